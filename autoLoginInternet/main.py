@@ -3,8 +3,11 @@ import time
 import re
 import json
 import logging
+import threading
 import websocket
-from typing import Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Any, Optional, Tuple
 
 # "serverIp2": "14.103.202.40"
 # Log configuration: append mode, UTF-8
@@ -18,12 +21,77 @@ logging.basicConfig(
 
 JSONP_RE = re.compile(r"[^(]+\((.*)\)\s*$")
 
+EPORTAL_URL = "http://10.160.63.9:801/eportal/"
+CONNECT_TIMEOUT = 3   # seconds; the eportal is on the LAN, a slow connect means it is down
+LOGIN_READ_TIMEOUT = 8
+LOGOUT_READ_TIMEOUT = 5
+
 def parse_jsonp(text: str) -> Dict[str, Any]:
     m = JSONP_RE.match(text)
     if not m:
         raise ValueError(f"Unable to parse response as JSONP: {text[:120]}...")
     return json.loads(m.group(1))
 
+class EportalClient:
+    """
+    Long-lived requests.Session for the eportal: keep-alive connections are shared by all
+    worker threads, so a burst of re-login commands reuses a few TCP connections instead of
+    connecting once per command. Also records per-request latency for stats().
+    """
+
+    def __init__(self, pool_size: int = 8, connect_timeout: float = CONNECT_TIMEOUT, max_samples: int = 512):
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=max_samples)
+        self.requests = 0
+        self.errors = 0
+
+    def get_jsonp(self, url: str, params: dict, read_timeout: float) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session.get(url, params=params, timeout=(self.connect_timeout, read_timeout))
+            resp.raise_for_status()
+            ok = True
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self.requests += 1
+                self.errors += not ok
+                self._latencies.append(elapsed)
+        return parse_jsonp(resp.text)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies)
+            requests_, errors = self.requests, self.errors
+
+        def pct(q):
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else 0.0
+
+        return {
+            "requests": requests_,
+            "errors": errors,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(lat[-1] * 1000, 1) if lat else 0.0,
+        }
+
+
+_eportal: Optional[EportalClient] = None
+
+
+def get_eportal() -> EportalClient:
+    global _eportal
+    if _eportal is None:
+        _eportal = EportalClient()
+    return _eportal
+
+
 def login_eportal(
         username: str,
         password: str,
@@ -31,9 +99,9 @@ def login_eportal(
         wlan_user_mac: str,
         wlan_ac_ip: str,
         wlan_ac_name: str,
-        base_url: str = "http://10.160.63.9:801/eportal/"
+        base_url: str = EPORTAL_URL,
+        client: Optional[EportalClient] = None,
 ) -> dict:
-    sess = requests.Session()
     ts = str(int(time.time() * 1000))
     params = {
         "c": "Portal",
@@ -49,15 +117,13 @@ def login_eportal(
         "callback": f"dr{ts}",
         "_": ts,
     }
-    resp = sess.get(base_url, params=params, timeout=10)
-    resp.raise_for_status()
-    return parse_jsonp(resp.text)
+    return (client or get_eportal()).get_jsonp(base_url, params, LOGIN_READ_TIMEOUT)
 
-def logout_campus(wlan_user_ip: str) -> Dict[str, Any]:
+def logout_campus(wlan_user_ip: str, client: Optional[EportalClient] = None) -> Dict[str, Any]:
     """
     Logout from campus network and return parsed JSON.
     """
-    base_url = "http://10.160.63.9:801/eportal/"
+    base_url = EPORTAL_URL
     now = int(time.time() * 1000)  # millisecond timestamp
 
     params = {
@@ -78,9 +144,7 @@ def logout_campus(wlan_user_ip: str) -> Dict[str, Any]:
         "_": now
     }
 
-    resp = requests.get(base_url, params=params, timeout=5)
-    resp.raise_for_status()
-    return parse_jsonp(resp.text)
+    return (client or get_eportal()).get_jsonp(base_url, params, LOGOUT_READ_TIMEOUT)
 
 def load_configs(path) -> list:
     """Load all login configurations from JSON file, return as list"""
@@ -121,17 +185,73 @@ def op_logout(wlan_user_ip,ws,email,username):
         logging.error(f"{username}: logout exception — {e}")
         ws.send(f"0:logout:0:{email}:{username}======{e}")
 
+class KeyedWorkerPool:
+    """
+    Bounded thread pool where tasks sharing a key run one at a time, in submission order,
+    while tasks for different keys run in parallel. At most max_pending tasks may be
+    queued or running; submit() returns False beyond that instead of blocking the caller.
+    """
+
+    def __init__(self, workers: int = 8, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="account")
+        self._lock = threading.Lock()
+        # key -> tasks waiting behind the one currently running for that key
+        self._queues: Dict[str, Deque[Tuple[Callable, tuple]]] = {}
+        self._pending = 0
+
+    def submit(self, key: str, fn: Callable, *args) -> bool:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            waiting = self._queues.get(key)
+            if waiting is not None:
+                waiting.append((fn, args))
+                return True
+            self._queues[key] = deque()
+        self._executor.submit(self._run, key, fn, args)
+        return True
+
+    def _run(self, key: str, fn: Callable, args: tuple):
+        try:
+            fn(*args)
+        except Exception as e:
+            logging.error(f"{key}: task exception — {e}")
+        with self._lock:
+            self._pending -= 1
+            waiting = self._queues[key]
+            if not waiting:
+                del self._queues[key]
+                return
+            fn, args = waiting.popleft()
+        # Re-queue instead of looping so one busy account cannot monopolise a worker
+        self._executor.submit(self._run, key, fn, args)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+
+def op_all(username, password, wlan_user_ip, wlan_user_mac, wlan_ac_ip, wlan_ac_name, email, ws):
+    op_logout(wlan_user_ip, ws, email, username)
+    op_login(username, password, wlan_user_ip, wlan_user_mac, wlan_ac_ip, wlan_ac_name, email, ws)
+
+
 class CampusAutoLoginClient:
-    def __init__(self, server_ip: str, max_retries: int = 12, retry_delay_sec: int = 3):
+    def __init__(self, server_ip: str, max_retries: int = 12, retry_delay_sec: int = 3,
+                 workers: int = 8, max_pending: int = 256):
         self.server_ip = server_ip
         self.max_retries = max_retries
         self.retry_delay_sec = retry_delay_sec
         self.ws: Optional[websocket.WebSocketApp] = None
         self.consecutive_failures = 0  # 连续连接失败计数
+        # Commands run off the websocket thread; one account's commands never interleave
+        self.pool = KeyedWorkerPool(workers, max_pending)
 
     # ===== WebSocket callbacks =====
     def on_open(self, ws):
-        logging.info("websocket connected")
+        logging.info(f"websocket connected, eportal stats={get_eportal().stats()}")
         # 成功建立连接，清零失败计数
         self.consecutive_failures = 0
 
@@ -152,16 +272,20 @@ class CampusAutoLoginClient:
         mtype = messageObj.get("type")
 
         if mtype == 'login':
-            op_login(username,password,wlan_user_ip,wlan_user_mac,wlan_ac_ip,wlan_ac_name,email,ws)
-
+            task = (op_login, username, password, wlan_user_ip, wlan_user_mac, wlan_ac_ip, wlan_ac_name, email, ws)
         elif mtype == 'logout':
-            op_logout(wlan_user_ip,ws,email,username)
-
-        elif mtype =='all':
-            op_logout(wlan_user_ip, ws, email, username)
-            op_login(username, password, wlan_user_ip, wlan_user_mac, wlan_ac_ip, wlan_ac_name, email, ws)
+            task = (op_logout, wlan_user_ip, ws, email, username)
+        elif mtype == 'all':
+            task = (op_all, username, password, wlan_user_ip, wlan_user_mac, wlan_ac_ip, wlan_ac_name, email, ws)
         else:
             logging.error(f"Received unknown message {message}")
+            return
+
+        key = username or wlan_user_ip
+        if not self.pool.submit(key, *task):
+            logging.error(f"{username}: command queue full ({self.pool.max_pending}), dropping {mtype}")
+            reply = "logout" if mtype == 'logout' else "login"
+            ws.send(f"{reply}:0:{email}:{username}======busy, too many pending commands, please retry later")
 
     def on_error(self, ws, error):
         logging.error(f"websocket error: {error}")
@@ -215,7 +339,26 @@ def main():
     server_ip = configs[0]["serverIp"]
     print(server_ip)
 
-    client = CampusAutoLoginClient(server_ip, max_retries=12, retry_delay_sec=3)
+    global _eportal
+    workers = int(configs[0].get("workers", 8))
+    # One pooled connection per worker is enough: each worker has at most one request in flight
+    _eportal = EportalClient(pool_size=workers)
+
+    client = CampusAutoLoginClient(
+        server_ip, max_retries=12, retry_delay_sec=3,
+        workers=workers,
+        max_pending=int(configs[0].get("maxPending", 256)),
+    )
+
+    stats_interval = float(configs[0].get("statsInterval", 600))
+    if stats_interval > 0:
+        def log_stats():
+            while True:
+                time.sleep(stats_interval)
+                logging.info(f"eportal stats={_eportal.stats()} pending={client.pool.pending()}")
+
+        threading.Thread(target=log_stats, daemon=True).start()
+
     client.run()
 
 if __name__ == "__main__":
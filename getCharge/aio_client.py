@@ -0,0 +1,146 @@
+# aio_client.py —— query_current_electricity 的 asyncio 版本（aiohttp），供 grpc.aio 服务使用
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+from dianfei_core import (
+    URL, logger, _begin_request_log, _rinfo, _parse_payload, _request_headers, _extract_value, _non_json_error,
+)
+from http_client import CONNECT_TIMEOUT, READ_TIMEOUT, KEEP_ALIVE, UpstreamCancelled, current_scope
+from metrics import STAGE_SECONDS, UPSTREAM_CANCELLED, UPSTREAM_INFLIGHT, UPSTREAM_RESPONSES
+
+# 单进程内同时在途的上游连接上限（异步模式下不再受线程数限制）
+AIO_POOL_SIZE = int(os.getenv("DIANFEI_AIO_POOL_SIZE", "200"))
+AIO_KEEPALIVE_TIMEOUT = float(os.getenv("DIANFEI_AIO_KEEPALIVE_TIMEOUT", "30"))
+
+
+class AsyncUpstreamClient:
+    """一个 aiohttp.ClientSession + 有界 TCPConnector；须在事件循环内创建和使用。"""
+
+    def __init__(
+        self,
+        pool_size: int = AIO_POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        keep_alive: bool = KEEP_ALIVE,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.requests = 0
+        self.errors = 0
+        self.inflight = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                force_close=not self.keep_alive,
+                keepalive_timeout=AIO_KEEPALIVE_TIMEOUT if self.keep_alive else None,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _timeout(self, timeout: Optional[float]) -> aiohttp.ClientTimeout:
+        if timeout is None:
+            return aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=self.read_timeout)
+        # 调用方给了总时限（如 gRPC 剩余时间）：整次请求不超过它
+        return aiohttp.ClientTimeout(total=timeout, connect=min(self.connect_timeout, timeout),
+                                     sock_read=min(self.read_timeout, timeout))
+
+    async def post_json(self, url: str, headers: Dict[str, str], data, timeout: Optional[float] = None):
+        """
+        POST 表单并返回 (status, elapsed 秒, 解析后的 JSON)；非 JSON 抛 ValueError。
+        timeout 缺省时取当前 CallScope 的剩余时间；已过截止时间、或因截止时间超时时抛 UpstreamCancelled。
+        """
+        clipped = False
+        scope = current_scope()
+        if timeout is None and scope is not None:
+            scope.check()
+            remaining = scope.remaining()
+            if remaining is not None and remaining < self.connect_timeout + self.read_timeout:
+                timeout, clipped = remaining, True
+        session = self._ensure_session()
+        self.requests += 1
+        self.inflight += 1
+        UPSTREAM_INFLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            async with session.post(url, headers=headers, data=data, timeout=self._timeout(timeout)) as resp:
+                text = await resp.text()
+                elapsed = time.perf_counter() - t0
+                STAGE_SECONDS.observe(elapsed, stage="upstream")
+                UPSTREAM_RESPONSES.inc(code=resp.status)
+                _rinfo("HTTP %s，耗时 %.3fs", resp.status, elapsed)
+                resp.raise_for_status()
+        except aiohttp.ClientResponseError:
+            self.errors += 1
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if clipped and isinstance(e, asyncio.TimeoutError):
+                UPSTREAM_CANCELLED.inc(reason="deadline", stage="inflight")
+                raise UpstreamCancelled("deadline") from e
+            self.errors += 1
+            UPSTREAM_RESPONSES.inc(code="error")
+            raise
+        except asyncio.CancelledError:
+            UPSTREAM_CANCELLED.inc(reason="cancelled", stage="inflight")
+            raise
+        finally:
+            self.inflight -= 1
+            UPSTREAM_INFLIGHT.dec()
+        try:
+            return resp.status, elapsed, json.loads(text)
+        except ValueError as e:
+            raise _non_json_error(text) from e
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "inflight": self.inflight,
+            "pool_size": self.pool_size,
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+_client: Optional[AsyncUpstreamClient] = None
+
+
+def get_async_client() -> AsyncUpstreamClient:
+    """返回进程内唯一的 AsyncUpstreamClient（只在 grpc.aio 的事件循环线程中使用）。"""
+    global _client
+    if _client is None:
+        _client = AsyncUpstreamClient()
+    return _client
+
+
+async def query_current_electricity_async(payload_json: str) -> float:
+    """与 dianfei_core.query_current_electricity 相同的流程与异常，只是上游请求不占线程。"""
+    _begin_request_log()
+    _rinfo("开始处理电量查询请求（async）")
+    logger.debug("原始输入 JSON：%r", payload_json)
+
+    with STAGE_SECONDS.time(stage="parse_input"):
+        payload = _parse_payload(payload_json)
+    with STAGE_SECONDS.time(stage="headers"):
+        headers = _request_headers()
+
+    _rinfo("向接口发起请求：%s", URL)
+    try:
+        _, _, data = await get_async_client().post_json(URL, headers, payload)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        logger.exception("请求接口失败")
+        raise
+    with STAGE_SECONDS.time(stage="parse_response"):
+        return _extract_value(data)
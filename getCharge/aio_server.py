@@ -0,0 +1,247 @@
+# aio_server.py —— grpc.aio 版本的 DianFeiService：上游请求走 aiohttp，不再受线程数限制
+import asyncio
+import contextvars
+import json
+import os
+import signal
+from typing import Tuple
+
+import grpc
+
+import dianfei_pb2
+import dianfei_pb2_grpc
+
+from aio_client import query_current_electricity_async, get_async_client
+from dianfei_core import logger
+from result_cache import AsyncResultCache, cache_key, SOURCE_STALE
+from room_catalog import AmbiguousRoom, RoomNotFound, get_catalog
+from metrics import (
+    METRICS_PORT, RPC_SECONDS, RPC_INFLIGHT, RPC_TOTAL, UPSTREAM_POOL, WARMUP, register_stats, start_metrics_server,
+)
+from service_common import (
+    BATCH_CONCURRENCY, BATCH_MAX_ITEMS, SWEEP_CONCURRENCY, SWEEP_MAX_CONCURRENCY, STATS_INTERVAL,
+    _request_to_payload, _abort_on_bad_room, _iter_sweep_rooms, _error_text, register_cache_metrics,
+    _record_reading, _history_reply, _consumption_reply, register_store_metrics, _stale_entry, _mark_stale,
+    _query_reply, server_options, SHUTDOWN_GRACE, _abort_cancelled, _persisted_reading, _ready_always,
+)
+from http_client import UpstreamCancelled, call_scope, check_current_scope, current_remaining
+from circuit_breaker import CircuitOpenError, get_guard
+from readings_store import get_store
+from warmup import make_warmup
+
+# 同时处理的 RPC 上限；超出时 gRPC 直接返回 RESOURCE_EXHAUSTED，保证内存有界
+AIO_MAX_CONCURRENT_RPCS = int(os.getenv("DIANFEI_AIO_MAX_CONCURRENT_RPCS", "1000"))
+
+
+class AioDianFeiServiceImpl(dianfei_pb2_grpc.DianFeiServiceServicer):
+    def __init__(self, cache: AsyncResultCache = None):
+        self.cache = cache if cache is not None else AsyncResultCache(
+            persisted=_persisted_reading, wait_check=check_current_scope, wait_timeout=current_remaining)
+
+    async def _query_entry(self, payload: dict):
+        """返回 (value, fetched_at, source)；SWR 模式下的后台刷新是事件循环里的一个任务。"""
+        payload_json = json.dumps(payload, ensure_ascii=False)
+
+        async def load():
+            value = await get_guard().call_async(lambda: query_current_electricity_async(payload_json))
+            return _record_reading(payload, float(value))
+
+        return await self.cache.get_or_load_entry_async(cache_key(payload), load)
+
+    async def _query(self, payload: dict) -> float:
+        return (await self._query_entry(payload))[0]
+
+    async def _query_safe(self, request_or_room):
+        try:
+            if isinstance(request_or_room, dianfei_pb2.QueryRequest):
+                payload = _request_to_payload(request_or_room)
+            else:
+                payload = request_or_room.payload()
+            return await self._query(payload), None
+        except Exception as e:
+            return None, e
+
+    async def QueryCurrentElectricity(self, request, context):
+        try:
+            payload = _request_to_payload(request)
+        except (RoomNotFound, AmbiguousRoom) as e:
+            await _abort_on_bad_room(context, e)
+        try:
+            # 上游请求的时限取调用方剩余时间；RPC 被取消时本任务被取消，
+            # 若它是该房间最后一个等待者，共享的上游请求也一并取消
+            with call_scope(context.time_remaining()):
+                val, fetched_at, source = await self._query_entry(payload)
+        except UpstreamCancelled as e:
+            await _abort_cancelled(context, e)
+        except CircuitOpenError as e:
+            entry = _stale_entry(self.cache, payload)
+            if entry is None:
+                await context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            (val, fetched_at), source = entry, SOURCE_STALE
+            _mark_stale(context, fetched_at)
+        return _query_reply(val, fetched_at, source)
+
+    async def QueryElectricityBatch(self, request, context):
+        items = list(request.items)
+        if len(items) > BATCH_MAX_ITEMS:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                                f"单批最多 {BATCH_MAX_ITEMS} 个房间，实际 {len(items)}")
+
+        sem = asyncio.Semaphore(max(BATCH_CONCURRENCY, 1))
+
+        async def one(item):
+            async with sem:
+                val, err = await self._query_safe(item)
+            if err is None:
+                return dianfei_pb2.RoomResult(request=item, ok=True, value=val)
+            logger.warning(f"批量查询中单个房间失败：room={item.room}，{_error_text(err)}")
+            return dianfei_pb2.RoomResult(request=item, ok=False, error=_error_text(err))
+
+        with call_scope(context.time_remaining()):
+            results = await asyncio.gather(*(one(item) for item in items))
+        return dianfei_pb2.BatchQueryReply(results=results)
+
+    async def SweepRooms(self, request, context):
+        limit = request.concurrency or SWEEP_CONCURRENCY
+        limit = max(1, min(limit, SWEEP_MAX_CONCURRENCY))
+        logger.info(f"开始扫描（async）：campus={request.campus!r} building={request.building!r} "
+                    f"prefix={request.name_prefix!r} concurrency={limit}")
+
+        rooms = _iter_sweep_rooms(request)
+        pending = {}
+        # 每个查询任务在带有调用方截止时间（CallScope）的上下文副本中运行
+        with call_scope(context.time_remaining()):
+            scoped = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+
+        def submit_next():
+            for room in rooms:
+                pending[loop.create_task(self._query_safe(room), context=scoped.copy())] = room
+                return
+
+        for _ in range(limit):
+            submit_next()
+        sent = failed = 0
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    room = pending.pop(task)
+                    val, err = task.result()
+                    req = dianfei_pb2.QueryRequest(name=room.name, **room.payload())
+                    if err is None:
+                        msg = dianfei_pb2.RoomResult(request=req, name=room.name, ok=True, value=val)
+                    else:
+                        failed += 1
+                        msg = dianfei_pb2.RoomResult(request=req, name=room.name, ok=False, error=_error_text(err))
+                    # await write 会在对端读得慢时挂起，从而限制在途数量
+                    await context.write(msg)
+                    sent += 1
+                    submit_next()
+        finally:
+            for task in pending:
+                task.cancel()
+        logger.info(f"扫描完成：共 {sent} 间，失败 {failed} 间")
+
+    async def _local_query(self, build_reply, request, context):
+        if get_store() is None:
+            await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "未启用本地读数存储（DIANFEI_READINGS_DB 为空）")
+        try:
+            # SQLite 查询放到默认线程池，避免阻塞事件循环
+            return await asyncio.get_running_loop().run_in_executor(None, build_reply, request)
+        except (RoomNotFound, AmbiguousRoom) as e:
+            await _abort_on_bad_room(context, e)
+
+    async def QueryHistory(self, request, context):
+        return await self._local_query(_history_reply, request, context)
+
+    async def QueryConsumption(self, request, context):
+        return await self._local_query(_consumption_reply, request, context)
+
+
+class _AioMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """与 server._MetricsInterceptor 相同的指标，异步 handler 版本。"""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit("/", 1)[-1]
+
+        if handler.unary_unary is not None:
+            inner = handler.unary_unary
+
+            async def unary_unary(request, context):
+                with RPC_INFLIGHT.track_inprogress(method=method), RPC_SECONDS.time(method=method):
+                    try:
+                        reply = await inner(request, context)
+                    except Exception:
+                        RPC_TOTAL.inc(method=method, code="error")
+                        raise
+                RPC_TOTAL.inc(method=method, code="ok")
+                return reply
+
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary, handler.request_deserializer, handler.response_serializer)
+
+        if handler.unary_stream is not None:
+            inner = handler.unary_stream
+
+            async def unary_stream(request, context):
+                with RPC_INFLIGHT.track_inprogress(method=method), RPC_SECONDS.time(method=method):
+                    try:
+                        await inner(request, context)
+                    except Exception:
+                        RPC_TOTAL.inc(method=method, code="error")
+                        raise
+                RPC_TOTAL.inc(method=method, code="ok")
+
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream, handler.request_deserializer, handler.response_serializer)
+        return handler
+
+
+async def _log_stats_forever(servicer: AioDianFeiServiceImpl, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"[stats] cache={servicer.cache.stats()} upstream={get_async_client().stats()} "
+                    f"breaker={get_guard().stats()}")
+
+
+async def serve_aio(host: str = "0.0.0.0", port: int = 50051, metrics_port: int = METRICS_PORT,
+                    reuseport: bool = False, on_started=None, shard: Tuple[int, int] = (0, 1)):
+    server = grpc.aio.server(interceptors=(_AioMetricsInterceptor(),),
+                             maximum_concurrent_rpcs=AIO_MAX_CONCURRENT_RPCS,
+                             options=server_options(reuseport))
+    servicer = AioDianFeiServiceImpl()
+    dianfei_pb2_grpc.add_DianFeiServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"{host}:{port}")
+
+    register_cache_metrics(servicer.cache)
+    register_store_metrics()
+    logger.info(f"房间目录已加载：{get_catalog().stats()}")
+    register_stats(UPSTREAM_POOL, lambda: get_async_client().stats(), ("requests", "errors", "inflight"))
+    loop = asyncio.get_running_loop()
+    # 启动预热：预热线程把查询交给本事件循环执行，走与正常请求相同的缓存 + 单飞 + 熔断 + 读数落库路径
+    warmup = make_warmup(lambda room: asyncio.run_coroutine_threadsafe(servicer._query(room), loop).result(),
+                         servicer.cache, shard=shard)
+    if warmup is not None:
+        register_stats(WARMUP, warmup.stats, ("rooms", "warmed", "failed", "ready"))
+    routes = {"/ready": warmup.ready_route if warmup is not None else _ready_always}
+    if start_metrics_server(host, metrics_port, routes=routes) is not None:
+        print(f"[metrics] http://{host}:{metrics_port}/metrics")
+    print(f"[gRPC/aio] DianFeiService listening on {host}:{port} (pid={os.getpid()})")
+    await server.start()
+    loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(server.stop(SHUTDOWN_GRACE)))
+    if warmup is not None:
+        warmup.start()
+    if on_started is not None:
+        # 交给调用方一个"在本事件循环里执行"的入口（supervisor 借它做健康心跳）
+        on_started(loop.call_soon_threadsafe)
+    stats_task = asyncio.ensure_future(_log_stats_forever(servicer, STATS_INTERVAL)) if STATS_INTERVAL > 0 else None
+    try:
+        await server.wait_for_termination()
+    finally:
+        if stats_task is not None:
+            stats_task.cancel()
+        await get_async_client().close()
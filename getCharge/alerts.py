@@ -0,0 +1,314 @@
+# alerts.py —— 低电量提醒：按 roomInfo.json 定时轮询关注的房间，低于阈值时按 email.json 发邮件
+#
+# email.json 中 room="-1" 的记录是阈值（度），其余记录的 email 为 "地址,称呼"，多个收件人用 ";" 分隔。
+# 同一房间每天最多提醒一次（alert_state.json 记录当天已提醒的房间）；同一收件人的多个房间合并成一封邮件。
+# 用法：
+#   python alerts.py --target 127.0.0.1:50051            # 常驻，每 DIANFEI_ALERT_INTERVAL 秒轮询一次
+#   python alerts.py --once --dry-run                    # 只轮询一次，邮件只写日志
+import argparse
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from typing import Callable, Dict, List, Tuple
+
+import grpc
+
+import dianfei_pb2
+import dianfei_pb2_grpc
+from dianfei_core import logger
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+ROOM_INFO_FILE = os.path.join(BASEDIR, "roomInfo.json")
+EMAIL_FILE = os.path.join(BASEDIR, "email.json")
+STATE_FILE = os.getenv("DIANFEI_ALERT_STATE", os.path.join(BASEDIR, "alert_state.json"))
+
+# 轮询间隔（秒）与抖动比例：实际间隔在 interval*(1±jitter) 之间，避免多个实例同时打上游
+ALERT_INTERVAL = float(os.getenv("DIANFEI_ALERT_INTERVAL", "3600"))
+ALERT_JITTER = float(os.getenv("DIANFEI_ALERT_JITTER", "0.1"))
+# 单次批量 RPC 最多带多少个房间（服务端 DIANFEI_BATCH_MAX_ITEMS 默认 1000）
+ALERT_BATCH_SIZE = int(os.getenv("DIANFEI_ALERT_BATCH_SIZE", "200"))
+ALERT_RPC_TIMEOUT = float(os.getenv("DIANFEI_ALERT_RPC_TIMEOUT", "60"))
+DEFAULT_THRESHOLD = 30.0
+
+# SMTP：未配置 DIANFEI_SMTP_HOST 时只写日志，不发邮件
+SMTP_HOST = os.getenv("DIANFEI_SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("DIANFEI_SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("DIANFEI_SMTP_SSL", "1") not in ("0", "false", "no")
+SMTP_USER = os.getenv("DIANFEI_SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("DIANFEI_SMTP_PASSWORD", "")
+SMTP_FROM = os.getenv("DIANFEI_SMTP_FROM", SMTP_USER)
+
+_PAYLOAD_FIELDS = ("campus", "building", "room", "feeitemid", "type", "level")
+
+Recipient = Tuple[str, str]  # (邮箱, 称呼)
+
+
+def _load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_recipients(text: str) -> List[Recipient]:
+    """'a@x.com,张三;b@y.com' -> [('a@x.com', '张三'), ('b@y.com', '')]"""
+    out = []
+    for part in str(text).split(";"):
+        addr, _, name = part.partition(",")
+        addr = addr.strip()
+        if addr:
+            out.append((addr, name.strip()))
+    return out
+
+
+def load_watch_list(room_path: str = ROOM_INFO_FILE, email_path: str = EMAIL_FILE):
+    """返回 (关注的房间列表, room -> 收件人列表, 阈值)。"""
+    rooms = [{k: str(r.get(k, "")) for k in _PAYLOAD_FIELDS} for r in _load_json(room_path)]
+    threshold = DEFAULT_THRESHOLD
+    recipients: Dict[str, List[Recipient]] = {}
+    for entry in _load_json(email_path):
+        room = str(entry.get("room", ""))
+        if room == "-1":
+            try:
+                threshold = float(entry.get("email", DEFAULT_THRESHOLD))
+            except (TypeError, ValueError):
+                logger.warning(f"email.json 中的阈值无法解析，使用默认 {DEFAULT_THRESHOLD}: {entry!r}")
+            continue
+        recipients.setdefault(room, []).extend(parse_recipients(entry.get("email", "")))
+    return rooms, recipients, threshold
+
+
+# —— 发送方式 ——
+class LogSender:
+    """只把邮件内容写进日志；未配置 SMTP 或 --dry-run 时使用。"""
+
+    def __init__(self):
+        self.sent: List[Tuple[str, str, str]] = []
+
+    def send(self, to: Recipient, subject: str, body: str):
+        self.sent.append((to[0], subject, body))
+        logger.info(f"[alert] (未发送) to={to[0]} subject={subject}\n{body}")
+
+
+class SmtpSender:
+    """
+    通过 SMTP 发信；每次 send 建一次连接（提醒很少，不值得保持长连接）。
+    use_ssl=False 时走明文 SMTP，可直接对接本地测试用的 SMTP 桩（如 python -m aiosmtpd -n）。
+    """
+
+    def __init__(self, host: str, port: int, user: str = "", password: str = "", sender: str = "",
+                 use_ssl: bool = True, timeout: float = 15.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+
+    def send(self, to: Recipient, subject: str, body: str):
+        msg = MIMEText(body, "plain", "utf-8")
+        msg["Subject"] = Header(subject, "utf-8")
+        msg["From"] = self.sender
+        msg["To"] = formataddr((str(Header(to[1], "utf-8")), to[0])) if to[1] else to[0]
+        cls = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        with cls(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.user:
+                smtp.login(self.user, self.password)
+            smtp.sendmail(self.sender, [to[0]], msg.as_string())
+
+
+def make_sender(dry_run: bool = False):
+    if dry_run or not SMTP_HOST:
+        return LogSender()
+    return SmtpSender(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM, SMTP_SSL)
+
+
+# —— 去重状态 ——
+class AlertState:
+    """记录当天已提醒过的房间；日期变化后自动清空。每次修改后原子落盘。"""
+
+    def __init__(self, path: str = STATE_FILE):
+        self.path = path
+        self.day = ""
+        self.alerted: Dict[str, float] = {}
+        if path and os.path.exists(path):
+            try:
+                data = _load_json(path)
+                self.day = data.get("day", "")
+                self.alerted = data.get("alerted", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"提醒状态文件 {path} 无法读取，忽略: {e}")
+
+    @staticmethod
+    def today() -> str:
+        return time.strftime("%Y-%m-%d")
+
+    def _roll(self):
+        today = self.today()
+        if self.day != today:
+            self.day, self.alerted = today, {}
+
+    def should_alert(self, room: str) -> bool:
+        self._roll()
+        return room not in self.alerted
+
+    def mark(self, room: str, value: float):
+        self._roll()
+        self.alerted[room] = value
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"day": self.day, "alerted": self.alerted}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+# —— 轮询 ——
+def make_grpc_poller(target: str, batch_size: int = ALERT_BATCH_SIZE, timeout: float = ALERT_RPC_TIMEOUT):
+    """
+    返回 poll(rooms) -> {room: value 或 Exception}。
+    用 QueryElectricityBatch，服务端在一个批次内并发查询上游，不再一间一间地调。
+    """
+    stub = dianfei_pb2_grpc.DianFeiServiceStub(grpc.insecure_channel(target))
+
+    def poll(rooms: List[dict]) -> Dict[str, object]:
+        out: Dict[str, object] = {}
+        for i in range(0, len(rooms), max(batch_size, 1)):
+            chunk = rooms[i:i + batch_size]
+            try:
+                reply = stub.QueryElectricityBatch(
+                    dianfei_pb2.BatchQueryRequest(items=[dianfei_pb2.QueryRequest(**r) for r in chunk]),
+                    timeout=timeout)
+            except grpc.RpcError as e:
+                for r in chunk:
+                    out[r["room"]] = e
+                continue
+            for res in reply.results:
+                out[res.request.room] = res.value if res.ok else RuntimeError(res.error)
+        return out
+
+    return poll
+
+
+def _room_label(room: dict) -> str:
+    try:
+        from room_catalog import get_catalog
+        hit = get_catalog().get(room["campus"], room["building"], room["room"])
+    except Exception:
+        hit = None
+    return hit.name if hit is not None else room["room"]
+
+
+def compose(to: Recipient, lows: List[Tuple[dict, float]], threshold: float) -> Tuple[str, str]:
+    who = to[1] or to[0]
+    subject = f"电费余额提醒：{len(lows)} 个房间低于 {threshold:g} 度" if len(lows) > 1 \
+        else f"电费余额提醒：{_room_label(lows[0][0])} 剩余 {lows[0][1]:g} 度"
+    lines = [f"{who}，你好：", "", f"以下房间的剩余电量已低于 {threshold:g} 度，请及时充值：", ""]
+    for room, value in lows:
+        lines.append(f"  {_room_label(room)}（{room['campus']}/{room['building']}/{room['room']}）：{value:g} 度")
+    lines += ["", time.strftime("%Y-%m-%d %H:%M")]
+    return subject, "\n".join(lines)
+
+
+class AlertScheduler:
+    def __init__(self, poll: Callable[[List[dict]], Dict[str, object]], sender, state: AlertState,
+                 room_path: str = ROOM_INFO_FILE, email_path: str = EMAIL_FILE,
+                 interval: float = ALERT_INTERVAL, jitter: float = ALERT_JITTER):
+        self.poll = poll
+        self.sender = sender
+        self.state = state
+        self.room_path = room_path
+        self.email_path = email_path
+        self.interval = interval
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self._stop = threading.Event()
+
+    def run_once(self) -> Dict[str, int]:
+        """轮询一轮并发送提醒，返回本轮统计。配置文件每轮重新读取，修改后无需重启。"""
+        rooms, recipients, threshold = load_watch_list(self.room_path, self.email_path)
+        results = self.poll(rooms)
+
+        by_recipient: Dict[str, Tuple[Recipient, List[Tuple[dict, float]]]] = {}
+        low = errors = skipped = 0
+        for room in rooms:
+            val = results.get(room["room"])
+            if val is None or isinstance(val, Exception):
+                errors += 1
+                logger.warning(f"[alert] 查询失败：room={room['room']} {val}")
+                continue
+            if val >= threshold:
+                continue
+            low += 1
+            if not self.state.should_alert(room["room"]):
+                skipped += 1
+                continue
+            for to in recipients.get(room["room"], ()):
+                by_recipient.setdefault(to[0], (to, []))[1].append((room, val))
+
+        sent = failed = 0
+        for to, lows in by_recipient.values():
+            subject, body = compose(to, lows, threshold)
+            try:
+                self.sender.send(to, subject, body)
+            except Exception as e:
+                failed += 1
+                logger.error(f"[alert] 发送失败：to={to[0]} {type(e).__name__}: {e}")
+                continue
+            sent += 1
+            for room, val in lows:
+                self.state.mark(room["room"], val)
+        if sent:
+            self.state.save()
+
+        stats = {"rooms": len(rooms), "low": low, "already_alerted": skipped, "errors": errors,
+                 "emails_sent": sent, "emails_failed": failed}
+        logger.info(f"[alert] 本轮完成：{stats}")
+        return stats
+
+    def next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run_forever(self):
+        # 首轮也随机推迟一点，多个实例同时启动时不会一起打上游
+        delay = random.uniform(0, self.interval * self.jitter)
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[alert] 本轮异常：{type(e).__name__}: {e}")
+            delay = self.next_delay()
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="低电量提醒")
+    parser.add_argument("--target", default=os.getenv("DIANFEI_ALERT_TARGET", "127.0.0.1:50051"),
+                        help="DianFeiService 地址")
+    parser.add_argument("--interval", type=float, default=ALERT_INTERVAL, help="轮询间隔（秒）")
+    parser.add_argument("--jitter", type=float, default=ALERT_JITTER, help="间隔抖动比例（0~1）")
+    parser.add_argument("--rooms", default=ROOM_INFO_FILE)
+    parser.add_argument("--emails", default=EMAIL_FILE)
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--once", action="store_true", help="只轮询一轮后退出")
+    parser.add_argument("--dry-run", action="store_true", help="不发邮件，只写日志")
+    args = parser.parse_args()
+
+    scheduler = AlertScheduler(make_grpc_poller(args.target), make_sender(args.dry_run), AlertState(args.state),
+                               args.rooms, args.emails, args.interval, args.jitter)
+    if args.once:
+        print(json.dumps(scheduler.run_once(), ensure_ascii=False))
+    else:
+        scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# bench.py —— DianFeiService 压测：固定并发下的 QPS、p50/p95/p99 延迟与错误数，结果存为 JSON
+#
+# 用法：
+#   # 连已启动的服务
+#   python bench.py --target 127.0.0.1:50051 --concurrency 1,8,32 --duration 20
+#   # 在本机起 mock 上游 + server.py 子进程后压测（不访问学校接口）
+#   python bench.py --local --mock-latency-ms 80 --concurrency 1,8,32,128 --out bench_result.json
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import grpc
+
+import dianfei_pb2
+import dianfei_pb2_grpc
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ("campus", "building", "room", "feeitemid", "type", "level")
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[idx]
+
+
+def _load_requests(path: str, limit: int) -> List[dianfei_pb2.QueryRequest]:
+    with open(path, "r", encoding="utf-8") as f:
+        rooms = json.load(f)
+    if limit and limit < len(rooms):
+        rooms = random.Random(0).sample(rooms, limit)
+    return [dianfei_pb2.QueryRequest(**{k: str(r.get(k, "")) for k in FIELDS}) for r in rooms]
+
+
+def run_level(stub, reqs, concurrency: int, duration: float, rpc: str, batch_size: int, timeout: float) -> Dict:
+    """在给定并发下持续压 duration 秒，返回该档位的统计。"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    rooms_done = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        local_lat, local_err, local_rooms = [], {}, 0
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                if rpc == "batch":
+                    items = [reqs[rng.randrange(len(reqs))] for _ in range(batch_size)]
+                    reply = stub.QueryElectricityBatch(dianfei_pb2.BatchQueryRequest(items=items), timeout=timeout)
+                    bad = sum(1 for r in reply.results if not r.ok)
+                    if bad:
+                        local_err["room_error"] = local_err.get("room_error", 0) + bad
+                    local_rooms += len(items)
+                else:
+                    stub.QueryCurrentElectricity(reqs[rng.randrange(len(reqs))], timeout=timeout)
+                    local_rooms += 1
+            except grpc.RpcError as e:
+                name = e.code().name
+                local_err[name] = local_err.get(name, 0) + 1
+            local_lat.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local_lat)
+            rooms_done[0] += local_rooms
+            for k, v in local_err.items():
+                errors[k] = errors.get(k, 0) + v
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t_start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "rpc": rpc,
+        "calls": len(latencies),
+        "rooms": rooms_done[0],
+        "duration_s": round(wall, 3),
+        "qps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "rooms_per_s": round(rooms_done[0] / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p95": round(_percentile(latencies, 95) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+        },
+        "errors": errors,
+        "error_count": sum(errors.values()),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_local(args):
+    """起 mock 上游（本进程线程）和 server.py（子进程），返回 (target, 子进程, mock)。"""
+    from mock_upstream import MockConfig, PATH, start_mock
+
+    mock = start_mock(config=MockConfig(args.mock_latency_ms, args.mock_jitter_ms, args.mock_error_rate,
+                                        args.mock_stall_rate, args.mock_stall_ms, seed=0))
+    port, metrics_port = _free_port(), _free_port()
+    env = dict(os.environ)
+    env["DIANFEI_UPSTREAM_URL"] = f"http://127.0.0.1:{mock.server_port}{PATH}"
+    for kv in args.server_env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BASEDIR, "server.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--metrics-port", str(metrics_port)] + args.server_args,
+        env=env, cwd=BASEDIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    target = f"127.0.0.1:{port}"
+    print(f"[bench] server.py pid={proc.pid} metrics=http://127.0.0.1:{metrics_port}/metrics")
+    grpc.channel_ready_future(grpc.insecure_channel(target)).result(timeout=30)
+    return target, proc, mock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DianFeiService 压测")
+    parser.add_argument("--target", default="127.0.0.1:50051")
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发档位")
+    parser.add_argument("--duration", type=float, default=10.0, help="每档持续秒数")
+    parser.add_argument("--warmup", type=float, default=1.0, help="每档正式计时前的预热秒数")
+    parser.add_argument("--rpc", choices=("unary", "batch"), default="unary")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--rooms-file", default=os.path.join(BASEDIR, "rooms_all.json"))
+    parser.add_argument("--rooms", type=int, default=0, help="只用随机抽取的 N 个房间（0 表示全部）")
+    parser.add_argument("--timeout", type=float, default=15.0, help="单次 RPC 超时")
+    parser.add_argument("--out", default="bench_result.json")
+    parser.add_argument("--label", default="", help="写入结果的备注，便于对比不同改动")
+    local = parser.add_argument_group("本地模式（mock 上游 + server.py 子进程）")
+    local.add_argument("--local", action="store_true")
+    local.add_argument("--mock-latency-ms", type=float, default=50.0)
+    local.add_argument("--mock-jitter-ms", type=float, default=0.0)
+    local.add_argument("--mock-error-rate", type=float, default=0.0)
+    local.add_argument("--mock-stall-rate", type=float, default=0.0)
+    local.add_argument("--mock-stall-ms", type=float, default=3000.0)
+    local.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                       help="传给 server.py 的环境变量，如 DIANFEI_CACHE_TTL=0")
+    local.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                       help="其余参数原样传给 server.py，如 --mode aio")
+    args = parser.parse_args()
+
+    proc = mock = None
+    target = args.target
+    if args.local:
+        target, proc, mock = _start_local(args)
+    try:
+        reqs = _load_requests(args.rooms_file, args.rooms)
+        stub = dianfei_pb2_grpc.DianFeiServiceStub(grpc.insecure_channel(target))
+        levels = []
+        for c in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+            if args.warmup > 0:
+                run_level(stub, reqs, c, args.warmup, args.rpc, args.batch_size, args.timeout)
+            res = run_level(stub, reqs, c, args.duration, args.rpc, args.batch_size, args.timeout)
+            lat = res["latency_ms"]
+            print(f"c={c:<4} qps={res['qps']:<9} p50={lat['p50']}ms p95={lat['p95']}ms "
+                  f"p99={lat['p99']}ms errors={res['error_count']}")
+            levels.append(res)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if mock is not None:
+            mock.shutdown()
+
+    result = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": "local" if args.local else target,
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("server_args",)},
+        "levels": levels,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: catalog.proto
+# Protobuf Python Version: 6.31.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    6,
+    31,
+    1,
+    '',
+    'catalog.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rcatalog.proto\x12\x07\x64ianfei\"=\n\x0bRoomProfile\x12\x11\n\tfeeitemid\x18\x01 \x01(\t\x12\x0c\n\x04type\x18\x02 \x01(\t\x12\r\n\x05level\x18\x03 \x01(\t\"\'\n\x08\x42uilding\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\"K\n\x06\x43\x61mpus\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12$\n\tbuildings\x18\x03 \x03(\x0b\x32\x11.dianfei.Building\"\x9d\x02\n\x0bRoomCatalog\x12\x0f\n\x07version\x18\x01 \x01(\r\x12\x12\n\nrooms_sha1\x18\x02 \x01(\t\x12\x13\n\x0b\x63\x61mpus_sha1\x18\x03 \x01(\t\x12\x14\n\x0c\x63\x61mpus_codes\x18\x04 \x03(\t\x12\x16\n\x0e\x62uilding_codes\x18\x05 \x03(\t\x12&\n\x08profiles\x18\x06 \x03(\x0b\x32\x14.dianfei.RoomProfile\x12\x12\n\ncampus_ids\x18\x07 \x03(\r\x12\x14\n\x0c\x62uilding_ids\x18\x08 \x03(\r\x12\x13\n\x0bprofile_ids\x18\t \x03(\r\x12\r\n\x05rooms\x18\n \x03(\t\x12\r\n\x05names\x18\x0b \x03(\t\x12!\n\x08\x63\x61mpuses\x18\x0c \x03(\x0b\x32\x0f.dianfei.Campusb\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'catalog_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_ROOMPROFILE']._serialized_start=26
+  _globals['_ROOMPROFILE']._serialized_end=87
+  _globals['_BUILDING']._serialized_start=89
+  _globals['_BUILDING']._serialized_end=128
+  _globals['_CAMPUS']._serialized_start=130
+  _globals['_CAMPUS']._serialized_end=205
+  _globals['_ROOMCATALOG']._serialized_start=208
+  _globals['_ROOMCATALOG']._serialized_end=493
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,171 @@
+# catalog_snapshot.py —— rooms_all.json + campus.json <-> 二进制快照 rooms_catalog.pb（catalog.proto）
+#
+# JSON 仍是可手工编辑的源文件；快照记录两个 JSON 的 sha1，内容对不上时自动退回解析 JSON。
+# 用法：
+#   python catalog_snapshot.py export          # 由 JSON 生成快照
+#   python catalog_snapshot.py import          # 由快照还原 JSON（rooms_all.json / campus.json）
+#   python catalog_snapshot.py bench           # 对比两种加载方式的耗时
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+import catalog_pb2
+from room_catalog import BASEDIR, ROOMS_FILE, RoomCatalog
+
+CAMPUS_FILE = os.path.join(BASEDIR, "campus.json")
+SNAPSHOT_FILE = os.getenv("DIANFEI_CATALOG_SNAPSHOT", os.path.join(BASEDIR, "rooms_catalog.pb"))
+SNAPSHOT_VERSION = 1
+
+
+def _sha1_file(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_snapshot(cat: RoomCatalog, campuses: list, rooms_sha1: str = "", campus_sha1: str = ""):
+    """由已加载的 RoomCatalog 和 campus.json 内容构造 RoomCatalog 消息。"""
+    msg = catalog_pb2.RoomCatalog(version=SNAPSHOT_VERSION, rooms_sha1=rooms_sha1, campus_sha1=campus_sha1)
+    msg.campus_codes.extend(cat._campuses.values)
+    msg.building_codes.extend(cat._buildings.values)
+    for feeitemid, type_, level in cat._profiles.values:
+        msg.profiles.add(feeitemid=feeitemid, type=type_, level=level)
+    msg.campus_ids.extend(cat._campus_col)
+    msg.building_ids.extend(cat._building_col)
+    msg.profile_ids.extend(cat._profile_col)
+    msg.rooms.extend(cat._room_col)
+    msg.names.extend(cat._name_col)
+    for c in campuses:
+        pc = msg.campuses.add(name=str(c.get("name", "")), value=str(c.get("value", "")))
+        for b in c.get("buildings", []):
+            pc.buildings.add(name=str(b.get("name", "")), value=str(b.get("value", "")))
+    return msg
+
+
+def export_snapshot(rooms_path: str = ROOMS_FILE, campus_path: str = CAMPUS_FILE,
+                    out_path: str = SNAPSHOT_FILE) -> int:
+    """读 JSON，写快照（临时文件 + os.replace），返回写入的字节数。"""
+    cat = RoomCatalog.load(rooms_path)
+    campuses = []
+    if os.path.exists(campus_path):
+        with open(campus_path, "r", encoding="utf-8") as f:
+            campuses = json.load(f)
+    data = build_snapshot(cat, campuses, _sha1_file(rooms_path), _sha1_file(campus_path)).SerializeToString()
+    tmp = f"{out_path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, out_path)
+    return len(data)
+
+
+def read_snapshot(path: str = SNAPSHOT_FILE):
+    msg = catalog_pb2.RoomCatalog()
+    with open(path, "rb") as f:
+        msg.ParseFromString(f.read())
+    if msg.version != SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本 {msg.version} 不支持（期望 {SNAPSHOT_VERSION}）")
+    return msg
+
+
+def catalog_from_snapshot(msg, source: str = "") -> RoomCatalog:
+    return RoomCatalog.from_columns(
+        msg.campus_codes, msg.building_codes,
+        [(p.feeitemid, p.type, p.level) for p in msg.profiles],
+        msg.campus_ids, msg.building_ids, msg.profile_ids,
+        msg.rooms, msg.names, source=source,
+    )
+
+
+def campuses_from_snapshot(msg) -> list:
+    """还原成与 campus.json 相同的结构。"""
+    return [
+        {"name": c.name, "value": c.value,
+         "buildings": [{"name": b.name, "value": b.value} for b in c.buildings]}
+        for c in msg.campuses
+    ]
+
+
+def load_snapshot(path: str = SNAPSHOT_FILE) -> Tuple[RoomCatalog, list]:
+    t0 = time.perf_counter()
+    msg = read_snapshot(path)
+    cat = catalog_from_snapshot(msg, source=path)
+    cat.load_seconds = time.perf_counter() - t0
+    return cat, campuses_from_snapshot(msg)
+
+
+def _fresh_snapshot(rooms_path: str, snapshot_path: str) -> Optional[RoomCatalog]:
+    """快照存在且 rooms_sha1 与当前 rooms_all.json 一致时返回目录，否则返回 None。"""
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        t0 = time.perf_counter()
+        msg = read_snapshot(snapshot_path)
+        if os.path.exists(rooms_path) and msg.rooms_sha1 != _sha1_file(rooms_path):
+            return None
+        cat = catalog_from_snapshot(msg, source=snapshot_path)
+        cat.load_seconds = time.perf_counter() - t0
+        return cat
+    except Exception as e:
+        print(f"WARN 快照 {snapshot_path} 无法使用，改读 JSON: {e}")
+        return None
+
+
+def load_catalog(rooms_path: str = ROOMS_FILE, snapshot_path: str = SNAPSHOT_FILE) -> RoomCatalog:
+    """优先用与 JSON 一致的快照；快照缺失/过期/损坏时解析 rooms_all.json。"""
+    cat = _fresh_snapshot(rooms_path, snapshot_path)
+    return cat if cat is not None else RoomCatalog.load(rooms_path)
+
+
+def import_snapshot(path: str = SNAPSHOT_FILE, rooms_path: str = ROOMS_FILE, campus_path: str = CAMPUS_FILE):
+    """由快照还原两个 JSON 文件（格式与 fetch_rooms.py 的输出一致）。"""
+    cat, campuses = load_snapshot(path)
+    rooms: List[dict] = [
+        {"feeitemid": r.feeitemid, "type": r.type, "level": r.level,
+         "campus": r.campus, "building": r.building, "room": r.room, "name": r.name}
+        for r in cat
+    ]
+    for out, obj in ((rooms_path, rooms), (campus_path, campuses)):
+        tmp = f"{out}.tmp.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, out)
+    return len(rooms), len(campuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房间目录二进制快照")
+    parser.add_argument("action", choices=("export", "import", "bench"))
+    parser.add_argument("--rooms", default=ROOMS_FILE)
+    parser.add_argument("--campus", default=CAMPUS_FILE)
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE)
+    args = parser.parse_args()
+
+    if args.action == "export":
+        size = export_snapshot(args.rooms, args.campus, args.snapshot)
+        print(f"WROTE -> {args.snapshot} ({size} bytes, json={os.path.getsize(args.rooms)} bytes)")
+    elif args.action == "import":
+        n_rooms, n_campus = import_snapshot(args.snapshot, args.rooms, args.campus)
+        print(f"WROTE -> {args.rooms} ({n_rooms} rooms), {args.campus} ({n_campus} campuses)")
+    else:
+        json_cat = RoomCatalog.load(args.rooms)
+        snap_cat, _ = load_snapshot(args.snapshot)
+        print(json.dumps({
+            "rooms": len(snap_cat),
+            "json_load_seconds": round(json_cat.load_seconds, 4),
+            "snapshot_load_seconds": round(snap_cat.load_seconds, 4),
+            "json_bytes": os.path.getsize(args.rooms),
+            "snapshot_bytes": os.path.getsize(args.snapshot),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# circuit_breaker.py —— 上游（getThirdData）熔断、重试预算与带抖动的退避
+#
+# - 熔断：最近 BREAKER_WINDOW 秒内调用数 >= BREAKER_MIN_CALLS 且失败率 >= BREAKER_FAILURE_RATE 时打开，
+#   打开期间直接抛 CircuitOpenError（不占线程等 10 秒超时）；BREAKER_OPEN_SECONDS 后半开，
+#   只放一个探测请求，成功则关闭，失败则重新打开。
+# - 重试：只对超时/连接错误/5xx 重试，最多 UPSTREAM_RETRIES 次，退避为 full jitter；
+#   每次首发请求往预算里存 RETRY_BUDGET_RATIO 个令牌，每次重试取 1 个，上游出问题时重试量不会放大到数倍。
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+import requests
+
+from http_client import UpstreamCancelled
+from metrics import BREAKER_EVENTS, BREAKER_STATE
+
+BREAKER_WINDOW = float(os.getenv("DIANFEI_BREAKER_WINDOW", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("DIANFEI_BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("DIANFEI_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("DIANFEI_BREAKER_OPEN_SECONDS", "15"))
+UPSTREAM_RETRIES = int(os.getenv("DIANFEI_UPSTREAM_RETRIES", "2"))
+RETRY_BUDGET_RATIO = float(os.getenv("DIANFEI_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BACKOFF = float(os.getenv("DIANFEI_RETRY_BACKOFF", "0.2"))        # 首次重试的退避上限（秒）
+RETRY_BACKOFF_MAX = float(os.getenv("DIANFEI_RETRY_BACKOFF_MAX", "2"))  # 退避上限（秒）
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开，未请求上游。retry_after 为预计可再次尝试的秒数。"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"上游熔断中，约 {retry_after:.1f}s 后重试")
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(e: BaseException) -> bool:
+    """超时、连接错误和 5xx 视为上游故障；4xx、返回内容解析失败等说明上游是通的，不计入。"""
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (requests.RequestException, aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    def __init__(self, window: float = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.window = window
+        self.min_calls = max(min_calls, 1)
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._calls: "deque[tuple]" = deque()  # (monotonic 时间, 是否失败)
+        self._failures = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = self.rejected = 0
+        BREAKER_STATE.set(0)
+
+    def _set_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUE[state])
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, failed = self._calls.popleft()
+            self._failures -= failed
+
+    def allow(self):
+        """请求上游前调用；不允许时抛 CircuitOpenError。"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            retry_after = max(self._opened_at + self.open_seconds - now, 0.0)
+        BREAKER_EVENTS.inc(event="rejected")
+        raise CircuitOpenError(retry_after)
+
+    def record(self, failed: bool):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._calls.clear()
+                    self._failures = 0
+                    self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                return
+            self._calls.append((now, failed))
+            self._failures += failed
+            self._trim(now)
+            total = len(self._calls)
+            if total >= self.min_calls and self._failures / total >= self.failure_rate:
+                self._open(now)
+
+    def cancel(self):
+        """调用被取消（结果未知）：不计入统计，只让出半开探测名额。"""
+        with self._lock:
+            self._probing = False
+
+    def _open(self, now: float):
+        self._opened_at = now
+        self._set_state(OPEN)
+        self.opened += 1
+        BREAKER_EVENTS.inc(event="opened")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            self._trim(time.monotonic())
+            total = len(self._calls)
+            return {
+                "state": self.state,
+                "window_calls": total,
+                "window_failure_rate": round(self._failures / total, 3) if total else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class RetryBudget:
+    """首发请求按 ratio 存入令牌（最多 max_balance），每次重试消耗 1 个；initial 为初始余额（缺省为满）。"""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, max_balance: float = 10.0,
+                 initial: Optional[float] = None):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self._balance = max_balance if initial is None else min(initial, max_balance)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.max_balance)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BACKOFF, cap: float = RETRY_BACKOFF_MAX) -> float:
+    """第 attempt 次重试（从 1 开始）前的等待：[0, min(cap, base * 2^(attempt-1))] 内均匀随机。"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class UpstreamGuard:
+    """把熔断器和重试预算组合起来，包住一次上游调用（同步与 asyncio 两个版本）。"""
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None, budget: Optional[RetryBudget] = None,
+                 retries: int = UPSTREAM_RETRIES):
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.retries = retries
+        self.retried = self.budget_exhausted = 0
+        self._lock = threading.Lock()
+
+    def _should_retry(self, e: BaseException, attempt: int) -> bool:
+        if attempt > self.retries or not is_upstream_failure(e):
+            return False
+        if not self.budget.try_withdraw():
+            with self._lock:
+                self.budget_exhausted += 1
+            BREAKER_EVENTS.inc(event="retry_budget_exhausted")
+            return False
+        with self._lock:
+            self.retried += 1
+        BREAKER_EVENTS.inc(event="retry")
+        return True
+
+    def call(self, fn: Callable[[], T]) -> T:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            try:
+                result = fn()
+            except UpstreamCancelled:
+                # 调用方放弃，结果未知：与 asyncio 版本的 CancelledError 同样处理
+                self.breaker.cancel()
+                raise
+            except Exception as e:
+                self.breaker.record(is_upstream_failure(e))
+                attempt += 1
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            self.breaker.record(False)
+            return result
+
+    async def call_async(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            try:
+                result = await fn()
+            except (asyncio.CancelledError, UpstreamCancelled):
+                self.breaker.cancel()
+                raise
+            except Exception as e:
+                self.breaker.record(is_upstream_failure(e))
+                attempt += 1
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            self.breaker.record(False)
+            return result
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counts = {"retried": self.retried, "retry_budget_exhausted": self.budget_exhausted}
+        return {**self.breaker.stats(), **counts}
+
+
+_guard: Optional[UpstreamGuard] = None
+_guard_lock = threading.Lock()
+
+
+def get_guard() -> UpstreamGuard:
+    """进程内共享的上游熔断/重试（线程模式与 aio 模式共用同一份状态）。"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = UpstreamGuard()
+    return _guard
@@ -1,78 +1,129 @@
+import atexit
+import contextvars
 import json
 import os
+import queue
+import random
 import re
 import requests
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from typing import Dict, Any
 
-# —— 固定接口与目录 ——
-URL = "https://wxxyshall.usts.edu.cn/charge/feeitem/getThirdData"
+from http_client import get_client
+from hedge import HEDGE_ENABLED, get_hedger
+from header_provider import get_provider, _mask, _redact_headers  # noqa: F401
+from metrics import LOG_DROPPED, STAGE_SECONDS, UPSTREAM_INFLIGHT, UPSTREAM_RESPONSES
+
+# —— 接口与目录（压测时可用 DIANFEI_UPSTREAM_URL 指向 mock_upstream.py） ——
+URL = os.getenv("DIANFEI_UPSTREAM_URL", "https://wxxyshall.usts.edu.cn/charge/feeitem/getThirdData")
 BASEDIR = os.path.dirname(__file__)
 
 # —— 日志配置（文件滚动 + 控制台） ——
 LOG_PATH = os.path.join(BASEDIR, "GetDianfei.log")
+LOG_LEVEL = os.getenv("DIANFEI_LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("DIANFEI_LOG_MAX_BYTES", "1000000"))
+# 异步模式：RPC 线程只把记录放进队列，由后台线程格式化并写文件/控制台
+LOG_ASYNC = os.getenv("DIANFEI_LOG_ASYNC", "0") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("DIANFEI_LOG_QUEUE_SIZE", "10000"))
+# 逐请求 INFO 日志的采样比例：未被采样的请求这些行降为 DEBUG（错误/告警不受影响）
+LOG_SAMPLE_RATE = float(os.getenv("DIANFEI_LOG_SAMPLE_RATE", "1.0"))
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃记录并计数，绝不阻塞调用线程。"""
+
+    def prepare(self, record):
+        # 队列在进程内，不需要可 pickle：原样入队，%-格式化、异常堆栈格式化都留给后台线程
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
 logger = logging.getLogger("dianfei")
-logger.setLevel(logging.INFO)
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+_log_listener = None
+_log_handlers = ()
 if not logger.handlers:
     fmt = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S")
-    fh = RotatingFileHandler(LOG_PATH, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
+    # delay：首次写入时才打开文件；多进程模式的工作进程改走 log_to_queue()，从不打开它
+    fh = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=3, encoding="utf-8", delay=True)
     fh.setFormatter(fmt)
     ch = logging.StreamHandler()
     ch.setFormatter(fmt)
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-
-def _mask(s: str, keep_head: int = 6, keep_tail: int = 4) -> str:
-    """打码敏感信息：保留前 keep_head、后 keep_tail，其余用*。"""
-    if s is None:
-        return ""
-    if len(s) <= keep_head + keep_tail:
-        return "*" * len(s)
-    return s[:keep_head] + "*" * (len(s) - keep_head - keep_tail) + s[-keep_tail:]
-
-def _redact_headers(hdr: Dict[str, str]) -> Dict[str, str]:
-    """对可能敏感的头做打码（仅用于日志展示）。"""
-    redacted = dict(hdr)
-    for key in list(redacted.keys()):
-        k_low = key.lower()
-        if any(t in k_low for t in ("cookie", "authorization", "token", "auth")):
-            redacted[key] = _mask(str(redacted[key]))
-    return redacted
+    _log_handlers = (fh, ch)
+    if LOG_ASYNC:
+        _log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        logger.addHandler(_DroppingQueueHandler(_log_queue))
+        _log_listener = QueueListener(_log_queue, fh, ch, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+    else:
+        logger.addHandler(fh)
+        logger.addHandler(ch)
+
+
+def log_to_queue(q):
+    """
+    多进程模式的工作进程调用：不再自己写 GetDianfei.log（多个进程各自滚动同一文件会互相覆盖），
+    记录经 multiprocessing 队列 q 交给 supervisor，由 listen_log_queue() 统一写文件/控制台。
+    """
+    global _log_listener
+    if _log_listener is not None:
+        atexit.unregister(_log_listener.stop)
+        _log_listener.stop()
+        _log_listener = None
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        h.close()
+    # 标准 QueueHandler.prepare 会先格式化消息、去掉 exc_info，记录可以 pickle 跨进程
+    logger.addHandler(QueueHandler(q))
+
+
+def listen_log_queue(q) -> QueueListener:
+    """supervisor 调用：后台线程把 q 中工作进程发来的记录交给本进程的文件/控制台 handler。"""
+    listener = QueueListener(q, *_log_handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+_log_sampled = contextvars.ContextVar("dianfei_log_sampled", default=True)
+
+
+def _begin_request_log():
+    """每个请求开始时决定本请求的逐步 INFO 日志是否输出。"""
+    _log_sampled.set(LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE)
+
+
+def _rinfo(msg: str, *args):
+    """逐请求的 INFO 日志：%-参数惰性格式化，未采样的请求降为 DEBUG。"""
+    logger.log(logging.INFO if _log_sampled.get() else logging.DEBUG, msg, *args)
+
 
 def _safe_preview(text: str, n: int = 200) -> str:
     return text if len(text) <= n else (text[:n] + "...(truncated)")
 
 def _load_headers_from_file(path: str) -> dict:
-    """从 headers.txt 读取请求头（与原脚本一致），并记录日志。"""
-    logger.info(f"读取 headers 文件: {path}")
-    hdr = {}
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if ":" not in line:
-                logger.warning(f"忽略无效头行: {line!r}")
-                continue
-            k, v = line.split(":", 1)
-            hdr[k.strip()] = v.strip()
-    logger.info(f"headers 读取完成，键数量={len(hdr)}，示例={_redact_headers(hdr)}")
-    return hdr
+    """从 headers.txt 读取请求头；文件未变化时直接返回缓存，不再重复解析和打日志。"""
+    return get_provider(path).get()
 
 def _to_float(val) -> float:
     """将可能带单位/中文的电量值安全转为 float，并记录解析过程。"""
-    logger.debug(f"尝试将值解析为 float：{val!r}")
+    logger.debug("尝试将值解析为 float：%r", val)
     if isinstance(val, (int, float)):
         fv = float(val)
-        logger.info(f"电量数值解析成功（数值型）：{fv}")
+        _rinfo("电量数值解析成功（数值型）：%s", fv)
         return fv
     if isinstance(val, str):
         s = val.replace(",", "").replace("，", "").strip()
         m = re.search(r"[-+]?\d+(?:\.\d+)?", s)
         if m:
             fv = float(m.group())
-            logger.info(f"电量数值解析成功（从字符串 {val!r} 提取）：{fv}")
+            _rinfo("电量数值解析成功（从字符串 %r 提取）：%s", val, fv)
             return fv
     logger.error(f"电量数值解析失败，原始值：{val!r}")
     raise ValueError(f"无法从值 {val!r} 解析数值为 float")
@@ -82,28 +133,21 @@ def _pick_show_value(show: Dict[str, Any]):
     candidates = ["当前剩余电量", "剩余电量", "当前剩余电量(kWh)"]
     for k in candidates:
         if k in show:
-            logger.info(f"命中预设电量字段：{k} => {show[k]!r}")
+            _rinfo("命中预设电量字段：%s => %r", k, show[k])
             return k, show[k]
     # 模糊匹配
     for k, v in show.items():
         if "剩余" in k or "电量" in k:
-            logger.info(f"命中模糊电量字段：{k} => {v!r}")
+            _rinfo("命中模糊电量字段：%s => %r", k, v)
             return k, v
     return None, None
 
-def query_current_electricity(payload_json: str) -> float:
-    """
-    仅接收一个 JSON 字符串，返回当前剩余电量（度，float）。
-    失败抛出异常（ValueError/KeyError/requests.RequestException）。
-    """
-    logger.info("开始处理电量查询请求")
-    logger.debug(f"原始输入 JSON：{payload_json!r}")
-
-    # 1) 解析与校验输入
+def _parse_payload(payload_json: str) -> Dict[str, Any]:
+    """步骤 1：解析与校验输入 JSON。"""
     try:
         payload = json.loads(payload_json)
-        logger.info(f"输入解析成功：feeitemid={payload.get('feeitemid')}, "
-                    f"campus={payload.get('campus')}, building={payload.get('building')}, room={payload.get('room')}")
+        _rinfo("输入解析成功：feeitemid=%s, campus=%s, building=%s, room=%s",
+               payload.get('feeitemid'), payload.get('campus'), payload.get('building'), payload.get('room'))
     except json.JSONDecodeError as e:
         logger.exception("payload_json 不是有效 JSON")
         raise ValueError(f"payload_json 不是有效 JSON：{e}") from e
@@ -113,33 +157,21 @@ def query_current_electricity(payload_json: str) -> float:
     if missing:
         logger.error(f"缺少必填字段：{', '.join(sorted(missing))}")
         raise KeyError(f"缺少字段：{', '.join(sorted(missing))}")
+    return payload
 
-    # 2) 读取 headers 并请求
+def _request_headers() -> Dict[str, str]:
+    """步骤 2 前半：读取 headers.txt。"""
     headers_path = os.path.join(BASEDIR, "headers.txt")
     try:
-        headers = _load_headers_from_file(headers_path)
+        return _load_headers_from_file(headers_path)
     except Exception as e:
         logger.exception("读取 headers.txt 失败")
         raise
 
-    logger.info(f"向接口发起请求：{URL}")
-    try:
-        resp = requests.post(URL, headers=headers, data=payload, timeout=10)
-        logger.info(f"HTTP {resp.status_code}，耗时 {getattr(resp, 'elapsed', None)}")
-        resp.raise_for_status()
-    except requests.RequestException as e:
-        logger.exception("请求接口失败")
-        raise
-
-    # 3) 解析返回 JSON，提取电量字段
-    try:
-        data = resp.json()
+def _extract_value(data: Dict[str, Any]) -> float:
+    """步骤 3/4：从返回 JSON 的 map.showData 中取电量并转为 float。"""
+    if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"接口返回 JSON 预览：{_safe_preview(json.dumps(data, ensure_ascii=False), 300)}")
-    except ValueError as e:
-        preview = _safe_preview(resp.text, 300)
-        logger.error(f"接口返回非 JSON：{preview}")
-        raise ValueError(f"接口返回非 JSON：{preview}") from e
-
     show = data.get("map", {}).get("showData", {})
     if not isinstance(show, dict) or not show:
         logger.error(f"返回 JSON 中 showData 缺失或为空：{show!r}")
@@ -150,11 +182,60 @@ def query_current_electricity(payload_json: str) -> float:
         logger.error(f"返回 JSON 中找不到电量字段，showData keys={list(show.keys())}")
         raise KeyError(f"返回 JSON 中找不到电量字段，showData={show!r}")
 
-    # 4) 统一转为 float 并返回
     result = _to_float(value)
-    logger.info(f"电量查询成功：字段={key!r}，数值={result}（度）")
+    _rinfo("电量查询成功：字段=%r，数值=%s（度）", key, result)
     return result
 
+def _non_json_error(text: str) -> ValueError:
+    preview = _safe_preview(text, 300)
+    logger.error(f"接口返回非 JSON：{preview}")
+    return ValueError(f"接口返回非 JSON：{preview}")
+
+def query_current_electricity(payload_json: str) -> float:
+    """
+    仅接收一个 JSON 字符串，返回当前剩余电量（度，float）。
+    失败抛出异常（ValueError/KeyError/requests.RequestException）。
+    异步版本见 aio_client.query_current_electricity_async。
+    """
+    _begin_request_log()
+    _rinfo("开始处理电量查询请求")
+    logger.debug("原始输入 JSON：%r", payload_json)
+
+    # 1) 解析与校验输入
+    with STAGE_SECONDS.time(stage="parse_input"):
+        payload = _parse_payload(payload_json)
+
+    # 2) 读取 headers 并请求
+    with STAGE_SECONDS.time(stage="headers"):
+        headers = _request_headers()
+
+    _rinfo("向接口发起请求：%s", URL)
+    try:
+        client = get_client()
+        with STAGE_SECONDS.time(stage="upstream"), UPSTREAM_INFLIGHT.track_inprogress():
+            if HEDGE_ENABLED:
+                resp = get_hedger().call(lambda: client.post(URL, headers=headers, data=payload))
+            else:
+                resp = client.post(URL, headers=headers, data=payload)
+        UPSTREAM_RESPONSES.inc(code=resp.status_code)
+        _rinfo("HTTP %s，耗时 %s", resp.status_code, getattr(resp, 'elapsed', None))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"上游连接池统计：{client.stats()}")
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        if getattr(e, "response", None) is None:
+            UPSTREAM_RESPONSES.inc(code="error")
+        logger.exception("请求接口失败")
+        raise
+
+    # 3) 解析返回 JSON，提取电量字段；4) 统一转为 float 并返回
+    with STAGE_SECONDS.time(stage="parse_response"):
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise _non_json_error(resp.text) from e
+        return _extract_value(data)
+
 
 # —— 示例（需要时自行启用） ——
 if __name__ == "__main__":
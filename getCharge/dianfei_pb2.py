@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rdianfei.proto\x12\x07\x64ianfei\"n\n\x0cQueryRequest\x12\x0e\n\x06\x63\x61mpus\x18\x01 \x01(\t\x12\x10\n\x08\x62uilding\x18\x02 \x01(\t\x12\x0c\n\x04room\x18\x03 \x01(\t\x12\x11\n\tfeeitemid\x18\x04 \x01(\t\x12\x0c\n\x04type\x18\x05 \x01(\t\x12\r\n\x05level\x18\x06 \x01(\t\"\x1b\n\nQueryReply\x12\r\n\x05value\x18\x01 \x01(\x01\x32W\n\x0e\x44ianFeiService\x12\x45\n\x17QueryCurrentElectricity\x12\x15.dianfei.QueryRequest\x1a\x13.dianfei.QueryReplyb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rdianfei.proto\x12\x07\x64ianfei\"|\n\x0cQueryRequest\x12\x0e\n\x06\x63\x61mpus\x18\x01 \x01(\t\x12\x10\n\x08\x62uilding\x18\x02 \x01(\t\x12\x0c\n\x04room\x18\x03 \x01(\t\x12\x11\n\tfeeitemid\x18\x04 \x01(\t\x12\x0c\n\x04type\x18\x05 \x01(\t\x12\r\n\x05level\x18\x06 \x01(\t\x12\x0c\n\x04name\x18\x07 \x01(\t\"\x88\x01\n\nQueryReply\x12\r\n\x05value\x18\x01 \x01(\x01\x12\x15\n\rfetched_at_ms\x18\x02 \x01(\x03\x12*\n\x06source\x18\x03 \x01(\x0e\x32\x1a.dianfei.QueryReply.Source\"(\n\x06Source\x12\x08\n\x04LIVE\x10\x00\x12\t\n\x05\x43\x41\x43HE\x10\x01\x12\t\n\x05STALE\x10\x02\"9\n\x11\x42\x61tchQueryRequest\x12$\n\x05items\x18\x01 \x03(\x0b\x32\x15.dianfei.QueryRequest\"l\n\nRoomResult\x12&\n\x07request\x18\x01 \x01(\x0b\x32\x15.dianfei.QueryRequest\x12\n\n\x02ok\x18\x02 \x01(\x08\x12\r\n\x05value\x18\x03 \x01(\x01\x12\r\n\x05\x65rror\x18\x04 \x01(\t\x12\x0c\n\x04name\x18\x05 \x01(\t\"7\n\x0f\x42\x61tchQueryReply\x12$\n\x07results\x18\x01 \x03(\x0b\x32\x13.dianfei.RoomResult\"Z\n\x0cSweepRequest\x12\x0e\n\x06\x63\x61mpus\x18\x01 \x01(\t\x12\x10\n\x08\x62uilding\x18\x02 \x01(\t\x12\x13\n\x0bname_prefix\x18\x03 \x01(\t\x12\x13\n\x0b\x63oncurrency\x18\x04 \x01(\x05\"h\n\x0eHistoryRequest\x12#\n\x04room\x18\x01 \x01(\x0b\x32\x15.dianfei.QueryRequest\x12\x10\n\x08since_ms\x18\x02 \x01(\x03\x12\x10\n\x08until_ms\x18\x03 \x01(\x03\x12\r\n\x05limit\x18\x04 \x01(\r\"\'\n\x07Reading\x12\r\n\x05ts_ms\x18\x01 \x01(\x03\x12\r\n\x05value\x18\x02 \x01(\x01\"2\n\x0cHistoryReply\x12\"\n\x08readings\x18\x01 \x03(\x0b\x32\x10.dianfei.Reading\"O\n\x12\x43onsumptionRequest\x12#\n\x04room\x18\x01 \x01(\x0b\x32\x15.dianfei.QueryRequest\x12\x14\n\x0cwindow_hours\x18\x02 \x01(\x01\"}\n\x10\x43onsumptionReply\x12\x14\n\x0ckwh_per_hour\x18\x01 \x01(\x01\x12\x16\n\x0ehours_to_empty\x18\x02 \x01(\x01\x12\x14\n\x0clatest_value\x18\x03 \x01(\x01\x12\x14\n\x0clatest_ts_ms\x18\x04 \x01(\x03\x12\x0f\n\x07samples\x18\x05 \x01(\r2\xee\x02\n\x0e\x44ianFeiService\x12\x45\n\x17QueryCurrentElectricity\x12\x15.dianfei.QueryRequest\x1a\x13.dianfei.QueryReply\x12M\n\x15QueryElectricityBatch\x12\x1a.dianfei.BatchQueryRequest\x1a\x18.dianfei.BatchQueryReply\x12:\n\nSweepRooms\x12\x15.dianfei.SweepRequest\x1a\x13.dianfei.RoomResult0\x01\x12>\n\x0cQueryHistory\x12\x17.dianfei.HistoryRequest\x1a\x15.dianfei.HistoryReply\x12J\n\x10QueryConsumption\x12\x1b.dianfei.ConsumptionRequest\x1a\x19.dianfei.ConsumptionReplyb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,9 +32,29 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'dianfei_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_QUERYREQUEST']._serialized_start=26
-  _globals['_QUERYREQUEST']._serialized_end=136
-  _globals['_QUERYREPLY']._serialized_start=138
-  _globals['_QUERYREPLY']._serialized_end=165
-  _globals['_DIANFEISERVICE']._serialized_start=167
-  _globals['_DIANFEISERVICE']._serialized_end=254
+  _globals['_QUERYREQUEST']._serialized_end=150
+  _globals['_QUERYREPLY']._serialized_start=153
+  _globals['_QUERYREPLY']._serialized_end=289
+  _globals['_QUERYREPLY_SOURCE']._serialized_start=249
+  _globals['_QUERYREPLY_SOURCE']._serialized_end=289
+  _globals['_BATCHQUERYREQUEST']._serialized_start=291
+  _globals['_BATCHQUERYREQUEST']._serialized_end=348
+  _globals['_ROOMRESULT']._serialized_start=350
+  _globals['_ROOMRESULT']._serialized_end=458
+  _globals['_BATCHQUERYREPLY']._serialized_start=460
+  _globals['_BATCHQUERYREPLY']._serialized_end=515
+  _globals['_SWEEPREQUEST']._serialized_start=517
+  _globals['_SWEEPREQUEST']._serialized_end=607
+  _globals['_HISTORYREQUEST']._serialized_start=609
+  _globals['_HISTORYREQUEST']._serialized_end=713
+  _globals['_READING']._serialized_start=715
+  _globals['_READING']._serialized_end=754
+  _globals['_HISTORYREPLY']._serialized_start=756
+  _globals['_HISTORYREPLY']._serialized_end=806
+  _globals['_CONSUMPTIONREQUEST']._serialized_start=808
+  _globals['_CONSUMPTIONREQUEST']._serialized_end=887
+  _globals['_CONSUMPTIONREPLY']._serialized_start=889
+  _globals['_CONSUMPTIONREPLY']._serialized_end=1014
+  _globals['_DIANFEISERVICE']._serialized_start=1017
+  _globals['_DIANFEISERVICE']._serialized_end=1383
 # @@protoc_insertion_point(module_scope)
@@ -40,6 +40,26 @@ class DianFeiServiceStub(object):
                 request_serializer=dianfei__pb2.QueryRequest.SerializeToString,
                 response_deserializer=dianfei__pb2.QueryReply.FromString,
                 _registered_method=True)
+        self.QueryElectricityBatch = channel.unary_unary(
+                '/dianfei.DianFeiService/QueryElectricityBatch',
+                request_serializer=dianfei__pb2.BatchQueryRequest.SerializeToString,
+                response_deserializer=dianfei__pb2.BatchQueryReply.FromString,
+                _registered_method=True)
+        self.SweepRooms = channel.unary_stream(
+                '/dianfei.DianFeiService/SweepRooms',
+                request_serializer=dianfei__pb2.SweepRequest.SerializeToString,
+                response_deserializer=dianfei__pb2.RoomResult.FromString,
+                _registered_method=True)
+        self.QueryHistory = channel.unary_unary(
+                '/dianfei.DianFeiService/QueryHistory',
+                request_serializer=dianfei__pb2.HistoryRequest.SerializeToString,
+                response_deserializer=dianfei__pb2.HistoryReply.FromString,
+                _registered_method=True)
+        self.QueryConsumption = channel.unary_unary(
+                '/dianfei.DianFeiService/QueryConsumption',
+                request_serializer=dianfei__pb2.ConsumptionRequest.SerializeToString,
+                response_deserializer=dianfei__pb2.ConsumptionReply.FromString,
+                _registered_method=True)
 
 
 class DianFeiServiceServicer(object):
@@ -52,6 +72,34 @@ class DianFeiServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def QueryElectricityBatch(self, request, context):
+        """批量查询：每个房间单独返回数值或错误，个别房间失败不影响整批
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SweepRooms(self, request, context):
+        """按条件扫描 rooms_all.json 中的房间，结果按完成顺序流式返回
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def QueryHistory(self, request, context):
+        """本地保存的历史读数（不访问上游）
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def QueryConsumption(self, request, context):
+        """最近一段时间的用电速率与预计用完时间（不访问上游）
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_DianFeiServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -60,6 +108,26 @@ def add_DianFeiServiceServicer_to_server(servicer, server):
                     request_deserializer=dianfei__pb2.QueryRequest.FromString,
                     response_serializer=dianfei__pb2.QueryReply.SerializeToString,
             ),
+            'QueryElectricityBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.QueryElectricityBatch,
+                    request_deserializer=dianfei__pb2.BatchQueryRequest.FromString,
+                    response_serializer=dianfei__pb2.BatchQueryReply.SerializeToString,
+            ),
+            'SweepRooms': grpc.unary_stream_rpc_method_handler(
+                    servicer.SweepRooms,
+                    request_deserializer=dianfei__pb2.SweepRequest.FromString,
+                    response_serializer=dianfei__pb2.RoomResult.SerializeToString,
+            ),
+            'QueryHistory': grpc.unary_unary_rpc_method_handler(
+                    servicer.QueryHistory,
+                    request_deserializer=dianfei__pb2.HistoryRequest.FromString,
+                    response_serializer=dianfei__pb2.HistoryReply.SerializeToString,
+            ),
+            'QueryConsumption': grpc.unary_unary_rpc_method_handler(
+                    servicer.QueryConsumption,
+                    request_deserializer=dianfei__pb2.ConsumptionRequest.FromString,
+                    response_serializer=dianfei__pb2.ConsumptionReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'dianfei.DianFeiService', rpc_method_handlers)
@@ -98,3 +166,111 @@ class DianFeiService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def QueryElectricityBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/dianfei.DianFeiService/QueryElectricityBatch',
+            dianfei__pb2.BatchQueryRequest.SerializeToString,
+            dianfei__pb2.BatchQueryReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SweepRooms(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/dianfei.DianFeiService/SweepRooms',
+            dianfei__pb2.SweepRequest.SerializeToString,
+            dianfei__pb2.RoomResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def QueryHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/dianfei.DianFeiService/QueryHistory',
+            dianfei__pb2.HistoryRequest.SerializeToString,
+            dianfei__pb2.HistoryReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def QueryConsumption(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/dianfei.DianFeiService/QueryConsumption',
+            dianfei__pb2.ConsumptionRequest.SerializeToString,
+            dianfei__pb2.ConsumptionReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
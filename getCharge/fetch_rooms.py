@@ -1,32 +1,36 @@
 # filename: fetch_rooms.py
-import os, json, time
+import os, json, time, random, argparse, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 
-URL = "https://wxxyshall.usts.edu.cn/charge/feeitem/getThirdData"
+from header_provider import get_provider
+from http_client import UpstreamClient
+from rate_limit import TokenBucket
+from catalog_snapshot import export_snapshot
+
+URL = os.getenv("DIANFEI_UPSTREAM_URL", "https://wxxyshall.usts.edu.cn/charge/feeitem/getThirdData")
 HEADERS_FILE = "headers.txt"            # headers文件（每行 key: value）
 CAMPUS_FILE = "campus.json"             # 校区/楼栋清单
 OUT_FILE = "rooms_all.json"             # 汇总输出文件
+CHECKPOINT_FILE = "rooms_checkpoint.json"  # 按楼栋记录进度的断点文件
+SNAPSHOT_FILE = "rooms_catalog.pb"      # rooms_all.json + campus.json 的二进制快照
 
 # 自动管理的头，避免与 multipart 冲突
 _AUTO_HEADERS = {"host", "connection", "content-length", "content-type"}
 
 def load_headers(path: str) -> dict:
-    headers = {}
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or ":" not in line:
-                continue
-            k, v = line.split(":", 1)
-            if k.lower().strip() in _AUTO_HEADERS:
-                continue
-            headers[k.strip()] = v.strip()
-    return headers
+    """与 dianfei_core 共用同一个 headers 解析/缓存，只额外去掉自动管理的头。"""
+    return get_provider(path).get(exclude=_AUTO_HEADERS)
 
 def pick_map_data(obj: dict):
     """取 map.data；找不到返回 {}"""
+    data = find_map_data(obj)
+    return {} if data is None else data
+
+def find_map_data(obj: dict):
+    """取 map.data；找不到返回 None（与 data 为空区分开）"""
     if not isinstance(obj, dict):
-        return {}
+        return None
     map_obj = obj.get("map") if isinstance(obj.get("map"), dict) else None
     if not map_obj:
         for key in ("data", "result"):
@@ -36,7 +40,7 @@ def pick_map_data(obj: dict):
                 break
     if isinstance(map_obj, dict) and "data" in map_obj:
         return map_obj["data"]
-    return {}
+    return None
 
 def iter_rooms(data_field):
     """
@@ -75,54 +79,275 @@ def to_room_record(campus_code, building_code, item: dict):
         "name": str(name),
     }
 
+class BuildingFetchError(Exception):
+    """单个楼栋抓取失败（网络异常、非 JSON、5xx/429、接口报错或缺少 map.data），可重试。"""
+
+
+class EmptyBuildingError(BuildingFetchError):
+    """楼栋上次有房间、这次返回空列表：多半是接口异常，不覆盖断点中上次的房间列表。"""
+
+
+def fetch_building(client, headers: dict, campus_code: str, building_code: str) -> list:
+    """抓取一个楼栋的房间清单，返回 room 记录列表（楼栋内已去重）。"""
+    files = {
+        "feeitemid": (None, "409"),
+        "type": (None, "select"),
+        "level": (None, "2"),
+        "campus": (None, campus_code),
+        "building": (None, building_code),
+    }
+    try:
+        resp = client.post(URL, headers=headers, files=files, timeout=(10, 30))
+    except requests.RequestException as e:
+        raise BuildingFetchError(str(e)) from e
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise BuildingFetchError(f"HTTP {resp.status_code}")
+    try:
+        obj = resp.json()
+    except ValueError as e:
+        raise BuildingFetchError(f"non-JSON, status={resp.status_code}") from e
+    # cookie 失效等情况下接口仍返回 200 + JSON，只是 success=false 或没有 map.data：按失败处理，不能当成空楼栋
+    if isinstance(obj, dict) and obj.get("success") is False:
+        raise BuildingFetchError(f"success=false, msg={obj.get('msg') or obj.get('message')!r}")
+    data = find_map_data(obj)
+    if data is None:
+        raise BuildingFetchError(f"no map.data in reply, status={resp.status_code}")
+
+    rooms, seen = [], set()
+    for item in iter_rooms(data):
+        rec = to_room_record(campus_code, building_code, item)
+        if rec["room"] in seen:
+            continue
+        seen.add(rec["room"])
+        rooms.append(rec)
+    return rooms
+
+
+def fetch_with_retry(client, bucket: TokenBucket, headers: dict, campus_code: str, building_code: str,
+                     retries: int, backoff: float) -> list:
+    """每次尝试前先从全局令牌桶取令牌；失败按指数退避（带抖动）重试 retries 次。"""
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return fetch_building(client, headers, campus_code, building_code)
+        except BuildingFetchError as e:
+            if attempt >= retries:
+                raise
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            print(f"RETRY {campus_code}-{building_code} ({attempt}/{retries}) in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def iter_buildings(campuses):
+    for campus in campuses:
+        campus_code = str(campus["value"])
+        for b in campus.get("buildings", []):
+            yield campus_code, str(b["value"])
+
+
+def crawl(buildings, headers: dict, workers: int, rps: float, retries: int, backoff: float, on_done=None):
+    """
+    并发抓取给定楼栋 [(campus, building), ...]：workers 个线程共享一个 rps 的令牌桶。
+    每个楼栋完成（成功或最终失败）后在调用线程里回调 on_done(campus, building, rooms, error)。
+    返回 ({(campus, building): rooms}, [(campus, building, 错误)])。
+    """
+    bucket = TokenBucket(rps, burst=max(1.0, min(rps, workers)))
+    client = UpstreamClient(pool_size=workers, read_timeout=30)
+    results, failed = {}, []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futs = {
+                pool.submit(fetch_with_retry, client, bucket, headers, c, b, retries, backoff): (c, b)
+                for c, b in buildings
+            }
+            for fut in as_completed(futs):
+                c, b = futs[fut]
+                try:
+                    rooms = fut.result()
+                except Exception as e:
+                    failed.append((c, b, str(e)))
+                    print(f"ERROR campus={c} building={b}: {e}")
+                    if on_done is not None:
+                        on_done(c, b, None, e)
+                    continue
+                results[(c, b)] = rooms
+                print(f"{c}-{b}: +{len(rooms)} rooms ({len(results)}/{len(buildings)} buildings)")
+                if on_done is not None:
+                    on_done(c, b, rooms, None)
+    finally:
+        client.close()
+    return results, failed
+
+
+def _atomic_write_json(path: str, obj, **dump_kw):
+    """先写同目录临时文件并 fsync，再 os.replace，中途崩溃不会留下半个文件。"""
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, **dump_kw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Checkpoint:
+    """
+    记录每个楼栋的抓取进度：status(ok/failed)、房间内容哈希、房间数、抓取时间和房间列表。
+    每完成一个楼栋就原子落盘，崩溃或 cookie 失效后重跑只需补抓未完成/失败/过期的楼栋。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, load: bool = True):
+        self.path = path
+        self.buildings = {}
+        if load and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.buildings = data.get("buildings", {})
+            except (OSError, ValueError) as e:
+                print(f"WARN checkpoint {path} 无法读取，忽略: {e}")
+
+    @staticmethod
+    def _key(campus_code: str, building_code: str) -> str:
+        return f"{campus_code}/{building_code}"
+
+    @staticmethod
+    def content_hash(rooms: list) -> str:
+        compact = [[r["room"], r["name"]] for r in rooms]
+        raw = json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return hashlib.sha1(raw).hexdigest()
+
+    def is_fresh(self, campus_code: str, building_code: str, max_age: float) -> bool:
+        st = self.buildings.get(self._key(campus_code, building_code))
+        return bool(st) and st.get("status") == "ok" and time.time() - st.get("fetched_at", 0) < max_age
+
+    def rooms(self, campus_code: str, building_code: str):
+        """返回该楼栋最近一次成功抓到的房间记录；从未成功过返回 None。"""
+        st = self.buildings.get(self._key(campus_code, building_code))
+        if not st or "rooms" not in st:
+            return None
+        return [to_room_record(campus_code, building_code, {"value": room, "name": name})
+                for room, name in st["rooms"]]
+
+    def record_ok(self, campus_code: str, building_code: str, rooms: list, allow_empty: bool = False) -> bool:
+        """
+        记录成功结果，返回内容是否与上次不同。
+        上次有房间而这次为空时抛 EmptyBuildingError、保留上次的列表，除非 allow_empty（确认楼栋确实已清空）。
+        """
+        key = self._key(campus_code, building_code)
+        prev = self.buildings.get(key, {})
+        if not rooms and prev.get("rooms") and not allow_empty:
+            raise EmptyBuildingError(f"empty room list, keeping previous {len(prev['rooms'])} rooms "
+                                     f"(pass --allow-empty if the building really is empty)")
+        h = self.content_hash(rooms)
+        self.buildings[key] = {
+            "status": "ok",
+            "hash": h,
+            "count": len(rooms),
+            "fetched_at": time.time(),
+            "rooms": [[r["room"], r["name"]] for r in rooms],
+        }
+        return prev.get("hash") != h
+
+    def record_failed(self, campus_code: str, building_code: str, error: str):
+        """记录失败；保留上次成功的房间列表，输出时仍可使用，下次重跑会重试。"""
+        key = self._key(campus_code, building_code)
+        st = self.buildings.setdefault(key, {})
+        st["status"] = "failed"
+        st["error"] = error
+        st["failed_at"] = time.time()
+
+    def save(self):
+        _atomic_write_json(self.path, {"version": self.VERSION, "buildings": self.buildings},
+                           separators=(",", ":"))
+
+
+def merge_rooms(campuses, results) -> list:
+    """按 campus.json 中的楼栋顺序合并，结果与顺序抓取时一致。"""
+    all_rooms = []
+    seen = set()  # 去重 key: (campus, building, room)
+    for key in iter_buildings(campuses):
+        for rec in results.get(key, ()):
+            k = (rec["campus"], rec["building"], rec["room"])
+            if k in seen:
+                continue
+            seen.add(k)
+            all_rooms.append(rec)
+    return all_rooms
+
+
 def main():
+    parser = argparse.ArgumentParser(description="抓取所有楼栋的房间清单，输出 rooms_all.json")
+    parser.add_argument("--workers", type=int, default=1, help="并发线程数")
+    parser.add_argument("--rps", type=float, default=1 / 1.2, help="全局每秒请求数上限（含重试）")
+    parser.add_argument("--retries", type=int, default=3, help="单个楼栋失败后的重试次数")
+    parser.add_argument("--backoff", type=float, default=2.0, help="首次重试前的基础等待秒数，之后指数增长")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="断点文件")
+    parser.add_argument("--max-age", type=float, default=20.0,
+                        help="断点中成功记录的有效期（小时），未过期的楼栋直接复用不再请求")
+    parser.add_argument("--full", action="store_true", help="忽略已有断点，全部重新抓取")
+    parser.add_argument("--allow-empty", action="store_true",
+                        help="允许用空房间列表覆盖断点中上次非空的楼栋（确认楼栋已清空时使用）")
+    args = parser.parse_args()
+
     headers = load_headers(HEADERS_FILE)
     with open(CAMPUS_FILE, "r", encoding="utf-8") as f:
         campuses = json.load(f)
 
-    session = requests.Session()
-    all_rooms = []
-    seen = set()  # 去重 key: (campus, building, room)
+    ckpt = Checkpoint(args.checkpoint, load=not args.full)
+    buildings = list(iter_buildings(campuses))
+    max_age = args.max_age * 3600
+    todo = [(c, b) for c, b in buildings if not ckpt.is_fresh(c, b, max_age)]
+    print(f"buildings={len(buildings)}  to_fetch={len(todo)}  reused_from_checkpoint={len(buildings) - len(todo)}")
 
-    for campus in campuses:
-        campus_code = str(campus["value"])
-        buildings = campus.get("buildings", [])
-        for b in buildings:
-            building_code = str(b["value"])
-
-            files = {
-                "feeitemid": (None, "409"),
-                "type": (None, "select"),
-                "level": (None, "2"),
-                "campus": (None, campus_code),
-                "building": (None, building_code),
-            }
+    changed, refused = [], []
 
+    def on_done(c, b, rooms, err):
+        if err is None:
             try:
-                resp = session.post(URL, headers=headers, files=files, timeout=30)
-                try:
-                    obj = resp.json()
-                    data_field = pick_map_data(obj)
-                    cnt = 0
-                    for item in iter_rooms(data_field):
-                        rec = to_room_record(campus_code, building_code, item)
-                        key = (rec["campus"], rec["building"], rec["room"])
-                        if key in seen:
-                            continue
-                        seen.add(key)
-                        all_rooms.append(rec)
-                        cnt += 1
-                    print(f"[{resp.status_code}] {campus_code}-{building_code}: +{cnt} rooms (total={len(all_rooms)})")
-                except ValueError:
-                    print(f"ERROR non-JSON for {campus_code}-{building_code}, status={resp.status_code}")
-            except Exception as e:
-                print(f"ERROR campus={campus_code} building={building_code}: {e}")
-
-            time.sleep(1.2)  # 轻微限速，避免过快请求
-
-    with open(OUT_FILE, "w", encoding="utf-8") as out:
-        json.dump(all_rooms, out, ensure_ascii=False, indent=2)
-    print(f"DONE -> {OUT_FILE}  total={len(all_rooms)}")
+                if ckpt.record_ok(c, b, rooms, allow_empty=args.allow_empty):
+                    changed.append((c, b))
+            except EmptyBuildingError as e:
+                err = e
+                refused.append((c, b, str(e)))
+                print(f"ERROR campus={c} building={b}: {e}")
+        if err is not None:
+            ckpt.record_failed(c, b, str(err))
+        ckpt.save()
+
+    t0 = time.time()
+    _, failed = crawl(todo, headers, max(args.workers, 1), args.rps, args.retries, args.backoff, on_done)
+    failed += refused
+
+    results = {}
+    for c, b in buildings:
+        rooms = ckpt.rooms(c, b)
+        if rooms is not None:
+            results[(c, b)] = rooms
+    all_rooms = merge_rooms(campuses, results)
+
+    new_text = json.dumps(all_rooms, ensure_ascii=False, indent=2)
+    old_text = None
+    if os.path.exists(OUT_FILE):
+        with open(OUT_FILE, "r", encoding="utf-8") as f:
+            old_text = f.read()
+    if new_text != old_text:
+        _atomic_write_json(OUT_FILE, all_rooms, indent=2)
+        print(f"WROTE -> {OUT_FILE}")
+    else:
+        print(f"UNCHANGED -> {OUT_FILE}")
+    if new_text != old_text or not os.path.exists(SNAPSHOT_FILE):
+        # 同步刷新二进制快照，服务启动时优先加载它
+        size = export_snapshot(OUT_FILE, CAMPUS_FILE, SNAPSHOT_FILE)
+        print(f"WROTE -> {SNAPSHOT_FILE} ({size} bytes)")
+    print(f"DONE total={len(all_rooms)}  changed_buildings={len(changed)}  failed_buildings={len(failed)}  "
+          f"elapsed={time.time() - t0:.1f}s")
+    for c, b, err in failed:
+        print(f"  FAILED {c}-{b}: {err}  (rerun to retry)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+# header_provider.py —— headers.txt 的缓存读取：只在文件变化时重新解析
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("dianfei")
+
+# 文件状态的检查间隔（秒）；0 表示每次 get() 都 stat 一次
+CHECK_INTERVAL = float(os.getenv("DIANFEI_HEADERS_CHECK_INTERVAL", "1.0"))
+
+
+def _mask(s: str, keep_head: int = 6, keep_tail: int = 4) -> str:
+    """打码敏感信息：保留前 keep_head、后 keep_tail，其余用*。"""
+    if s is None:
+        return ""
+    if len(s) <= keep_head + keep_tail:
+        return "*" * len(s)
+    return s[:keep_head] + "*" * (len(s) - keep_head - keep_tail) + s[-keep_tail:]
+
+
+def _redact_headers(hdr: Dict[str, str]) -> Dict[str, str]:
+    """对可能敏感的头做打码（仅用于日志展示）。"""
+    redacted = dict(hdr)
+    for key in list(redacted.keys()):
+        k_low = key.lower()
+        if any(t in k_low for t in ("cookie", "authorization", "token", "auth")):
+            redacted[key] = _mask(str(redacted[key]))
+    return redacted
+
+
+def parse_headers(path: str) -> Dict[str, str]:
+    """解析 headers 文件（每行 key: value，# 开头为注释）。"""
+    hdr = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if ":" not in line:
+                logger.warning(f"忽略无效头行: {line!r}")
+                continue
+            k, v = line.split(":", 1)
+            hdr[k.strip()] = v.strip()
+    return hdr
+
+
+class HeaderProvider:
+    """
+    按 (inode, mtime, size) 判断 headers 文件是否变化，变化时才重新解析。
+    轮换挂载的 cookie 文件无需重启即可生效；文件暂时不可读时沿用上一次的结果。
+    """
+
+    def __init__(self, path: str, check_interval: float = CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._sig: Optional[Tuple[int, int, int]] = None
+        self._headers: Optional[Dict[str, str]] = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def _signature(self) -> Tuple[int, int, int]:
+        st = os.stat(self.path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._headers is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            sig = self._signature()
+            if sig == self._sig and self._headers is not None:
+                return
+            hdr = parse_headers(self.path)
+        except OSError:
+            if self._headers is None:
+                raise
+            logger.exception(f"headers 文件暂不可读，沿用上一版本: {self.path}")
+            return
+        self._sig = sig
+        self._headers = hdr
+        self.reloads += 1
+        logger.info(f"headers 已(重新)加载: {self.path}，键数量={len(hdr)}，示例={_redact_headers(hdr)}")
+
+    def get(self, exclude: Iterable[str] = ()) -> Dict[str, str]:
+        """返回当前请求头的副本；exclude 中的键（不区分大小写）会被去掉。"""
+        with self._lock:
+            self._refresh()
+            hdr = self._headers
+        drop = {k.lower() for k in exclude}
+        return {k: v for k, v in hdr.items() if k.lower() not in drop}
+
+
+_providers: Dict[str, HeaderProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(path: str) -> HeaderProvider:
+    """同一路径共享同一个 HeaderProvider。"""
+    key = os.path.abspath(path)
+    with _providers_lock:
+        p = _providers.get(key)
+        if p is None:
+            p = _providers[key] = HeaderProvider(key)
+        return p
@@ -0,0 +1,160 @@
+# hedge.py —— 上游请求对冲（hedged request）：首发请求迟迟不返回时再发一路相同请求，取先返回者
+#
+# - 触发延迟取最近 HEDGE_WINDOW 次成功请求耗时的 HEDGE_PERCENTILE 分位（不低于 HEDGE_MIN_DELAY），
+#   样本不足 HEDGE_MIN_SAMPLES 时不对冲；
+# - 全局预算：每次调用存入 HEDGE_BUDGET_RATIO 个令牌，每次对冲取 1 个，额外请求量不超过该比例；
+#   预算从 0 开始、最多攒 HEDGE_BUDGET_BURST 个，不会因为启动时的满额或长时间空闲后的积攒而集中对冲；
+# - 先返回成功结果的一路胜出，另一路通过 CallScope 取消（关闭套接字，不再等它读完）；
+#   一路失败时等另一路，两路都失败才抛首发请求的异常；
+# - 对冲胜出时首发请求还没返回，它的耗时按“至少到对冲胜出为止”计入样本（删失样本），
+#   否则只有快的那一路进样本，分位数会越算越低、对冲越来越早；
+# - 两路都以调用方 CallScope 的子 scope 运行，调用方取消/截止时间同样作用于它们。
+import os
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from typing import Callable, Dict, Optional, TypeVar
+
+from circuit_breaker import RetryBudget
+from http_client import CallScope, bind_scope, current_scope
+from metrics import HEDGE_DELAY, HEDGE_EVENTS
+
+HEDGE_ENABLED = os.getenv("DIANFEI_HEDGE", "0") not in ("0", "false", "no")
+HEDGE_PERCENTILE = float(os.getenv("DIANFEI_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("DIANFEI_HEDGE_MIN_DELAY", "0.05"))   # 秒
+HEDGE_BUDGET_RATIO = float(os.getenv("DIANFEI_HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_BUDGET_BURST = float(os.getenv("DIANFEI_HEDGE_BUDGET_BURST", "2"))
+HEDGE_WINDOW = int(os.getenv("DIANFEI_HEDGE_WINDOW", "512"))
+HEDGE_MIN_SAMPLES = int(os.getenv("DIANFEI_HEDGE_MIN_SAMPLES", "50"))
+# 两路请求都在这个线程池里执行；池满时首发请求排队，所以应不小于同时在途的上游请求数
+HEDGE_WORKERS = int(os.getenv("DIANFEI_HEDGE_WORKERS", "32"))
+
+T = TypeVar("T")
+
+_RECOMPUTE_EVERY = 32  # 每记录这么多个样本重新算一次分位数，避免每次请求都排序
+
+
+class Hedger:
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_delay: float = HEDGE_MIN_DELAY,
+                 budget_ratio: float = HEDGE_BUDGET_RATIO, budget_burst: float = HEDGE_BUDGET_BURST,
+                 window: int = HEDGE_WINDOW, min_samples: int = HEDGE_MIN_SAMPLES, workers: int = HEDGE_WORKERS):
+        self.percentile = min(max(percentile, 0.0), 1.0)
+        self.min_delay = min_delay
+        self.min_samples = max(min_samples, 1)
+        self.budget = RetryBudget(budget_ratio, max_balance=max(budget_burst, 1.0), initial=0.0)
+        self._pool = futures.ThreadPoolExecutor(max_workers=max(workers, 2), thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._latencies: "deque[float]" = deque(maxlen=max(window, 1))
+        self._since_recompute = 0
+        self._delay: Optional[float] = None
+        self.calls = self.hedged = self.hedge_won = self.budget_exhausted = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._since_recompute += 1
+            if self._since_recompute < _RECOMPUTE_EVERY and self._delay is not None:
+                return
+            self._since_recompute = 0
+            if len(self._latencies) < self.min_samples:
+                return
+            ordered = sorted(self._latencies)
+            idx = min(int(self.percentile * len(ordered)), len(ordered) - 1)
+            self._delay = max(ordered[idx], self.min_delay)
+        HEDGE_DELAY.set(self._delay)
+
+    def delay(self) -> Optional[float]:
+        """当前对冲触发延迟（秒）；样本不足时为 None（不对冲）。"""
+        with self._lock:
+            return self._delay
+
+    def _attempt(self, scope: CallScope, fn: Callable[[], T]) -> T:
+        t0 = time.perf_counter()
+        with bind_scope(scope):
+            result = fn()
+        self.observe(time.perf_counter() - t0)
+        return result
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """执行 fn（一次上游请求），必要时对冲。fn 须是幂等的。"""
+        self.budget.deposit()
+        with self._lock:
+            self.calls += 1
+        delay = self.delay()
+        parent = current_scope()
+        if delay is None:
+            t0 = time.perf_counter()
+            result = fn()
+            self.observe(time.perf_counter() - t0)
+            return result
+
+        attempts: Dict[futures.Future, CallScope] = {}
+
+        def launch() -> futures.Future:
+            scope = parent.child() if parent is not None else CallScope()
+            fut = self._pool.submit(self._attempt, scope, fn)
+            attempts[fut] = scope
+            return fut
+
+        t0 = time.perf_counter()
+        primary = launch()
+        hedge = None
+        done, _ = futures.wait([primary], timeout=delay)
+        if not done:
+            if self.budget.try_withdraw():
+                hedge = launch()
+                with self._lock:
+                    self.hedged += 1
+                HEDGE_EVENTS.inc(event="hedged")
+            else:
+                with self._lock:
+                    self.budget_exhausted += 1
+                HEDGE_EVENTS.inc(event="budget_exhausted")
+
+        winner = None
+        primary_pending = False
+        try:
+            for fut in futures.as_completed(attempts):
+                if fut.exception() is None:
+                    winner = fut
+                    primary_pending = not primary.done()
+                    break
+        finally:
+            for fut, scope in attempts.items():
+                if fut is not winner:
+                    scope.cancel("hedge_lost" if winner is not None else "cancelled")
+        if winner is None:
+            return primary.result()  # 两路都失败：抛首发请求的异常
+        if primary_pending:
+            self.observe(time.perf_counter() - t0)  # 首发请求的耗时至少这么长
+        if winner is hedge:
+            with self._lock:
+                self.hedge_won += 1
+            HEDGE_EVENTS.inc(event="hedge_won")
+        return winner.result()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_won": self.hedge_won,
+                "budget_exhausted": self.budget_exhausted,
+                "delay": self._delay if self._delay is not None else -1.0,
+                "samples": len(self._latencies),
+            }
+
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """进程内共享的对冲器（延迟分位数与预算在所有请求间共享）。"""
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger
@@ -0,0 +1,357 @@
+# http_client.py —— 进程级共享的上游 HTTP 客户端（连接池 + keep-alive）
+import contextvars
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+from metrics import UPSTREAM_CANCELLED
+
+# —— 可通过环境变量调整的默认参数 ——
+# 每个 host 最多保持的连接数。连接按需建立，默认值覆盖所有可能同时调用上游的线程：
+# gRPC 8 + fan-out 16 + 对冲 32 + 定时轮询 8 + 启动预热 4 = 68，正常负载下不必排队等连接
+POOL_SIZE = int(os.getenv("DIANFEI_POOL_SIZE", "68"))
+POOL_BLOCK = os.getenv("DIANFEI_POOL_BLOCK", "1") != "0"           # 连接用尽时排队等待，而不是临时多开
+POOL_WAIT_POLL = 0.05  # 秒；在 CallScope 下排队等连接时，每隔这么久检查一次调用方是否已取消/超时
+KEEP_ALIVE = os.getenv("DIANFEI_KEEP_ALIVE", "1") != "0"           # 复用连接 + TCP keepalive
+CONNECT_TIMEOUT = float(os.getenv("DIANFEI_CONNECT_TIMEOUT", "3"))  # 建连（TCP+TLS）超时，秒
+READ_TIMEOUT = float(os.getenv("DIANFEI_READ_TIMEOUT", "10"))       # 读响应超时，秒
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+_CANCEL_TEXT = {"cancelled": "调用方已取消", "deadline": "调用方截止时间已到", "hedge_lost": "对冲请求已有先返回的结果"}
+
+
+class UpstreamCancelled(Exception):
+    """
+    上游请求未发出或已被中断：调用方已取消（reason=cancelled）、截止时间已到（reason=deadline），
+    或对冲请求中另一路已先返回（reason=hedge_lost）。
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(_CANCEL_TEXT.get(reason, reason))
+        self.reason = reason
+
+
+class CallScope:
+    """
+    一次 gRPC 调用对上游请求的约束：截止时间（monotonic）与取消标记。
+    请求期间正在使用的连接登记在这里，cancel() 时直接 shutdown 套接字，阻塞中的读立刻返回。
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.cancel_reason = "cancelled"
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._conns: Dict[object, int] = {}  # 连接 -> 使用它的线程 id
+        self._children: List["CallScope"] = []
+
+    def child(self) -> "CallScope":
+        """同一截止时间的子 scope：本 scope 取消时一并取消，子 scope 单独取消不影响本 scope。"""
+        c = CallScope()
+        c.deadline = self.deadline
+        with self._lock:
+            if self.cancelled:
+                c._cancelled.set()
+            else:
+                self._children.append(c)
+        return c
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self):
+        """已取消或已过截止时间时抛 UpstreamCancelled（请求尚未发出）。"""
+        if self.cancelled:
+            reason = self.cancel_reason
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            reason = "deadline"
+        else:
+            return
+        UPSTREAM_CANCELLED.inc(reason=reason, stage="before")
+        raise UpstreamCancelled(reason)
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if not self._cancelled.is_set():
+                self.cancel_reason = reason
+            self._cancelled.set()
+            conns = list(self._conns)
+            children, self._children = self._children, []
+        for c in children:
+            c.cancel(reason)
+        for conn in conns:
+            sock = getattr(conn, "sock", None)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def attach(self, conn):
+        with self._lock:
+            self._conns[conn] = threading.get_ident()
+
+    def detach_current_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            for conn in [c for c, t in self._conns.items() if t == ident]:
+                del self._conns[conn]
+
+
+_scope: "contextvars.ContextVar[Optional[CallScope]]" = contextvars.ContextVar("dianfei_call_scope", default=None)
+
+
+@contextmanager
+def bind_scope(scope: Optional[CallScope]):
+    """在当前上下文中登记 scope，其间经 UpstreamClient 发出的请求都受它约束。"""
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def call_scope(timeout: Optional[float] = None):
+    return bind_scope(CallScope(timeout))
+
+
+def current_scope() -> Optional[CallScope]:
+    return _scope.get()
+
+
+def check_current_scope():
+    """当前上下文有 CallScope 且已取消/已过截止时间时抛 UpstreamCancelled。"""
+    scope = _scope.get()
+    if scope is not None:
+        scope.check()
+
+
+def current_remaining() -> Optional[float]:
+    """当前上下文 CallScope 的剩余秒数；没有 scope 或不限时为 None。"""
+    scope = _scope.get()
+    return None if scope is None else scope.remaining()
+
+
+def _attach_to_scope(conn):
+    scope = _scope.get()
+    if scope is not None:
+        scope.attach(conn)
+
+
+def _get_conn_in_scope(pool, get_conn, timeout: Optional[float]):
+    """
+    连接池用尽（pool_block）时的排队等待也受当前 CallScope 约束：分段等待，
+    调用方取消或截止时间已到时抛 EmptyPoolError（由 UpstreamClient.post 转成 UpstreamCancelled），
+    而不是无限期地等一个空闲连接。必须抛 EmptyPoolError：urlopen 只在这种异常下不把“连接”归还池中。
+    """
+    scope = _scope.get()
+    if scope is None or timeout is not None:
+        return get_conn(timeout)
+    while True:
+        remaining = scope.remaining()
+        if scope.cancelled or (remaining is not None and remaining <= 0):
+            raise EmptyPoolError(pool, "调用方已取消或截止时间已到，放弃等待空闲连接")
+        try:
+            return get_conn(POOL_WAIT_POLL if remaining is None else min(remaining, POOL_WAIT_POLL))
+        except EmptyPoolError:
+            continue
+
+
+class _Stats:
+    """连接复用统计：requests 为发出的请求数，connects 为真正建立的 TCP(+TLS) 连接数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+        self.errors = 0
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            reused = max(self.requests - self.connects, 0)
+            return {
+                "requests": self.requests,
+                "connects": self.connects,
+                "reused": reused,
+                "errors": self.errors,
+                "reuse_ratio": (reused / self.requests) if self.requests else 0.0,
+            }
+
+
+def _keepalive_socket_options():
+    opts = list(HTTPConnection.default_socket_options)
+    opts.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Linux 下细调探测间隔；其它平台没有这些常量就跳过
+    for name, val in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 15), ("TCP_KEEPCNT", 4)):
+        if hasattr(socket, name):
+            opts.append((socket.IPPROTO_TCP, getattr(socket, name), val))
+    return opts
+
+
+class _CountingAdapter(HTTPAdapter):
+    """在 urllib3 连接对象的 connect() 上计数，以区分“新建连接”和“复用连接”。"""
+
+    def __init__(self, stats: _Stats, keep_alive: bool, **kw):
+        self._stats = stats
+        self._keep_alive = keep_alive
+        super().__init__(**kw)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._keep_alive:
+            pool_kwargs.setdefault("socket_options", _keepalive_socket_options())
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        stats = self._stats
+
+        class _HTTPConn(HTTPConnection):
+            def connect(self):
+                stats.incr("connects")
+                return super().connect()
+
+            def request(self, *args, **kw):
+                _attach_to_scope(self)
+                return super().request(*args, **kw)
+
+        class _HTTPSConn(HTTPSConnection):
+            def connect(self):
+                stats.incr("connects")
+                return super().connect()
+
+            def request(self, *args, **kw):
+                _attach_to_scope(self)
+                return super().request(*args, **kw)
+
+        class _HTTPPool(HTTPConnectionPool):
+            ConnectionCls = _HTTPConn
+
+            def _get_conn(self, timeout=None):
+                return _get_conn_in_scope(self, super()._get_conn, timeout)
+
+        class _HTTPSPool(HTTPSConnectionPool):
+            ConnectionCls = _HTTPSConn
+
+            def _get_conn(self, timeout=None):
+                return _get_conn_in_scope(self, super()._get_conn, timeout)
+
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+
+class UpstreamClient:
+    """
+    线程安全的上游客户端：一个 requests.Session + 有界连接池，
+    供 server.py 的所有工作线程共享，避免每次请求都重新握手。
+    """
+
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        keep_alive: bool = KEEP_ALIVE,
+        pool_block: bool = POOL_BLOCK,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self._stats = _Stats()
+
+        self.session = requests.Session()
+        adapter = _CountingAdapter(
+            self._stats,
+            keep_alive,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            pool_block=pool_block,
+            max_retries=0,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        data=None,
+        files=None,
+        timeout: Optional[Timeout] = None,
+    ) -> requests.Response:
+        """
+        发起 POST；timeout 缺省为 (connect_timeout, read_timeout)。
+        当前上下文有 CallScope 时，超时不超过调用方剩余时间（连接池用尽时排队等连接也算在内）；
+        调用方取消或截止时间已到则抛 UpstreamCancelled。
+        """
+        hdr = dict(headers or {})
+        if not self.keep_alive:
+            hdr["Connection"] = "close"
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        scope = _scope.get()
+        clipped = False
+        if scope is not None:
+            scope.check()
+            remaining = scope.remaining()
+            longest = timeout if isinstance(timeout, (int, float)) else max(timeout)
+            if remaining is not None and remaining < longest:
+                timeout, clipped = remaining, True
+        self._stats.incr("requests")
+        try:
+            return self.session.post(url, headers=hdr, data=data, files=files, timeout=timeout)
+        except EmptyPoolError as e:
+            # 只有在 CallScope 下等空闲连接时才会抛到这里（见 _get_conn_in_scope），请求尚未发出
+            reason = scope.cancel_reason if scope is not None and scope.cancelled else "deadline"
+            UPSTREAM_CANCELLED.inc(reason=reason, stage="before")
+            raise UpstreamCancelled(reason) from e
+        except requests.RequestException as e:
+            if scope is not None and scope.cancelled:
+                UPSTREAM_CANCELLED.inc(reason=scope.cancel_reason, stage="inflight")
+                raise UpstreamCancelled(scope.cancel_reason) from e
+            if clipped and isinstance(e, requests.Timeout):
+                UPSTREAM_CANCELLED.inc(reason="deadline", stage="inflight")
+                raise UpstreamCancelled("deadline") from e
+            self._stats.incr("errors")
+            raise
+        finally:
+            if scope is not None:
+                scope.detach_current_thread()
+
+    def stats(self) -> Dict[str, float]:
+        snap = self._stats.snapshot()
+        snap["pool_size"] = self.pool_size
+        return snap
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[UpstreamClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> UpstreamClient:
+    """返回进程内唯一的 UpstreamClient（首次调用时按环境变量创建）。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UpstreamClient()
+    return _client
@@ -0,0 +1,262 @@
+# metrics.py —— 进程内指标（Prometheus 文本格式）与本地 /metrics HTTP 端口
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_PORT = int(os.getenv("DIANFEI_METRICS_PORT", "50052"))  # 0 表示不开 /metrics
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self.samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, registry=None):
+        super().__init__(name, help, registry)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """可 set/inc/dec；也可用 set_function 在抓取时现算（如线程池队列长度）。"""
+
+    type = "gauge"
+
+    def __init__(self, name, help, registry=None):
+        super().__init__(name, help, registry)
+        self._values: Dict[LabelKey, float] = {}
+        self._funcs: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        with self._lock:
+            self._funcs[_label_key(labels)] = fn
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            funcs = dict(self._funcs)
+        for key, fn in funcs.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                acc = 0
+                for b, c in zip(self.buckets, counts):
+                    acc += c
+                    out.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(b))])} {acc}")
+                out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(self._sums[key])}")
+                out.append(f"{self.name}_count{_fmt_labels(key)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# —— 服务用到的指标 ——
+STAGE_SECONDS = Histogram(
+    "dianfei_stage_seconds",
+    "query_current_electricity 各步骤耗时（parse_input/headers/upstream/parse_response）",
+)
+UPSTREAM_INFLIGHT = Gauge("dianfei_upstream_inflight", "正在进行的上游 HTTP 请求数")
+UPSTREAM_RESPONSES = Counter(
+    "dianfei_upstream_responses_total",
+    "上游响应计数，code 为 HTTP 状态码，网络异常时为 error",
+)
+RPC_SECONDS = Histogram("dianfei_rpc_seconds", "gRPC 方法处理耗时（不含排队）")
+RPC_INFLIGHT = Gauge("dianfei_rpc_inflight", "正在处理的 gRPC 调用数")
+RPC_TOTAL = Counter("dianfei_rpc_total", "gRPC 调用计数，按方法与结果码")
+POOL_QUEUE_DEPTH = Gauge("dianfei_pool_queue_depth", "线程池中排队等待执行的任务数")
+CACHE_EVENTS = Gauge("dianfei_cache", "结果缓存统计（hits/misses/coalesced/size...）")
+LOG_DROPPED = Counter("dianfei_log_dropped_total", "异步日志队列已满而丢弃的记录数")
+UPSTREAM_POOL = Gauge("dianfei_upstream_pool", "上游连接池统计（requests/connects/reused...）")
+BREAKER_STATE = Gauge("dianfei_breaker_state", "上游熔断器状态：0 关闭，1 半开，2 打开")
+BREAKER_EVENTS = Counter(
+    "dianfei_breaker_events_total",
+    "熔断/重试事件（opened/rejected/retry/retry_budget_exhausted/stale_served）",
+)
+UPSTREAM_CANCELLED = Counter(
+    "dianfei_upstream_cancelled_total",
+    "因 gRPC 调用方取消（reason=cancelled）、截止时间已到（reason=deadline）或对冲落败（reason=hedge_lost）"
+    "而放弃的上游请求；stage=before 为未发出，stage=inflight 为已发出后中断",
+)
+HEDGE_EVENTS = Counter(
+    "dianfei_hedge_events_total",
+    "上游对冲请求事件（hedged 发出第二路/hedge_won 第二路先返回/budget_exhausted 预算不足未对冲）",
+)
+HEDGE_DELAY = Gauge("dianfei_hedge_delay_seconds", "当前对冲触发延迟（近期上游耗时的分位数）")
+WARMUP = Gauge("dianfei_warmup", "启动预热统计（rooms/warmed/failed/ready）")
+READINGS_STORE = Gauge("dianfei_readings_store", "本地读数存储统计（written/batches/dropped/queued...）")
+
+
+def register_stats(gauge: Gauge, stats_fn: Callable[[], Dict[str, float]], keys: Iterable[str], **labels):
+    """把某个 stats() 字典中的若干键挂成 gauge，抓取时读取最新值。"""
+    for k in keys:
+        gauge.set_function(lambda k=k: stats_fn()[k], stat=k, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+    routes: Dict[str, Callable[[], Tuple[int, str]]] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            status, body = 200, self.registry.render()
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in self.routes:
+            status, body = self.routes[path]()
+            ctype = "text/plain; charset=utf-8"
+        else:
+            status, body, ctype = 404, "not found\n", "text/plain; charset=utf-8"
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(host: str = "0.0.0.0", port: int = METRICS_PORT,
+                         routes: Optional[Dict[str, Callable[[], Tuple[int, str]]]] = None):
+    """在后台线程开 HTTP 端口，提供 /metrics；routes 可追加其它只读路径。port<=0 时不启动。"""
+    if port <= 0:
+        return None
+    handler = type("BoundMetricsHandler", (_MetricsHandler,), {"routes": dict(routes or {})})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
@@ -0,0 +1,168 @@
+# mock_upstream.py —— 本地模拟 /charge/feeitem/getThirdData，用于压测和离线调试
+#
+# 用法：
+#   python mock_upstream.py --port 18080 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+#   DIANFEI_UPSTREAM_URL=http://127.0.0.1:18080/charge/feeitem/getThirdData python server.py
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs
+
+PATH = "/charge/feeitem/getThirdData"
+
+# showData 的几种返回形态，对应 dianfei_core._pick_show_value / _to_float 支持的情况
+VARIANTS = ("string", "numeric", "fuzzy", "comma")
+
+
+def _room_balance(campus: str, building: str, room: str) -> float:
+    """按房间确定性地生成一个余额，同一房间多次查询结果一致，便于对比。"""
+    h = zlib.crc32(f"{campus}/{building}/{room}".encode("utf-8"))
+    return round((h % 30000) / 100.0, 2)
+
+
+def _show_data(balance: float, variant: str) -> Dict[str, object]:
+    if variant == "numeric":
+        return {"当前剩余电量": balance}
+    if variant == "fuzzy":
+        return {"房间": "模拟房间", "剩余电量(度)": f"{balance}度"}
+    if variant == "comma":
+        return {"当前剩余电量": f"{balance:,.2f} kWh"}
+    return {"当前剩余电量": f"{balance}度"}
+
+
+def _room_list(building: str, rooms_per_building: int):
+    """level=2/type=select 时返回的房间清单（map.data）。"""
+    base = zlib.crc32(building.encode("utf-8")) % 10000
+    data = []
+    for i in range(rooms_per_building):
+        floor, num = divmod(i, 20)
+        data.append({"value": str(base * 100 + i), "name": f"{building}-{floor + 1}{num + 1:02d}"})
+    return data
+
+
+class MockConfig:
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, error_rate=0.0, stall_rate=0.0, stall_ms=3000.0,
+                 variant="string", rooms_per_building=60, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.variant = variant
+        self.rooms_per_building = rooms_per_building
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            return self.rng.random(), self.rng.random(), self.rng.uniform(-1, 1)
+
+
+def _parse_form(handler: BaseHTTPRequestHandler) -> Dict[str, str]:
+    """兼容 x-www-form-urlencoded（dianfei_core）和 multipart/form-data（fetch_rooms）。"""
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    ctype = handler.headers.get("Content-Type", "")
+    if ctype.startswith("multipart/form-data"):
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + ctype.encode("latin-1") + b"\r\n\r\n" + body
+        )
+        form = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name:
+                form[name] = part.get_payload(decode=True).decode("utf-8")
+        return form
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实接口一致
+    disable_nagle_algorithm = True  # 头和正文分两次写，不关 Nagle 会被延迟 ACK 拖慢约 40ms
+    config: MockConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, ctype: str = "application/json;charset=UTF-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != PATH:
+            self._send(404, b'{"msg":"not found"}')
+            return
+        form = _parse_form(self)
+        cfg = self.config
+        r_err, r_stall, r_jitter = cfg.draw()
+
+        delay = cfg.latency_ms + cfg.jitter_ms * r_jitter
+        if r_stall < cfg.stall_rate:
+            delay += cfg.stall_ms
+        time.sleep(max(delay, 0) / 1000.0)
+
+        if r_err < cfg.error_rate:
+            # 一半返回 5xx，一半返回 HTML 错误页（模拟网关/登录失效），两种都要能被客户端正确报错
+            if r_err < cfg.error_rate / 2:
+                self._send(502, b'{"msg":"bad gateway"}')
+            else:
+                self._send(200, "<html>登录已失效</html>".encode("utf-8"), "text/html;charset=UTF-8")
+            return
+
+        campus, building, room = form.get("campus", ""), form.get("building", ""), form.get("room", "")
+        if form.get("type") == "select" or form.get("level") == "2":
+            payload = {"success": True, "map": {"data": _room_list(building, cfg.rooms_per_building)}}
+        else:
+            balance = _room_balance(campus, building, room)
+            payload = {"success": True, "map": {"showData": _show_data(balance, cfg.variant)}}
+        self._send(200, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+def start_mock(host: str = "127.0.0.1", port: int = 0, config: MockConfig = None) -> ThreadingHTTPServer:
+    """在后台线程启动 mock，返回 server（server.server_port 为实际端口）。"""
+    handler = type("BoundMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="mock-upstream", daemon=True).start()
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟电费上游接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="基础延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟的均匀抖动幅度（±）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 502/非 JSON 的比例")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="偶发长时间卡顿的比例")
+    parser.add_argument("--stall-ms", type=float, default=3000.0, help="卡顿时额外增加的延迟")
+    parser.add_argument("--variant", choices=VARIANTS, default="string", help="showData 的返回形态")
+    parser.add_argument("--rooms-per-building", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    cfg = MockConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.stall_rate, args.stall_ms,
+                     args.variant, args.rooms_per_building, args.seed)
+    httpd = start_mock(args.host, args.port, cfg)
+    print(f"[mock] listening on http://{args.host}:{httpd.server_port}{PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
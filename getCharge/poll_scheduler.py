@@ -0,0 +1,227 @@
+# poll_scheduler.py —— 按预计耗尽时间自适应轮询：快到阈值/掉得快的房间常查，电量充足的房间少查
+#
+# 优先队列（heapq）按下次应查询时间排序；所有上游请求共用一个全局令牌桶。
+# 每查一次，用该房间的用电速率估计还有多久跌到阈值，下次查询安排在这段时间的 POLL_SAFETY 倍之后，
+# 并限制在 [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL] 内。
+# 统计中的 uniform_calls 是“以 POLL_MIN_INTERVAL 为周期全量扫描同一批房间”所需的上游请求数。
+# 用法：
+#   python poll_scheduler.py --campus 2sh --rps 2 --duration 3600
+import argparse
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent import futures
+from typing import Callable, Dict, List, Optional
+
+from dianfei_core import logger
+from rate_limit import TokenBucket
+from room_catalog import Room, get_catalog
+
+POLL_MIN_INTERVAL = float(os.getenv("DIANFEI_POLL_MIN_INTERVAL", "600"))     # 秒
+POLL_MAX_INTERVAL = float(os.getenv("DIANFEI_POLL_MAX_INTERVAL", "21600"))   # 秒
+POLL_SAFETY = float(os.getenv("DIANFEI_POLL_SAFETY", "0.25"))
+POLL_RPS = float(os.getenv("DIANFEI_POLL_RPS", "2"))
+POLL_WORKERS = int(os.getenv("DIANFEI_POLL_WORKERS", "8"))
+# 还没有任何历史时假定的用电速率（度/小时），取偏大的值，宁可多查
+POLL_DEFAULT_RATE = float(os.getenv("DIANFEI_POLL_DEFAULT_RATE", "1.0"))
+# 用电速率的指数平滑系数
+POLL_RATE_ALPHA = float(os.getenv("DIANFEI_POLL_RATE_ALPHA", "0.3"))
+
+
+class _RoomState:
+    __slots__ = ("room", "value", "ts", "rate", "polls", "errors")
+
+    def __init__(self, room: Room, rate: Optional[float] = None):
+        self.room = room
+        self.value: Optional[float] = None
+        self.ts = 0.0
+        self.rate = rate        # 度/小时；None 表示未知
+        self.polls = 0
+        self.errors = 0
+
+    def update(self, value: float, now: float, alpha: float):
+        if self.value is not None and now > self.ts and value <= self.value:
+            inst = (self.value - value) / ((now - self.ts) / 3600)
+            self.rate = inst if self.rate is None else alpha * inst + (1 - alpha) * self.rate
+        # 读数上升视为充值，保留原速率
+        self.value, self.ts = value, now
+
+
+class AdaptivePoller:
+    def __init__(self, rooms: List[Room], query: Callable[[Room], float], threshold: float,
+                 bucket: TokenBucket, workers: int = POLL_WORKERS,
+                 min_interval: float = POLL_MIN_INTERVAL, max_interval: float = POLL_MAX_INTERVAL,
+                 safety: float = POLL_SAFETY, default_rate: float = POLL_DEFAULT_RATE,
+                 rate_alpha: float = POLL_RATE_ALPHA, rate_hint: Optional[Callable[[Room], Optional[float]]] = None):
+        self.query = query
+        self.threshold = threshold
+        self.bucket = bucket
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.safety = safety
+        self.default_rate = default_rate
+        self.rate_alpha = rate_alpha
+        self._pool = futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="poll")
+        self._slots = threading.Semaphore(max(workers, 1))
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._heap: List = []
+        self._seq = 0
+        self._states: List[_RoomState] = []
+        self.calls = self.errors = 0
+        self.started_at = self.finished_at = 0.0
+
+        now = time.monotonic()
+        span = min_interval
+        for i, room in enumerate(rooms):
+            self._states.append(_RoomState(room, rate_hint(room) if rate_hint else None))
+            # 首轮均匀摊开在一个最短周期内，避免启动时集中打上游
+            self._push(i, now + span * i / max(len(rooms), 1))
+
+    def _push(self, idx: int, due: float):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, idx))
+
+    def next_interval(self, st: _RoomState) -> float:
+        """按当前电量和速率估计距离阈值的时间，乘以安全系数作为下次间隔。"""
+        if st.value is None or st.value <= self.threshold:
+            return self.min_interval
+        rate = st.rate if st.rate is not None else self.default_rate
+        if rate <= 0:
+            return self.max_interval
+        hours_left = (st.value - self.threshold) / rate
+        return min(max(hours_left * 3600 * self.safety, self.min_interval), self.max_interval)
+
+    def _poll_one(self, idx: int):
+        st = self._states[idx]
+        try:
+            value = float(self.query(st.room))
+            err = None
+        except Exception as e:
+            value, err = None, e
+        now = time.monotonic()
+        with self._cond:
+            self.calls += 1
+            st.polls += 1
+            if err is None:
+                st.update(value, now, self.rate_alpha)
+                delay = self.next_interval(st)
+            else:
+                self.errors += 1
+                st.errors += 1
+                delay = self.min_interval
+                logger.warning(f"[poll] 查询失败：{st.room.name} {type(err).__name__}: {err}")
+            self._push(idx, now + delay)
+            self._cond.notify()
+        self._slots.release()
+
+    def run(self, duration: Optional[float] = None):
+        """按到期顺序调度，直到 stop() 或运行满 duration 秒。"""
+        self.started_at, self.finished_at = time.monotonic(), 0.0
+        end = None if duration is None else self.started_at + duration
+        while not self._stop.is_set():
+            with self._cond:
+                while self._heap and not self._stop.is_set():
+                    wait = self._heap[0][0] - time.monotonic()
+                    if end is not None:
+                        wait = min(wait, end - time.monotonic())
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._stop.is_set() or (end is not None and time.monotonic() >= end):
+                    break
+                if not self._heap:
+                    self._cond.wait(1.0)
+                    continue
+                _, _, idx = heapq.heappop(self._heap)
+            # 在途数量和全局速率都受限，拿不到时这里阻塞，到期的房间在堆里等着
+            self._slots.acquire()
+            self.bucket.acquire()
+            self._pool.submit(self._poll_one, idx)
+        self._pool.shutdown(wait=True)
+        self.finished_at = time.monotonic()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at if self.started_at else 0.0
+        uniform = len(self._states) * elapsed / self.min_interval if self.min_interval > 0 else 0.0
+        # 全量扫描在第 0 秒也要先查一遍
+        uniform = int(uniform) + len(self._states) if elapsed > 0 else 0
+        with self._cond:
+            calls, errors = self.calls, self.errors
+            due = sorted(d for d, _, _ in self._heap)
+            low = sum(1 for s in self._states if s.value is not None and s.value <= self.threshold)
+        return {
+            "rooms": len(self._states),
+            "elapsed_s": round(elapsed, 1),
+            "calls": calls,
+            "errors": errors,
+            "uniform_calls": uniform,
+            "saved_calls": max(uniform - calls, 0),
+            "saved_ratio": round(1 - calls / uniform, 4) if uniform else 0.0,
+            "below_threshold": low,
+            "next_due_in_s": round(due[0] - time.monotonic(), 1) if due else 0.0,
+        }
+
+
+def _store_rate_hint(room: Room) -> Optional[float]:
+    """用本地读数（readings_store）里的历史速率作为初始速率。"""
+    from readings_store import get_store
+
+    store = get_store()
+    if store is None:
+        return None
+    rate = store.consumption_rate((room.campus, room.building, room.room),
+                                  item=(room.feeitemid, room.type, room.level))
+    return rate["kwh_per_hour"] if rate["samples"] >= 2 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按预计耗尽时间自适应轮询房间电量")
+    parser.add_argument("--campus", default="")
+    parser.add_argument("--building", default="")
+    parser.add_argument("--name-prefix", default="")
+    parser.add_argument("--threshold", type=float, default=None, help="默认取 email.json 中 room=-1 的阈值")
+    parser.add_argument("--rps", type=float, default=POLL_RPS, help="全局每秒上游请求数上限")
+    parser.add_argument("--workers", type=int, default=POLL_WORKERS)
+    parser.add_argument("--min-interval", type=float, default=POLL_MIN_INTERVAL)
+    parser.add_argument("--max-interval", type=float, default=POLL_MAX_INTERVAL)
+    parser.add_argument("--duration", type=float, default=None, help="运行多少秒后退出并输出统计")
+    parser.add_argument("--report-interval", type=float, default=60.0)
+    args = parser.parse_args()
+
+    threshold = args.threshold
+    if threshold is None:
+        from alerts import load_watch_list
+        threshold = load_watch_list()[2]
+
+    # 走与 gRPC 服务相同的查询路径：结果缓存 + 单飞 + 读数落库
+    from server import DianFeiServiceImpl
+    servicer = DianFeiServiceImpl()
+    rooms = list(get_catalog().filter(args.campus, args.building, args.name_prefix))
+    poller = AdaptivePoller(rooms, lambda r: servicer._query(r.payload()), threshold,
+                            TokenBucket(args.rps, burst=1), args.workers, args.min_interval, args.max_interval,
+                            rate_hint=_store_rate_hint)
+    logger.info(f"[poll] 开始：rooms={len(rooms)} threshold={threshold} rps={args.rps}")
+
+    def report():
+        while not poller._stop.wait(args.report_interval):
+            logger.info(f"[poll] {poller.stats()}")
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        poller.run(args.duration)
+    except KeyboardInterrupt:
+        poller.stop()
+    poller.stop()
+    print(json.dumps(poller.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# rate_limit.py —— 线程安全的令牌桶：多个工作线程共享一个全局每秒请求预算
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    每秒补充 rate 个令牌，桶容量 burst。acquire() 拿不到令牌时睡到下一个令牌产生，
+    因此无论多少线程并发，整体请求速率都不超过 rate（允许最多 burst 个的突发）。
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.capacity = max(float(burst), 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def acquire(self, n: float = 1.0, timeout: float = None) -> bool:
+        """阻塞直到拿到 n 个令牌；超过 timeout 秒仍拿不到返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return True
+                wait = (n - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
@@ -0,0 +1,239 @@
+# readings_store.py —— 电量读数的本地时序存储（SQLite WAL，后台线程批量写入）
+#
+# 每次真正打到上游的成功结果都会追加一条 (campus, building, room, feeitemid, type, level, ts_ms, value)，
+# 供历史曲线、用电速率和预计用完时间查询，仪表盘刷新不必再打上游。
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+# 数据库路径；设为空字符串关闭存储。默认放在 data/ 目录下，容器里把该目录挂到宿主机（见 start.txt），
+# 否则重建容器后读数随之丢失
+READINGS_DB = os.getenv("DIANFEI_READINGS_DB", os.path.join(BASEDIR, "data", "readings.db"))
+# 后台写线程：攒够 READINGS_BATCH 条或等了 READINGS_FLUSH_INTERVAL 秒就提交一次
+READINGS_BATCH = int(os.getenv("DIANFEI_READINGS_BATCH", "500"))
+READINGS_FLUSH_INTERVAL = float(os.getenv("DIANFEI_READINGS_FLUSH_INTERVAL", "1.0"))
+# 待写队列上限，写不过来时丢弃新读数（只影响历史，不影响查询结果）
+READINGS_QUEUE_SIZE = int(os.getenv("DIANFEI_READINGS_QUEUE_SIZE", "100000"))
+# 用电速率默认统计窗口（小时）
+RATE_WINDOW_HOURS = float(os.getenv("DIANFEI_RATE_WINDOW_HOURS", "72"))
+
+RoomKey = Tuple[str, str, str]  # (campus, building, room)
+ItemKey = Tuple[str, str, str]  # (feeitemid, type, level)：同一房间的不同计费项
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    campus   TEXT    NOT NULL,
+    building TEXT    NOT NULL,
+    room     TEXT    NOT NULL,
+    ts_ms    INTEGER NOT NULL,
+    value    REAL    NOT NULL,
+    feeitemid TEXT   NOT NULL DEFAULT '',
+    type     TEXT    NOT NULL DEFAULT '',
+    level    TEXT    NOT NULL DEFAULT ''
+);
+"""
+# 早期版本的表没有计费项三列：启动时补上（旧读数三列为空串），索引也换成含计费项的
+_ITEM_COLUMNS = ("feeitemid", "type", "level")
+_INDEX = """
+DROP INDEX IF EXISTS readings_room_ts;
+CREATE INDEX IF NOT EXISTS readings_room_item_ts ON readings (campus, building, room, feeitemid, type, level, ts_ms);
+"""
+
+_STOP = object()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(readings)")}
+    for name in _ITEM_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE readings ADD COLUMN {name} TEXT NOT NULL DEFAULT ''")
+    conn.executescript(_INDEX)
+
+
+def consumption(readings: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """
+    由按时间排序的 (ts_ms, value) 计算 (消耗的度数, 经过的小时数)。
+    读数上升视为充值，那一段不计入，也不计时间，所以充值不会把速率拉成负数。
+    """
+    used = hours = 0.0
+    for (t0, v0), (t1, v1) in zip(readings, readings[1:]):
+        if v1 > v0 or t1 <= t0:
+            continue
+        used += v0 - v1
+        hours += (t1 - t0) / 3_600_000
+    return used, hours
+
+
+class ReadingStore:
+    def __init__(self, path: str = READINGS_DB, batch: int = READINGS_BATCH,
+                 flush_interval: float = READINGS_FLUSH_INTERVAL, queue_size: int = READINGS_QUEUE_SIZE):
+        self.path = path
+        self.batch = max(batch, 1)
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(queue_size, 1))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.written = self.dropped = self.batches = self.write_errors = 0
+
+        conn = _connect(path)
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        conn.commit()
+        self._writer_conn = conn
+        self._thread = threading.Thread(target=self._write_forever, name="readings-writer", daemon=True)
+        self._thread.start()
+
+    # —— 写 ——
+    def record(self, key: RoomKey, value: float, ts_ms: Optional[int] = None, item: ItemKey = ("", "", "")):
+        """非阻塞追加一条读数；队列满时丢弃并计数。"""
+        row = (key[0], key[1], key[2], int(ts_ms if ts_ms is not None else time.time() * 1000), float(value),
+               item[0], item[1], item[2])
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _write_forever(self):
+        stop = False
+        while not stop:
+            rows = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                rows.append(item)
+                if len(rows) >= self.batch:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if rows:
+                self._flush(rows)
+        self._writer_conn.close()
+
+    def _flush(self, rows: list):
+        try:
+            with self._writer_conn:
+                self._writer_conn.executemany(
+                    "INSERT INTO readings (campus, building, room, ts_ms, value, feeitemid, type, level) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error:
+            with self._lock:
+                self.write_errors += 1
+            return
+        with self._lock:
+            self.written += len(rows)
+            self.batches += 1
+
+    def close(self, timeout: float = 5.0):
+        """写完队列里剩下的读数后停止写线程。"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # —— 读 ——
+    def _reader(self) -> sqlite3.Connection:
+        # WAL 下读写互不阻塞；每个线程一个只读连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    @staticmethod
+    def _where(key: RoomKey, item: Optional[ItemKey]) -> Tuple[str, list]:
+        sql = " WHERE campus=? AND building=? AND room=?"
+        args = [key[0], key[1], key[2]]
+        if item is not None:
+            sql += " AND feeitemid=? AND type=? AND level=?"
+            args.extend(item)
+        return sql, args
+
+    def history(self, key: RoomKey, since_ms: int = 0, until_ms: int = 0, limit: int = 0,
+                item: Optional[ItemKey] = None) -> List[Tuple[int, float]]:
+        """
+        按时间升序返回 (ts_ms, value)；limit>0 时只返回最近的 limit 条。
+        给了 item 时只取该计费项的读数（同一房间不同计费项的读数混在一起没有意义）。
+        """
+        where, args = self._where(key, item)
+        sql = "SELECT ts_ms, value FROM readings" + where + " AND ts_ms>=?"
+        args.append(since_ms)
+        if until_ms > 0:
+            sql += " AND ts_ms<=?"
+            args.append(until_ms)
+        sql += " ORDER BY ts_ms DESC"
+        if limit > 0:
+            sql += " LIMIT ?"
+            args.append(limit)
+        rows = self._reader().execute(sql, args).fetchall()
+        rows.reverse()
+        return rows
+
+    def latest(self, key: RoomKey, item: Optional[ItemKey] = None) -> Optional[Tuple[int, float]]:
+        """该房间（给了 item 时限定该计费项）最近一条已落盘的读数 (ts_ms, value)；没有时返回 None。"""
+        where, args = self._where(key, item)
+        return self._reader().execute(
+            "SELECT ts_ms, value FROM readings" + where + " ORDER BY ts_ms DESC LIMIT 1", args).fetchone()
+
+    def consumption_rate(self, key: RoomKey, window_hours: float = RATE_WINDOW_HOURS,
+                         item: Optional[ItemKey] = None) -> Dict[str, float]:
+        """
+        最近 window_hours 小时（给了 item 时只看该计费项）的平均用电速率（度/小时）和按该速率预计用完的小时数。
+        样本不足或期间没有用电时 kwh_per_hour=0、hours_to_empty=-1。
+        """
+        since = int((time.time() - window_hours * 3600) * 1000)
+        rows = self.history(key, since_ms=since, item=item)
+        out = {"samples": len(rows), "kwh_per_hour": 0.0, "hours_to_empty": -1.0,
+               "latest_value": 0.0, "latest_ts_ms": 0}
+        if not rows:
+            return out
+        out["latest_ts_ms"], out["latest_value"] = rows[-1]
+        used, hours = consumption(rows)
+        if used > 0 and hours > 0:
+            rate = used / hours
+            out["kwh_per_hour"] = rate
+            out["hours_to_empty"] = max(out["latest_value"], 0.0) / rate
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "write_errors": self.write_errors,
+                "queued": self._queue.qsize(),
+            }
+
+
+_store: Optional[ReadingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[ReadingStore]:
+    """进程内共享的读数存储；DIANFEI_READINGS_DB 为空时返回 None。"""
+    global _store
+    if _store is None and READINGS_DB:
+        with _store_lock:
+            if _store is None:
+                os.makedirs(os.path.dirname(os.path.abspath(READINGS_DB)), exist_ok=True)
+                _store = ReadingStore(READINGS_DB)
+                atexit.register(_store.close)
+    return _store
@@ -0,0 +1,371 @@
+# result_cache.py —— 电量查询结果的 LRU+TTL 缓存，并发未命中时合并为一次上游调用
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+CACHE_TTL = float(os.getenv("DIANFEI_CACHE_TTL", "60"))       # 新鲜期（秒），<=0 表示不缓存结果
+CACHE_SIZE = int(os.getenv("DIANFEI_CACHE_SIZE", "10000"))    # 最多缓存的房间数
+# stale-while-revalidate：超过 CACHE_TTL（软 TTL）但未超过 CACHE_HARD_TTL 的值立即返回，同时后台刷新；
+# 超过硬 TTL 才阻塞等上游。CACHE_SWR=0 时行为与普通 TTL 缓存相同
+CACHE_SWR = os.getenv("DIANFEI_CACHE_SWR", "0") not in ("0", "false", "no")
+CACHE_HARD_TTL = float(os.getenv("DIANFEI_CACHE_HARD_TTL", "600"))
+# 等待者每隔这么多秒调用一次 wait_check，检查自己的调用方是否已放弃
+FOLLOWER_POLL = 0.05
+
+# 返回值的来源
+SOURCE_LIVE = "live"    # 本次（或同时进行的同一键请求）刚从上游取到
+SOURCE_CACHE = "cache"  # 软 TTL 内的缓存
+SOURCE_STALE = "stale"  # 超过软 TTL 的旧值（SWR 模式或上游熔断时）
+
+KEY_FIELDS = ("campus", "building", "room", "feeitemid", "type", "level")
+
+
+def cache_key(payload: Dict[str, Any]) -> Tuple[str, ...]:
+    """按 (campus, building, room, feeitemid, type, level) 生成缓存键。"""
+    return tuple(str(payload.get(k, "")) for k in KEY_FIELDS)
+
+
+class _Flight:
+    """一次进行中的上游调用；同一键的其它请求等在 done 上共享结果。"""
+
+    __slots__ = ("done", "value", "fetched_at", "error", "source")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.fetched_at = 0.0
+        self.error: Optional[BaseException] = None
+        self.source = SOURCE_LIVE
+
+
+class ResultCache:
+    """
+    线程安全的 LRU+TTL 缓存：
+    - 命中且未过期：直接返回；
+    - 未命中：同一键只有一个线程（leader）去调用 loader，其余线程等待并共享结果或异常；
+    - 过期条目不会立刻删除，peek() 仍可取到（供降级使用），超出 max_size 时按 LRU 淘汰；
+    - swr=True 时，超过 ttl 但未超过 hard_ttl 的条目立即返回并在 refresh_pool 中后台刷新（同一键只刷一次）；
+    - leader 因 abandon_errors 中的异常放弃（如它的调用方已取消）时，等待者不共享该异常，而是重新竞争 leader；
+    - 给了 wait_check 时，等待者每 FOLLOWER_POLL 秒调用一次，它抛出的异常让该等待者立即离开
+      （如调用方已取消/超时），不必陪着 leader 等到上游返回；
+    - 给了 persisted 时，内存未命中先查它（如本地读数库，重启后不丢），未过期的直接返回，
+      过期的也放进内存供 peek() 降级使用，再去调用 loader。
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_size: int = CACHE_SIZE, swr: bool = CACHE_SWR,
+                 hard_ttl: float = CACHE_HARD_TTL, refresh_pool=None, abandon_errors: tuple = (),
+                 persisted: Optional[Callable[[Hashable], Optional[Tuple[Any, float]]]] = None,
+                 wait_check: Optional[Callable[[], None]] = None):
+        self.ttl = ttl
+        self.abandon_errors = abandon_errors
+        self.wait_check = wait_check
+        self.persisted = persisted
+        self.max_size = max_size
+        self.swr = swr and ttl > 0
+        self.hard_ttl = max(hard_ttl, ttl)
+        self.refresh_pool = refresh_pool
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.evictions = 0
+        self.stale_served = 0
+        self.refreshes = 0
+        self.persisted_hits = 0
+
+    def _fresh(self, fetched_at: float) -> bool:
+        return self.ttl > 0 and time.time() - fetched_at < self.ttl
+
+    def put(self, key: Hashable, value: Any, fetched_at: Optional[float] = None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._store(key, value, time.time() if fetched_at is None else fetched_at)
+
+    def _store(self, key, value, fetched_at):
+        self._data[key] = (value, fetched_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """返回 (value, fetched_at)，不论是否过期；不影响命中统计。"""
+        with self._lock:
+            return self._data.get(key)
+
+    def is_fresh(self, key: Hashable) -> bool:
+        """key 在缓存中且未超过软 TTL；不影响命中统计。"""
+        entry = self.peek(key)
+        return entry is not None and self._fresh(entry[1])
+
+    def _lookup_fresh(self, key: Hashable):
+        """
+        调用方需持有 _lock。命中软 TTL 内的条目返回 (value, fetched_at, SOURCE_CACHE)；
+        SWR 模式下命中硬 TTL 内的条目返回 (value, fetched_at, SOURCE_STALE)，调用方负责触发刷新；否则返回 None。
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if self._fresh(entry[1]):
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1], SOURCE_CACHE
+        if self.swr and time.time() - entry[1] < self.hard_ttl:
+            self._data.move_to_end(key)
+            self.stale_served += 1
+            return entry[0], entry[1], SOURCE_STALE
+        return None
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        return self.get_or_load_entry(key, loader)[0]
+
+    def get_or_load_entry(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, float, str]:
+        """返回 (value, fetched_at, source)，source 为 SOURCE_LIVE/SOURCE_CACHE/SOURCE_STALE。"""
+        while True:
+            with self._lock:
+                hit = self._lookup_fresh(key)
+                if hit is not None:
+                    if hit[2] == SOURCE_STALE:
+                        self._start_refresh(key, loader)
+                    return hit
+                flight = self._inflight.get(key)
+                if flight is not None:
+                    self.coalesced += 1
+                    leader = False
+                else:
+                    self.misses += 1
+                    flight = self._inflight[key] = _Flight()
+                    leader = True
+
+            if leader:
+                self._run_flight(key, flight, loader)
+            else:
+                self._follow(flight)
+            if flight.error is None:
+                return flight.value, flight.fetched_at, flight.source
+            if leader or not isinstance(flight.error, self.abandon_errors):
+                raise flight.error
+
+    def _follow(self, flight: _Flight):
+        if self.wait_check is None:
+            flight.done.wait()
+            return
+        while not flight.done.wait(FOLLOWER_POLL):
+            self.wait_check()
+
+    def _load_persisted(self, key) -> Optional[Tuple[Any, float]]:
+        if self.persisted is None or self.ttl <= 0:
+            return None
+        try:
+            return self.persisted(key)
+        except Exception:
+            return None  # 持久层出错只是少了一次命中，不影响查询
+
+    def _persisted_source(self, entry: Optional[Tuple[Any, float]]) -> Optional[str]:
+        """持久层的条目可以直接返回时给出 SOURCE_CACHE（未过期）或 SOURCE_STALE（SWR 硬 TTL 内），否则 None。"""
+        if entry is None:
+            return None
+        if self._fresh(entry[1]):
+            return SOURCE_CACHE
+        if self.swr and time.time() - entry[1] < self.hard_ttl:
+            return SOURCE_STALE
+        return None
+
+    def _run_flight(self, key, flight: _Flight, loader, use_persisted: bool = True):
+        entry = self._load_persisted(key) if use_persisted else None
+        try:
+            source = self._persisted_source(entry)
+            if source is not None:
+                flight.value, flight.fetched_at = entry
+                flight.source = source
+                with self._lock:
+                    self.persisted_hits += 1
+            else:
+                flight.value = loader()
+                flight.fetched_at = time.time()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+                if entry is not None:
+                    self._store(key, entry[0], entry[1])
+        else:
+            if self.ttl > 0:
+                with self._lock:
+                    self._store(key, flight.value, flight.fetched_at)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.source == SOURCE_STALE:
+                    self._start_refresh(key, loader)
+            flight.done.set()
+
+    def _start_refresh(self, key, loader):
+        """调用方需持有 _lock；该键没有进行中的调用时，在 refresh_pool 中后台重新加载。"""
+        if key in self._inflight or self.refresh_pool is None:
+            return
+        flight = self._inflight[key] = _Flight()
+        self.refreshes += 1
+        self.refresh_pool.submit(self._run_flight, key, flight, loader, False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "evictions": self.evictions,
+                "stale_served": self.stale_served,
+                "refreshes": self.refreshes,
+                "persisted_hits": self.persisted_hits,
+                "inflight": len(self._inflight),
+                "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
+
+
+class AsyncResultCache(ResultCache):
+    """
+    供 grpc.aio 使用的版本：存储与统计与 ResultCache 相同，
+    单飞合并改用 asyncio.Future，等待时不占线程。只能在同一个事件循环中使用。
+    每个键记录等待者数量：最后一个等待者被取消（调用方都已放弃）时取消 leader 任务，上游请求随之中断；
+    SWR 的后台刷新没有等待者，不受影响。
+    persisted 的语义与 ResultCache 相同；它是阻塞调用，在事件循环的默认线程池中执行。
+    leader 与后台刷新任务在空白上下文中运行，不继承触发它的那个调用方的 CallScope（截止时间）；
+    每个等待者按自己的 wait_timeout() 等待，到期后调用 wait_check()（应抛出异常，如 UpstreamCancelled）离开。
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_size: int = CACHE_SIZE, swr: bool = CACHE_SWR,
+                 hard_ttl: float = CACHE_HARD_TTL,
+                 persisted: Optional[Callable[[Hashable], Optional[Tuple[Any, float]]]] = None,
+                 wait_check: Optional[Callable[[], None]] = None,
+                 wait_timeout: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(ttl, max_size, swr, hard_ttl, persisted=persisted, wait_check=wait_check)
+        self.wait_timeout = wait_timeout if wait_check is not None else None
+        self._afutures: Dict[Hashable, "asyncio.Future"] = {}
+        # 事件循环只持有任务的弱引用，这里保留强引用直到任务结束，避免执行中途被回收
+        self._tasks: "set[asyncio.Task]" = set()
+        # 按共享 future 计：leader 任务与等待者数量
+        self._leads: Dict["asyncio.Future", "asyncio.Task"] = {}
+        self._waiters: Dict["asyncio.Future", int] = {}
+        self.abandoned = 0
+
+    def stats(self) -> Dict[str, float]:
+        out = super().stats()
+        with self._lock:
+            out["abandoned"] = self.abandoned
+        return out
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        return (await self.get_or_load_entry_async(key, loader))[0]
+
+    def _start_flight(self, key, loader, use_persisted: bool = True) -> "asyncio.Future":
+        """调用方需持有 _lock；后台启动一次加载，返回共享的 future（结果为 (value, fetched_at, source)）。"""
+        fut = self._afutures[key] = asyncio.get_running_loop().create_future()
+        self._inflight[key] = None  # 仅用于 stats() 中的 inflight 计数
+        fut.add_done_callback(_consume_exception)
+        task = self._leads[fut] = asyncio.get_running_loop().create_task(
+            self._lead(key, fut, loader, use_persisted), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return fut
+
+    async def get_or_load_entry_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        with self._lock:
+            hit = self._lookup_fresh(key)
+            if hit is not None:
+                if hit[2] == SOURCE_STALE and key not in self._afutures:
+                    self.refreshes += 1
+                    self._start_flight(key, loader, use_persisted=False)
+                return hit
+            fut = self._afutures.get(key)
+            if fut is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                fut = self._start_flight(key, loader)
+            self._waiters[fut] = self._waiters.get(fut, 0) + 1
+        try:
+            return await self._wait(fut)
+        finally:
+            self._leave(fut)
+
+    async def _wait(self, fut):
+        # shield：某个等待者被取消或超时时，不影响其他等待者共享的那次上游调用
+        while True:
+            timeout = self.wait_timeout() if self.wait_timeout is not None else None
+            if timeout is not None and timeout <= 0:
+                self.wait_check()
+                timeout = FOLLOWER_POLL  # wait_check 没有抛出（如计时误差）：稍后再查
+            try:
+                return await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except asyncio.TimeoutError:
+                if fut.done():
+                    return fut.result()
+
+    def _leave(self, fut):
+        with self._lock:
+            left = self._waiters.get(fut, 1) - 1
+            if left > 0:
+                self._waiters[fut] = left
+                return
+            self._waiters.pop(fut, None)
+            task = self._leads.get(fut) if not fut.done() else None
+            if task is not None:
+                self.abandoned += 1
+        if task is not None:
+            task.cancel()
+
+    async def _lead(self, key, fut, loader, use_persisted: bool = True):
+        entry, source = None, SOURCE_LIVE
+        try:
+            if use_persisted and self.persisted is not None and self.ttl > 0:
+                entry = await asyncio.get_running_loop().run_in_executor(None, self._load_persisted, key)
+            persisted_source = self._persisted_source(entry)
+            if persisted_source is not None:
+                (value, fetched_at), source = entry, persisted_source
+                with self._lock:
+                    self.persisted_hits += 1
+            else:
+                value = await loader()
+                fetched_at = time.time()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+                if entry is not None:
+                    self._store(key, entry[0], entry[1])
+            fut.set_exception(e)
+        else:
+            if self.ttl > 0:
+                with self._lock:
+                    self._store(key, value, fetched_at)
+            fut.set_result((value, fetched_at, source))
+        finally:
+            with self._lock:
+                self._afutures.pop(key, None)
+                self._inflight.pop(key, None)
+                self._leads.pop(fut, None)
+                if source == SOURCE_STALE:
+                    self.refreshes += 1
+                    self._start_flight(key, loader, use_persisted=False)
+
+
+def _consume_exception(fut: "asyncio.Future"):
+    # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+    if not fut.cancelled():
+        fut.exception()
@@ -0,0 +1,282 @@
+# room_catalog.py —— rooms_all.json 的紧凑内存表示与索引（按键 / 房间名 / 名称前缀查找）
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+ROOMS_FILE = os.path.join(BASEDIR, "rooms_all.json")
+
+
+class Room(NamedTuple):
+    campus: str
+    building: str
+    room: str
+    name: str
+    feeitemid: str
+    type: str
+    level: str
+
+    def payload(self) -> Dict[str, str]:
+        """查询接口需要的 6 个字段。"""
+        return {
+            "campus": self.campus,
+            "building": self.building,
+            "room": self.room,
+            "feeitemid": self.feeitemid,
+            "type": self.type,
+            "level": self.level,
+        }
+
+
+class RoomNotFound(KeyError):
+    """按房间名找不到房间。"""
+
+
+class AmbiguousRoom(ValueError):
+    """同一房间名对应多个房间，需要补充 campus/building。"""
+
+
+class _Interner:
+    """字符串 -> 小整数 id 的表，用于 campus/building/(feeitemid,type,level) 这类高度重复的列。"""
+
+    def __init__(self):
+        self.values: List = []
+        self.ids: Dict = {}
+
+    def id(self, v) -> int:
+        i = self.ids.get(v)
+        if i is None:
+            i = self.ids[v] = len(self.values)
+            self.values.append(v)
+        return i
+
+
+class RoomCatalog:
+    """
+    列式存储：campus/building/profile 用 array 存 id，room/name 用驻留字符串列表；
+    索引：
+    - (campus, building, room) -> 行号（dict，O(1)）
+    - name -> 行号（同名多行时为 tuple）
+    - 按 name 排序的行号数组，支持楼栋/楼层前缀（如 "1-1"）的二分查找
+    - (campus, building) -> 行号列表
+    """
+
+    def __init__(self, records=(), source: str = ""):
+        t0 = time.perf_counter()
+        self.source = source
+        self._campuses = _Interner()
+        self._buildings = _Interner()
+        self._profiles = _Interner()
+        self._campus_col = array("H")
+        self._building_col = array("H")
+        self._profile_col = array("B")
+        self._room_col: List[str] = []
+        self._name_col: List[str] = []
+
+        intern = sys.intern
+        seen = set()
+        for rec in records:
+            campus = intern(str(rec.get("campus", "")))
+            building = intern(str(rec.get("building", "")))
+            room = intern(str(rec.get("room", "")))
+            key = (campus, building, room)
+            if key in seen:
+                continue
+            seen.add(key)
+            self._campus_col.append(self._campuses.id(campus))
+            self._building_col.append(self._buildings.id(building))
+            self._profile_col.append(self._profiles.id(
+                (str(rec.get("feeitemid", "")), str(rec.get("type", "")), str(rec.get("level", "")))
+            ))
+            self._room_col.append(room)
+            self._name_col.append(intern(str(rec.get("name", ""))))
+        self._build_indexes()
+        self.load_seconds = time.perf_counter() - t0
+
+    @classmethod
+    def from_columns(cls, campus_codes, building_codes, profiles, campus_ids, building_ids, profile_ids,
+                     rooms, names, source: str = "") -> "RoomCatalog":
+        """直接由列数据构造（二进制快照加载用），不经过逐行 dict。"""
+        t0 = time.perf_counter()
+        cat = cls.__new__(cls)
+        cat.source = source
+        intern = sys.intern
+        cat._campuses, cat._buildings, cat._profiles = _Interner(), _Interner(), _Interner()
+        for v in campus_codes:
+            cat._campuses.id(intern(v))
+        for v in building_codes:
+            cat._buildings.id(intern(v))
+        for v in profiles:
+            cat._profiles.id(tuple(v))
+        cat._campus_col = array("H", campus_ids)
+        cat._building_col = array("H", building_ids)
+        cat._profile_col = array("B", profile_ids)
+        cat._room_col = [intern(v) for v in rooms]
+        cat._name_col = [intern(v) for v in names]
+        cat._build_indexes()
+        cat.load_seconds = time.perf_counter() - t0
+        return cat
+
+    def _build_indexes(self):
+        campuses, buildings = self._campuses.values, self._buildings.values
+        self._by_key: Dict[Tuple[str, str, str], int] = {}
+        self._by_name: Dict[str, object] = {}
+        self._by_building: Dict[Tuple[str, str], array] = {}
+        for idx, (ci, bi, room, name) in enumerate(
+                zip(self._campus_col, self._building_col, self._room_col, self._name_col)):
+            campus, building = campuses[ci], buildings[bi]
+            self._by_key[(campus, building, room)] = idx
+            prev = self._by_name.get(name)
+            if prev is None:
+                self._by_name[name] = idx
+            elif isinstance(prev, tuple):
+                self._by_name[name] = prev + (idx,)
+            else:
+                self._by_name[name] = (prev, idx)
+            self._by_building.setdefault((campus, building), array("I")).append(idx)
+
+        order = sorted(range(len(self._name_col)), key=self._name_col.__getitem__)
+        self._sorted_idx = array("I", order)
+        self._sorted_names = [self._name_col[i] for i in order]
+
+    # —— 构造 ——
+    @classmethod
+    def load(cls, path: str = ROOMS_FILE) -> "RoomCatalog":
+        t0 = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        cat = cls(records, source=path)
+        cat.load_seconds = time.perf_counter() - t0
+        return cat
+
+    # —— 基本访问 ——
+    def __len__(self) -> int:
+        return len(self._room_col)
+
+    def __getitem__(self, idx: int) -> Room:
+        feeitemid, type_, level = self._profiles.values[self._profile_col[idx]]
+        return Room(
+            self._campuses.values[self._campus_col[idx]],
+            self._buildings.values[self._building_col[idx]],
+            self._room_col[idx],
+            self._name_col[idx],
+            feeitemid, type_, level,
+        )
+
+    def __iter__(self) -> Iterator[Room]:
+        for i in range(len(self)):
+            yield self[i]
+
+    # —— 查找 ——
+    def get(self, campus: str, building: str, room: str) -> Optional[Room]:
+        idx = self._by_key.get((campus, building, room))
+        return None if idx is None else self[idx]
+
+    def find_by_name(self, name: str, campus: str = "", building: str = "") -> List[Room]:
+        hit = self._by_name.get(name)
+        if hit is None:
+            return []
+        rows = hit if isinstance(hit, tuple) else (hit,)
+        out = [self[i] for i in rows]
+        if campus:
+            out = [r for r in out if r.campus == campus]
+        if building:
+            out = [r for r in out if r.building == building]
+        return out
+
+    def resolve_name(self, name: str, campus: str = "", building: str = "") -> Room:
+        """房间名 -> 唯一房间；找不到抛 RoomNotFound，多于一个抛 AmbiguousRoom。"""
+        rooms = self.find_by_name(name, campus, building)
+        if not rooms:
+            raise RoomNotFound(f"找不到房间名 {name!r}（campus={campus!r}, building={building!r}）")
+        if len(rooms) > 1:
+            where = ", ".join(f"{r.campus}/{r.building}/{r.room}" for r in rooms[:5])
+            raise AmbiguousRoom(f"房间名 {name!r} 对应 {len(rooms)} 个房间（{where}），请补充 campus/building")
+        return rooms[0]
+
+    def _prefix_rows(self, prefix: str) -> Iterator[int]:
+        names = self._sorted_names
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            yield self._sorted_idx[i]
+            i += 1
+
+    def filter(self, campus: str = "", building: str = "", name_prefix: str = "") -> Iterator[Room]:
+        """按 campus / building / 房间名前缀筛选，空字符串表示不限。"""
+        if name_prefix:
+            for i in self._prefix_rows(name_prefix):
+                r = self[i]
+                if (not campus or r.campus == campus) and (not building or r.building == building):
+                    yield r
+            return
+        if campus and building:
+            for i in self._by_building.get((campus, building), ()):
+                yield self[i]
+            return
+        for r in self:
+            if (not campus or r.campus == campus) and (not building or r.building == building):
+                yield r
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rooms": len(self),
+            "campuses": len(self._campuses.values),
+            "buildings": len(self._by_building),
+            "distinct_names": len(self._by_name),
+            "load_seconds": round(self.load_seconds, 4),
+            "source": os.path.basename(self.source),
+        }
+
+
+_catalog: Optional[RoomCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> RoomCatalog:
+    """
+    进程内共享的房间目录，第一次使用时加载：
+    二进制快照（rooms_catalog.pb）与 rooms_all.json 内容一致时用快照，否则解析 JSON。
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                from catalog_snapshot import load_catalog
+                _catalog = load_catalog()
+    return _catalog
+
+
+if __name__ == "__main__":
+    # 报告加载耗时、内存占用（与直接 json.load 的 dict 列表对比）和查找耗时
+    import tracemalloc
+
+    tracemalloc.start()
+    with open(ROOMS_FILE, "r", encoding="utf-8") as f:
+        flat = json.load(f)
+    flat_bytes = tracemalloc.get_traced_memory()[0]
+    del flat
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    cat = RoomCatalog.load()
+    cat_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    sample = [cat[i] for i in range(0, len(cat), max(len(cat) // 1000, 1))]
+    t0 = time.perf_counter()
+    for r in sample:
+        cat.get(r.campus, r.building, r.room)
+        cat.find_by_name(r.name, r.campus)
+    per_lookup = (time.perf_counter() - t0) / (2 * len(sample))
+
+    print(json.dumps({
+        **cat.stats(),
+        "memory_bytes_catalog": cat_bytes,
+        "memory_bytes_json_dicts": flat_bytes,
+        "lookup_us": round(per_lookup * 1e6, 2),
+    }, ensure_ascii=False, indent=2))
@@ -1,41 +1,359 @@
 # server.py  —— gRPC + Protobuf 版本（不要再用 dubbo-python）
+import argparse
+import contextvars
+import itertools
 import json
+import os
+import signal
+import threading
+import time
 import grpc
 from concurrent import futures
+from contextlib import contextmanager
+from typing import Dict, Tuple
 
 import dianfei_pb2
 import dianfei_pb2_grpc
 
 # 复用你的函数：入参 JSON 字符串，返回 float
-from dianfei_core import query_current_electricity
+from dianfei_core import query_current_electricity, logger
+from http_client import UpstreamCancelled, call_scope, check_current_scope, get_client
+from hedge import HEDGE_ENABLED, get_hedger
+from result_cache import ResultCache, cache_key, SOURCE_STALE
+from room_catalog import AmbiguousRoom, RoomNotFound, get_catalog
+from readings_store import get_store
+from circuit_breaker import CircuitOpenError, get_guard
+from metrics import (
+    METRICS_PORT, RPC_SECONDS, RPC_INFLIGHT, RPC_TOTAL, POOL_QUEUE_DEPTH, UPSTREAM_POOL, WARMUP,
+    register_stats, start_metrics_server,
+)
+from service_common import (
+    STATS_INTERVAL, BATCH_CONCURRENCY, BATCH_MAX_ITEMS, SWEEP_CONCURRENCY, SWEEP_MAX_CONCURRENCY, SHUTDOWN_GRACE,
+    RPC_STUCK_TIMEOUT, server_options, _ready_always,
+    _iter_sweep_rooms, _request_to_payload, _abort_on_bad_room, _abort_cancelled, _error_text, _stale_entry, _mark_stale,
+    _query_reply, _record_reading, _history_reply, _consumption_reply, _persisted_reading,
+    register_store_metrics, register_cache_metrics,
+)
+from warmup import make_warmup
+
+# 批量查询：所有批次共享的线程池大小
+FANOUT_WORKERS = int(os.getenv("DIANFEI_FANOUT_WORKERS", "16"))
+
+_fanout_pool = futures.ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+@contextmanager
+def _upstream_scope(context):
+    """
+    让本次 RPC 期间的上游请求遵守调用方的截止时间，并在 RPC 被取消/结束时中断仍在进行的上游请求。
+    add_callback 在 RPC 已终止时返回 False，此时直接视为已取消。
+    """
+    with call_scope(context.time_remaining()) as scope:
+        if not context.add_callback(scope.cancel):
+            scope.cancel()
+        yield scope
+
+
+def _fan_out(items, fn, limit: int):
+    """
+    在共享线程池上并发执行 fn(item)，任何时刻最多 limit 个在途；
+    按完成顺序产出 (item, value, error)。消费方停止迭代时不再提交新任务。
+    """
+    it = iter(items)
+    pending = {}
+
+    def submit_next() -> bool:
+        for item in it:
+            # 每个任务带上提交方上下文的副本，调用方的截止时间/取消（CallScope）随之传到池线程
+            pending[_fanout_pool.submit(contextvars.copy_context().run, fn, item)] = item
+            return True
+        return False
+
+    for _ in range(max(limit, 1)):
+        if not submit_next():
+            break
+    while pending:
+        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for fut in done:
+            item = pending.pop(fut)
+            err = fut.exception()
+            yield item, (None if err is not None else fut.result()), err
+            submit_next()
+
 
 class DianFeiServiceImpl(dianfei_pb2_grpc.DianFeiServiceServicer):
-    def QueryCurrentElectricity(self, request, context):
+    def __init__(self, cache: ResultCache = None):
+        # SWR 模式下的后台刷新也放在共享线程池里，数量受 FANOUT_WORKERS 限制
+        # 单飞的 leader 因自己的调用方取消而放弃时，其余等待者重新发起，不受牵连；
+        # 等待者自己的调用方取消/超时时立即离开，不再占着工作线程等 leader；
+        # 内存未命中时先查本地读数库，重启后仍新鲜的读数不必再打上游
+        self.cache = cache if cache is not None else ResultCache(refresh_pool=_fanout_pool,
+                                                                 abandon_errors=(UpstreamCancelled,),
+                                                                 persisted=_persisted_reading,
+                                                                 wait_check=check_current_scope)
+
+    def _query_entry(self, payload: dict):
+        """返回 (value, fetched_at, source)。"""
         # 把 proto 入参组装为你原函数需要的 JSON 字符串
-        payload = {
-            "campus": request.campus,
-            "building": request.building,
-            "room": request.room,
-            "feeitemid": request.feeitemid,
-            "type": request.type,
-            "level": request.level,
-        }
         payload_json = json.dumps(payload, ensure_ascii=False)
 
-        # 调你的业务，拿 float
-        val = float(query_current_electricity(payload_json))
+        # 调你的业务，拿 float；同一房间的并发请求只打一次上游，真正打到上游的结果记入本地读数
+        return self.cache.get_or_load_entry(
+            cache_key(payload),
+            lambda: _record_reading(payload, float(get_guard().call(lambda: query_current_electricity(payload_json)))),
+        )
+
+    def _query(self, payload: dict) -> float:
+        return self._query_entry(payload)[0]
+
+    def QueryCurrentElectricity(self, request, context):
+        try:
+            payload = _request_to_payload(request)
+        except (RoomNotFound, AmbiguousRoom) as e:
+            _abort_on_bad_room(context, e)
+        try:
+            with _upstream_scope(context):
+                val, fetched_at, source = self._query_entry(payload)
+        except UpstreamCancelled as e:
+            _abort_cancelled(context, e)
+        except CircuitOpenError as e:
+            # 上游熔断：有足够新的旧值就返回旧值（尾部元数据标记），否则立即失败，不占线程等超时
+            entry = _stale_entry(self.cache, payload)
+            if entry is None:
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            (val, fetched_at), source = entry, SOURCE_STALE
+            _mark_stale(context, fetched_at)
 
         # 返回 Protobuf 消息，而不是 JSON 字节
-        return dianfei_pb2.QueryReply(value=val)
+        return _query_reply(val, fetched_at, source)
+
+    def QueryElectricityBatch(self, request, context):
+        items = list(request.items)
+        if len(items) > BATCH_MAX_ITEMS:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"单批最多 {BATCH_MAX_ITEMS} 个房间，实际 {len(items)}")
+
+        results = [None] * len(items)
+        with _upstream_scope(context):
+            self._batch_results(items, results, context)
+        return dianfei_pb2.BatchQueryReply(results=[r for r in results if r is not None])
+
+    def _batch_results(self, items, results, context):
+        for idx, val, err in _fan_out(
+            range(len(items)),
+            lambda i: self._query(_request_to_payload(items[i])),
+            BATCH_CONCURRENCY,
+        ):
+            if err is None:
+                results[idx] = dianfei_pb2.RoomResult(request=items[idx], ok=True, value=val)
+            else:
+                logger.warning(f"批量查询中单个房间失败：room={items[idx].room}，{_error_text(err)}")
+                results[idx] = dianfei_pb2.RoomResult(request=items[idx], ok=False, error=_error_text(err))
+            if not context.is_active():
+                logger.info("批量查询调用方已取消，停止提交剩余房间")
+                break
+
+    def SweepRooms(self, request, context):
+        limit = request.concurrency or SWEEP_CONCURRENCY
+        limit = max(1, min(limit, SWEEP_MAX_CONCURRENCY))
+        logger.info(f"开始扫描：campus={request.campus!r} building={request.building!r} "
+                    f"prefix={request.name_prefix!r} concurrency={limit}")
+
+        # _fan_out 只在上一条结果被 yield（即 gRPC 写出）后才补充新任务，
+        # 调用方读得慢时在途数量不会超过 limit，内存占用与扫描规模无关
+        with _upstream_scope(context):
+            yield from self._sweep(request, context, limit)
+
+    def _sweep(self, request, context, limit: int):
+        sent = failed = 0
+        for room, val, err in _fan_out(_iter_sweep_rooms(request), lambda r: self._query(r.payload()), limit):
+            req = dianfei_pb2.QueryRequest(name=room.name, **room.payload())
+            if err is None:
+                yield dianfei_pb2.RoomResult(request=req, name=room.name, ok=True, value=val)
+            else:
+                failed += 1
+                yield dianfei_pb2.RoomResult(request=req, name=room.name, ok=False, error=_error_text(err))
+            sent += 1
+            if not context.is_active():
+                logger.info(f"扫描调用方已断开，已返回 {sent} 间")
+                return
+        logger.info(f"扫描完成：共 {sent} 间，失败 {failed} 间")
+
+    def _local_query(self, build_reply, request, context):
+        if get_store() is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "未启用本地读数存储（DIANFEI_READINGS_DB 为空）")
+        try:
+            return build_reply(request)
+        except (RoomNotFound, AmbiguousRoom) as e:
+            _abort_on_bad_room(context, e)
+
+    def QueryHistory(self, request, context):
+        return self._local_query(_history_reply, request, context)
+
+    def QueryConsumption(self, request, context):
+        return self._local_query(_consumption_reply, request, context)
+
+
+class _ProgressTracker:
+    """
+    记录正在执行的 handler 各自开始于何时（流式 RPC 按产出每一条消息计），
+    oldest_age() 反映的是工作线程有没有卡住，与线程池里排队的请求多少无关。
+    """
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._running: Dict[int, float] = {}
 
-def serve(host: str = "0.0.0.0", port: int = 50051):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
-    dianfei_pb2_grpc.add_DianFeiServiceServicer_to_server(DianFeiServiceImpl(), server)
+    @contextmanager
+    def track(self):
+        token = next(self._ids)
+        with self._lock:
+            self._running[token] = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._running[token]
+
+    def oldest_age(self) -> float:
+        with self._lock:
+            oldest = min(self._running.values(), default=None)
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+
+_progress = _ProgressTracker()
+
+
+def _run_if_progressing(fn):
+    """多进程模式的健康心跳：没有 handler 卡住超过 RPC_STUCK_TIMEOUT 秒时执行 fn（写心跳）。"""
+    if _progress.oldest_age() < RPC_STUCK_TIMEOUT:
+        fn()
+
+
+class _MetricsInterceptor(grpc.ServerInterceptor):
+    """
+    按方法统计 RPC 次数、在途数和处理耗时（从 handler 开始执行算起，不含线程池排队），
+    并在 _progress 中登记 handler 的执行进度。
+    """
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit("/", 1)[-1]
+
+        if handler.unary_unary is not None:
+            inner = handler.unary_unary
+
+            def unary_unary(request, context):
+                with RPC_INFLIGHT.track_inprogress(method=method), RPC_SECONDS.time(method=method), \
+                        _progress.track():
+                    try:
+                        reply = inner(request, context)
+                    except Exception:
+                        RPC_TOTAL.inc(method=method, code="error")
+                        raise
+                RPC_TOTAL.inc(method=method, code="ok")
+                return reply
+
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary, handler.request_deserializer, handler.response_serializer)
+
+        if handler.unary_stream is not None:
+            inner = handler.unary_stream
+
+            def unary_stream(request, context):
+                with RPC_INFLIGHT.track_inprogress(method=method), RPC_SECONDS.time(method=method):
+                    try:
+                        yield from _tracked_steps(inner(request, context))
+                    except Exception:
+                        RPC_TOTAL.inc(method=method, code="error")
+                        raise
+                RPC_TOTAL.inc(method=method, code="ok")
+
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream, handler.request_deserializer, handler.response_serializer)
+        return handler
+
+
+def _tracked_steps(gen):
+    """逐条转发流式 handler 的输出，每产出一条消息之前的计算登记为一次进度。"""
+    try:
+        while True:
+            with _progress.track():
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        gen.close()
+
+
+def _log_stats_forever(servicer: DianFeiServiceImpl, interval: float):
+    while True:
+        time.sleep(interval)
+        hedge = f" hedge={get_hedger().stats()}" if HEDGE_ENABLED else ""
+        logger.info(f"[stats] cache={servicer.cache.stats()} upstream={get_client().stats()} "
+                    f"breaker={get_guard().stats()}{hedge}")
+
+
+def serve(host: str = "0.0.0.0", port: int = 50051, metrics_port: int = METRICS_PORT,
+          reuseport: bool = False, on_started=None, shard: Tuple[int, int] = (0, 1)):
+    executor = futures.ThreadPoolExecutor(max_workers=8)
+    server = grpc.server(executor, interceptors=(_MetricsInterceptor(),), options=server_options(reuseport))
+    servicer = DianFeiServiceImpl()
+    dianfei_pb2_grpc.add_DianFeiServiceServicer_to_server(servicer, server)
     server.add_insecure_port(f"{host}:{port}")
-    print(f"[gRPC] DianFeiService listening on {host}:{port}")
+
+    POOL_QUEUE_DEPTH.set_function(executor._work_queue.qsize, pool="grpc")
+    POOL_QUEUE_DEPTH.set_function(_fanout_pool._work_queue.qsize, pool="fanout")
+    register_cache_metrics(servicer.cache)
+    register_store_metrics()
+    logger.info(f"房间目录已加载：{get_catalog().stats()}")
+    register_stats(UPSTREAM_POOL, lambda: get_client().stats(), ("requests", "connects", "reused", "errors"))
+    # 启动预热：与接收流量并行进行；/ready 在预热达到比例前返回 503
+    warmup = make_warmup(servicer._query, servicer.cache, shard=shard)
+    if warmup is not None:
+        register_stats(WARMUP, warmup.stats, ("rooms", "warmed", "failed", "ready"))
+    routes = {"/ready": warmup.ready_route if warmup is not None else _ready_always}
+    if start_metrics_server(host, metrics_port, routes=routes) is not None:
+        print(f"[metrics] http://{host}:{metrics_port}/metrics")
+
+    print(f"[gRPC] DianFeiService listening on {host}:{port} (pid={os.getpid()})")
     server.start()
+    signal.signal(signal.SIGTERM, lambda *_: server.stop(SHUTDOWN_GRACE))
+    if warmup is not None:
+        warmup.start()
+    if on_started is not None:
+        # supervisor 借它做健康心跳：只看有没有 handler 卡住，不经过线程池排队（繁忙但在推进的进程不算不健康）
+        on_started(_run_if_progressing)
+    if STATS_INTERVAL > 0:
+        threading.Thread(target=_log_stats_forever, args=(servicer, STATS_INTERVAL), daemon=True).start()
     server.wait_for_termination()
 
+def main():
+    parser = argparse.ArgumentParser(description="DianFeiService gRPC 服务")
+    parser.add_argument("--mode", choices=("thread", "aio"), default=os.getenv("DIANFEI_SERVER_MODE", "thread"),
+                        help="thread：线程池 + requests（默认）；aio：grpc.aio + aiohttp")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="/metrics 端口，0 表示关闭")
+    parser.add_argument("--workers", default=os.getenv("DIANFEI_WORKERS", "1"),
+                        help="工作进程数，>1 时以 SO_REUSEPORT 共用端口；0 或 auto 表示按 CPU 数")
+    args = parser.parse_args()
+
+    from supervisor import resolve_workers, serve_multi
+    workers = resolve_workers(args.workers)
+    if workers > 1:
+        serve_multi(workers, args.mode, args.host, args.port, args.metrics_port)
+    elif args.mode == "aio":
+        import asyncio
+        from aio_server import serve_aio
+        asyncio.run(serve_aio(args.host, args.port, args.metrics_port))
+    else:
+        serve(args.host, args.port, args.metrics_port)
+
 if __name__ == "__main__":
-    serve()
+    main()
@@ -0,0 +1,145 @@
+# service_common.py —— 线程版（server.py）与 grpc.aio 版（aio_server.py）共用的配置与辅助函数
+# 这里只放无副作用的定义：导入本模块不会创建线程池、不会启动任何后台线程。
+import os
+import time
+
+import grpc
+
+import dianfei_pb2
+
+from http_client import UpstreamCancelled
+from result_cache import ResultCache, cache_key, SOURCE_LIVE, SOURCE_CACHE, SOURCE_STALE
+from room_catalog import RoomNotFound, get_catalog
+from readings_store import RATE_WINDOW_HOURS, get_store
+from metrics import CACHE_EVENTS, READINGS_STORE, BREAKER_EVENTS, register_stats
+
+# 统计日志的输出间隔（秒），<=0 关闭
+STATS_INTERVAL = float(os.getenv("DIANFEI_STATS_INTERVAL", "60"))
+# 批量查询：单个批次同时在途的上游请求数上限、单批最多房间数
+BATCH_CONCURRENCY = int(os.getenv("DIANFEI_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("DIANFEI_BATCH_MAX_ITEMS", "1000"))
+# 扫描：默认并发与允许调用方请求的最大并发
+SWEEP_CONCURRENCY = int(os.getenv("DIANFEI_SWEEP_CONCURRENCY", "8"))
+SWEEP_MAX_CONCURRENCY = int(os.getenv("DIANFEI_SWEEP_MAX_CONCURRENCY", "32"))
+# 上游熔断时，缓存里不超过这么多秒的旧值仍可返回（带 x-dianfei-source=stale 尾部元数据）；<=0 表示直接失败
+STALE_MAX_AGE = float(os.getenv("DIANFEI_STALE_MAX_AGE", "86400"))
+# 收到 SIGTERM 后停止接新请求，最多再等这么多秒让在途请求处理完
+SHUTDOWN_GRACE = float(os.getenv("DIANFEI_SHUTDOWN_GRACE", "10"))
+# 某个 handler 执行（流式 RPC 为产出下一条消息）超过这么多秒视为工作线程卡死，多进程模式下健康心跳随之停更；
+# 应大于一次上游调用可能的最长耗时（建连 + 读超时，含重试）
+RPC_STUCK_TIMEOUT = float(os.getenv("DIANFEI_RPC_STUCK_TIMEOUT", "120"))
+
+
+def server_options(reuseport: bool):
+    """多进程模式下各工作进程共用同一端口（SO_REUSEPORT）；单进程时关闭，避免误起第二个实例也能绑定成功。"""
+    return [("grpc.so_reuseport", 1 if reuseport else 0)]
+
+
+def _iter_sweep_rooms(request):
+    return get_catalog().filter(request.campus, request.building, request.name_prefix)
+
+
+_PAYLOAD_FIELDS = ("campus", "building", "room", "feeitemid", "type", "level")
+
+
+def _request_to_payload(request) -> dict:
+    """
+    proto 入参 -> 查询字段。room 为空但给了 name 时，按房间目录解析出 room，
+    并补齐未填的 feeitemid/type/level；解析失败抛 RoomNotFound / AmbiguousRoom。
+    """
+    payload = {k: getattr(request, k) for k in _PAYLOAD_FIELDS}
+    if not request.room and request.name:
+        room = get_catalog().resolve_name(request.name, request.campus, request.building)
+        for k, v in room.payload().items():
+            if not payload[k] or k == "room":
+                payload[k] = v
+    return payload
+
+
+def _abort_on_bad_room(context, e: Exception):
+    code = grpc.StatusCode.NOT_FOUND if isinstance(e, RoomNotFound) else grpc.StatusCode.INVALID_ARGUMENT
+    return context.abort(code, str(e))
+
+
+def _abort_cancelled(context, e: UpstreamCancelled):
+    code = grpc.StatusCode.DEADLINE_EXCEEDED if e.reason == "deadline" else grpc.StatusCode.CANCELLED
+    return context.abort(code, str(e))
+
+
+def _error_text(e: BaseException) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+def _stale_entry(cache: ResultCache, payload: dict):
+    """熔断时可用的旧值 (value, fetched_at)；没有或太旧时返回 None。"""
+    entry = cache.peek(cache_key(payload))
+    if entry is None or STALE_MAX_AGE <= 0 or time.time() - entry[1] > STALE_MAX_AGE:
+        return None
+    BREAKER_EVENTS.inc(event="stale_served")
+    return entry
+
+
+def _mark_stale(context, fetched_at: float):
+    context.set_trailing_metadata((
+        ("x-dianfei-source", "stale"),
+        ("x-dianfei-fetched-at-ms", str(int(fetched_at * 1000))),
+    ))
+
+
+_REPLY_SOURCE = {
+    SOURCE_LIVE: dianfei_pb2.QueryReply.LIVE,
+    SOURCE_CACHE: dianfei_pb2.QueryReply.CACHE,
+    SOURCE_STALE: dianfei_pb2.QueryReply.STALE,
+}
+
+
+def _query_reply(value: float, fetched_at: float, source: str) -> dianfei_pb2.QueryReply:
+    return dianfei_pb2.QueryReply(value=value, fetched_at_ms=int(fetched_at * 1000), source=_REPLY_SOURCE[source])
+
+
+def _record_reading(payload: dict, value: float) -> float:
+    """上游成功返回的读数追加进本地存储（非阻塞），原样返回 value。"""
+    store = get_store()
+    if store is not None:
+        store.record((payload["campus"], payload["building"], payload["room"]), value,
+                     item=(payload["feeitemid"], payload["type"], payload["level"]))
+    return value
+
+
+def _history_reply(request) -> dianfei_pb2.HistoryReply:
+    key = cache_key(_request_to_payload(request.room))
+    rows = get_store().history(key[:3], request.since_ms, request.until_ms, request.limit, item=key[3:6])
+    return dianfei_pb2.HistoryReply(readings=[dianfei_pb2.Reading(ts_ms=t, value=v) for t, v in rows])
+
+
+def _consumption_reply(request) -> dianfei_pb2.ConsumptionReply:
+    key = cache_key(_request_to_payload(request.room))
+    rate = get_store().consumption_rate(key[:3], request.window_hours or RATE_WINDOW_HOURS, item=key[3:6])
+    return dianfei_pb2.ConsumptionReply(**rate)
+
+
+def _persisted_reading(key):
+    """
+    缓存键 -> 本地读数库中同一房间、同一计费项（feeitemid/type/level）最近一次读数 (value, fetched_at)；
+    重启后内存缓存为空时由 ResultCache / AsyncResultCache 按需读取。
+    """
+    store = get_store()
+    row = store.latest(key[:3], item=key[3:6]) if store is not None else None
+    return None if row is None else (row[1], row[0] / 1000)
+
+
+def _ready_always():
+    """未开启启动预热时的 /ready：服务启动即就绪。"""
+    return 200, "ok\n"
+
+
+def register_store_metrics():
+    store = get_store()
+    if store is not None:
+        register_stats(READINGS_STORE, store.stats, ("written", "batches", "dropped", "write_errors", "queued"))
+
+
+def register_cache_metrics(cache: ResultCache):
+    register_stats(CACHE_EVENTS, cache.stats,
+                   ("size", "hits", "misses", "coalesced", "errors", "evictions", "inflight",
+                    "stale_served", "refreshes", "persisted_hits"))
@@ -0,0 +1,223 @@
+# supervisor.py —— 多进程模式：同一端口（SO_REUSEPORT）起 N 个 gRPC 工作进程，由内核分摊连接
+#
+# - 工作进程用 spawn 启动（不 fork 已初始化 gRPC 的进程），各自有独立的 GIL、缓存和上游连接池；
+# - 健康检查：工作进程在 server.start() 之后每 WORKER_HEARTBEAT 秒经服务提供的探针写一次心跳时间戳：
+#   线程模式下只要没有 handler 卡住超过 RPC_STUCK_TIMEOUT 秒就写（线程池排队再长也照写，繁忙不等于不健康），
+#   aio 模式下由事件循环执行写心跳（事件循环被阻塞时停更）；
+#   启动超过 WORKER_START_TIMEOUT 秒仍无心跳、或心跳超过 WORKER_HEALTH_TIMEOUT 秒未更新的进程会被杀掉重启；
+# - 进程退出（崩溃）后自动重启；刚启动就退出的进程按指数退避重启，避免崩溃循环打满 CPU；
+# - SIGTERM/SIGINT：转发 SIGTERM 给所有工作进程，它们停止接新请求并在 SHUTDOWN_GRACE 秒内处理完在途请求，
+#   超时仍未退出的进程被 SIGKILL。
+# 日志：工作进程的记录经 multiprocessing 队列交给 supervisor，由它统一写 GetDianfei.log（只有一个进程滚动该文件）。
+# /metrics：第 i 个工作进程监听 metrics_port + i（metrics_port<=0 时都不开）。
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import List, Optional
+
+from dianfei_core import listen_log_queue, log_to_queue, logger
+from service_common import SHUTDOWN_GRACE
+
+WORKER_HEARTBEAT = float(os.getenv("DIANFEI_WORKER_HEARTBEAT", "2"))
+WORKER_HEALTH_TIMEOUT = float(os.getenv("DIANFEI_WORKER_HEALTH_TIMEOUT", "30"))
+WORKER_START_TIMEOUT = float(os.getenv("DIANFEI_WORKER_START_TIMEOUT", "60"))
+# 重启退避：运行不足 WORKER_MIN_UPTIME 秒就退出视为崩溃循环，下次重启前等待翻倍（上限 WORKER_RESTART_MAX_DELAY）
+WORKER_MIN_UPTIME = float(os.getenv("DIANFEI_WORKER_MIN_UPTIME", "10"))
+WORKER_RESTART_MAX_DELAY = float(os.getenv("DIANFEI_WORKER_RESTART_MAX_DELAY", "30"))
+
+
+def cpu_count() -> int:
+    """容器内可用的 CPU 数（受 cpuset 限制时以 sched_getaffinity 为准）。"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return max(os.cpu_count() or 1, 1)
+
+
+def resolve_workers(value) -> int:
+    """把 --workers / DIANFEI_WORKERS 的值转成进程数；0 或 auto 取 CPU 数。"""
+    if str(value).strip().lower() in ("", "0", "auto"):
+        return cpu_count()
+    return max(int(value), 1)
+
+
+def _heartbeat_forever(beat, interval: float, run_in_server):
+    """
+    每 interval 秒把写心跳交给服务提供的探针 run_in_server（它判断服务仍在推进时才执行）；
+    上一次交出的还没被执行就不再交，探针异步执行（aio）时也不会越积越长。
+    """
+    touched = threading.Event()
+    touched.set()
+
+    def touch():
+        beat.value = time.time()
+        touched.set()
+
+    while True:
+        if touched.is_set():
+            touched.clear()
+            try:
+                run_in_server(touch)
+            except RuntimeError:
+                return  # 服务已关闭（执行器 shutdown / 事件循环已关闭）
+        time.sleep(interval)
+
+
+def _worker_main(index: int, workers: int, mode: str, host: str, port: int, metrics_port: int, beat,
+                 heartbeat: float, log_queue):
+    """工作进程入口（spawn 后在新解释器中执行）。"""
+    log_to_queue(log_queue)
+
+    def on_started(run_in_server):
+        threading.Thread(target=_heartbeat_forever, args=(beat, heartbeat, run_in_server),
+                         name="worker-heartbeat", daemon=True).start()
+
+    worker_metrics_port = metrics_port + index if metrics_port > 0 else 0
+    if mode == "aio":
+        import asyncio
+        from aio_server import serve_aio
+        asyncio.run(serve_aio(host, port, worker_metrics_port, reuseport=True, on_started=on_started,
+                              shard=(index, workers)))
+    else:
+        from server import serve
+        serve(host, port, worker_metrics_port, reuseport=True, on_started=on_started, shard=(index, workers))
+
+
+class _Worker:
+    __slots__ = ("index", "process", "beat", "started_at", "restarts", "next_start")
+
+    def __init__(self, index: int, beat):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.beat = beat
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class Supervisor:
+    def __init__(self, workers: int, mode: str = "thread", host: str = "0.0.0.0", port: int = 50051,
+                 metrics_port: int = 0, heartbeat: float = WORKER_HEARTBEAT,
+                 health_timeout: float = WORKER_HEALTH_TIMEOUT, start_timeout: float = WORKER_START_TIMEOUT,
+                 grace: float = SHUTDOWN_GRACE):
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.metrics_port = metrics_port
+        self.heartbeat = heartbeat
+        self.health_timeout = health_timeout
+        self.start_timeout = start_timeout
+        self.grace = grace
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: List[_Worker] = [_Worker(i, self._ctx.Value("d", 0.0, lock=False)) for i in range(workers)]
+        self._log_queue = self._ctx.Queue()
+        self._log_listener = None
+        self._stop = threading.Event()
+        self.crashes = self.unhealthy = 0
+
+    def _start(self, w: _Worker):
+        w.beat.value = 0.0
+        w.process = self._ctx.Process(
+            target=_worker_main,
+            args=(w.index, len(self._workers), self.mode, self.host, self.port, self.metrics_port, w.beat, self.heartbeat,
+                  self._log_queue),
+            name=f"dianfei-worker-{w.index}",
+            daemon=False,
+        )
+        w.process.start()
+        w.started_at = time.time()
+        logger.info(f"[supervisor] 工作进程 #{w.index} 已启动 pid={w.process.pid}")
+
+    def _schedule_restart(self, w: _Worker, now: float):
+        uptime = now - w.started_at
+        w.restarts += 1
+        if uptime < WORKER_MIN_UPTIME:
+            delay = min(2 ** min(w.restarts - 1, 10), WORKER_RESTART_MAX_DELAY)
+        else:
+            w.restarts = 0
+            delay = 0.0
+        w.next_start = now + delay
+        w.process = None
+        if delay:
+            logger.warning(f"[supervisor] 工作进程 #{w.index} 运行 {uptime:.1f}s 即退出，{delay:.0f}s 后重启")
+
+    def _unhealthy(self, w: _Worker, now: float) -> Optional[str]:
+        beat = w.beat.value
+        if beat <= 0:
+            if now - w.started_at > self.start_timeout:
+                return f"启动 {self.start_timeout:.0f}s 仍未就绪"
+            return None
+        if now - beat > self.health_timeout:
+            return f"心跳已 {now - beat:.0f}s 未更新"
+        return None
+
+    def check_once(self):
+        """检查一轮：启动/重启该起的进程，回收退出的进程，杀掉失去心跳的进程。"""
+        now = time.time()
+        for w in self._workers:
+            p = w.process
+            if p is None:
+                if now >= w.next_start:
+                    self._start(w)
+                continue
+            if not p.is_alive():
+                self.crashes += 1
+                logger.error(f"[supervisor] 工作进程 #{w.index} pid={p.pid} 退出，exitcode={p.exitcode}")
+                p.join()
+                self._schedule_restart(w, now)
+                continue
+            reason = self._unhealthy(w, now)
+            if reason is not None:
+                self.unhealthy += 1
+                logger.error(f"[supervisor] 工作进程 #{w.index} pid={p.pid} {reason}，强制重启")
+                p.kill()
+                p.join()
+                self._schedule_restart(w, now)
+
+    def run(self):
+        logger.info(f"[supervisor] 启动 {len(self._workers)} 个工作进程（mode={self.mode}），"
+                    f"共享端口 {self.host}:{self.port}")
+        self._log_listener = listen_log_queue(self._log_queue)
+        while not self._stop.is_set():
+            self.check_once()
+            self._stop.wait(min(self.heartbeat, 1.0))
+        self._shutdown()
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def _shutdown(self):
+        alive = [w.process for w in self._workers if w.process is not None and w.process.is_alive()]
+        logger.info(f"[supervisor] 停止中：通知 {len(alive)} 个工作进程优雅退出（grace={self.grace}s）")
+        for p in alive:
+            p.terminate()
+        deadline = time.time() + self.grace + 2
+        for p in alive:
+            p.join(max(deadline - time.time(), 0))
+            if p.is_alive():
+                logger.warning(f"[supervisor] pid={p.pid} 未在期限内退出，SIGKILL")
+                p.kill()
+                p.join()
+        if self._log_listener is not None:
+            self._log_listener.stop()  # 写完工作进程退出前发来的剩余记录
+            self._log_listener = None
+
+    def stats(self):
+        now = time.time()
+        return {
+            "workers": len(self._workers),
+            "alive": sum(1 for w in self._workers if w.process is not None and w.process.is_alive()),
+            "crashes": self.crashes,
+            "unhealthy": self.unhealthy,
+            "heartbeat_age": [round(now - w.beat.value, 1) if w.beat.value > 0 else None for w in self._workers],
+        }
+
+
+def serve_multi(workers: int, mode: str = "thread", host: str = "0.0.0.0", port: int = 50051,
+                metrics_port: int = 0):
+    """前台运行 supervisor，直到收到 SIGTERM/SIGINT。"""
+    sup = Supervisor(workers, mode, host, port, metrics_port)
+    signal.signal(signal.SIGTERM, sup.stop)
+    signal.signal(signal.SIGINT, sup.stop)
+    sup.run()
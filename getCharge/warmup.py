@@ -0,0 +1,182 @@
+# warmup.py —— 启动预热：serve() / serve_aio() 开始接流量的同时，限速预取一批房间的电量填进结果缓存
+#
+# 容器重启后缓存是空的，第一波查询全部打到上游、堆在 8 个工作线程上。开启 DIANFEI_WARMUP 后，
+# 后台按 WARMUP_RPS 的全局速率、WARMUP_CONCURRENCY 路并发预取 WARMUP_FILE（默认 roomInfo.json）中的房间；
+# 预取走与正常查询相同的路径（缓存 + 单飞 + 熔断 + 读数落库），与真实请求撞上同一房间时只打一次上游。
+# 就绪：缓存中仍在 TTL 内的预热房间比例达到 WARMUP_READY_FRACTION（或预热超过 WARMUP_TIMEOUT 秒、或清单全部试过）后，
+# /metrics 端口上的 /ready 返回 200。清单预热时间长于缓存 TTL 时，先预热的房间在结束前就已过期，启动时会告警。
+# 多进程模式（--workers N）下第 i 个工作进程只预热清单中下标 ≡ i (mod N) 的房间：总上游压力与单进程相同，
+# 其它进程的缓存未命中时由本地读数库（readings_store，各进程共用）兜底。
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dianfei_core import logger
+from rate_limit import TokenBucket
+from result_cache import ResultCache, cache_key
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+WARMUP_ENABLED = os.getenv("DIANFEI_WARMUP", "0") not in ("0", "false", "no")
+# 预热的房间清单：与 roomInfo.json 相同格式的 JSON 数组（每项含 campus/building/room/feeitemid/type/level）
+WARMUP_FILE = os.getenv("DIANFEI_WARMUP_FILE", os.path.join(BASEDIR, "roomInfo.json"))
+WARMUP_RPS = float(os.getenv("DIANFEI_WARMUP_RPS", "5"))
+WARMUP_CONCURRENCY = int(os.getenv("DIANFEI_WARMUP_CONCURRENCY", "4"))
+WARMUP_READY_FRACTION = float(os.getenv("DIANFEI_WARMUP_READY_FRACTION", "0.9"))
+# 上游长时间不可用时也不能永远不就绪：超过这么多秒后无论预热比例都报告就绪
+WARMUP_TIMEOUT = float(os.getenv("DIANFEI_WARMUP_TIMEOUT", "120"))
+
+_PAYLOAD_FIELDS = ("campus", "building", "room", "feeitemid", "type", "level")
+_FRESH_CHECK_INTERVAL = 1.0  # 秒；统计缓存新鲜度要遍历整个清单，两次之间至少间隔这么久
+
+
+def load_rooms(path: str = WARMUP_FILE) -> List[dict]:
+    """读取预热清单；文件不存在或格式不对时返回空列表（不预热，直接就绪）。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"[warmup] 读取预热清单失败，跳过预热：{path}，{type(e).__name__}: {e}")
+        return []
+    rooms, seen = [], set()
+    for r in entries if isinstance(entries, list) else []:
+        payload = {k: str(r.get(k, "")) for k in _PAYLOAD_FIELDS}
+        key = tuple(payload.values())
+        if payload["room"] and key not in seen:
+            seen.add(key)
+            rooms.append(payload)
+    return rooms
+
+
+class Warmup:
+    def __init__(self, rooms: List[dict], load: Callable[[dict], float], cache: Optional[ResultCache] = None,
+                 rps: float = WARMUP_RPS, concurrency: int = WARMUP_CONCURRENCY,
+                 ready_fraction: float = WARMUP_READY_FRACTION, timeout: float = WARMUP_TIMEOUT):
+        self.rooms = rooms
+        self.load = load
+        # load 写入的结果缓存；为 None 或未开启缓存时按成功次数判断就绪
+        self.cache = cache if cache is not None and cache.ttl > 0 else None
+        self.bucket = TokenBucket(rps, burst=max(concurrency, 1))
+        self.concurrency = max(concurrency, 1)
+        self.ready_fraction = min(max(ready_fraction, 0.0), 1.0)
+        self.timeout = timeout
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.started_at = 0.0
+        self.warmed = self.failed = 0
+        self.finished_at = 0.0
+        self._checked_at = 0.0
+
+    def start(self):
+        self.started_at = time.monotonic()
+        if self._warm_enough(0):
+            self._mark_ready("无需预热")
+            return
+        expected = len(self.rooms) / self.bucket.rate if self.bucket.rate > 0 else 0.0
+        if self.cache is not None and expected > self.cache.ttl:
+            logger.warning(f"[warmup] 按 rps={self.bucket.rate} 预热 {len(self.rooms)} 个房间约需 {expected:.1f}s，"
+                           f"超过缓存 TTL {self.cache.ttl:g}s：先预热的房间在结束前就会过期，"
+                           f"请调大 DIANFEI_WARMUP_RPS 或精简预热清单")
+        for room in self.rooms:
+            self._queue.put(room)
+        for i in range(min(self.concurrency, len(self.rooms))):
+            threading.Thread(target=self._work, name=f"warmup-{i}", daemon=True).start()
+        if self.timeout > 0:
+            timer = threading.Timer(self.timeout, self._mark_ready, args=(f"预热超过 {self.timeout:.0f}s",))
+            timer.daemon = True
+            timer.start()
+        logger.info(f"[warmup] 开始预热 {len(self.rooms)} 个房间（rps={self.bucket.rate}, "
+                    f"concurrency={self.concurrency}, ready_fraction={self.ready_fraction}）")
+
+    def _warm_enough(self, warmed: int) -> bool:
+        return warmed >= self.ready_fraction * len(self.rooms)
+
+    def fresh_count(self) -> int:
+        """清单中当前仍在缓存 TTL 内的房间数（无缓存时为成功预热数）。"""
+        if self.cache is None:
+            with self._lock:
+                return self.warmed
+        return sum(1 for room in self.rooms if self.cache.is_fresh(cache_key(room)))
+
+    def _check_ready(self, warmed: int):
+        if self._ready.is_set() or not self._warm_enough(warmed):
+            return
+        if self.cache is None:
+            self._mark_ready(f"已预热 {warmed}/{len(self.rooms)}")
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < _FRESH_CHECK_INTERVAL:
+                return
+            self._checked_at = now
+        fresh = self.fresh_count()
+        if self._warm_enough(fresh):
+            self._mark_ready(f"缓存中 {fresh}/{len(self.rooms)} 个房间在 TTL 内")
+
+    def _work(self):
+        while True:
+            try:
+                room = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.bucket.acquire()
+            try:
+                self.load(room)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.warning(f"[warmup] 预热失败：room={room['room']}，{type(e).__name__}: {e}")
+            else:
+                with self._lock:
+                    self.warmed += 1
+                    warmed = self.warmed
+                self._check_ready(warmed)
+            with self._lock:
+                done = self.warmed + self.failed == len(self.rooms)
+                if done:
+                    self.finished_at = time.monotonic()
+            if done:
+                # 全部试过仍未达到比例时不再等超时：剩下的只能靠正常请求来填
+                self._mark_ready(f"预热结束，成功 {self.warmed}/{len(self.rooms)}")
+                logger.info(f"[warmup] 预热结束：{self.stats()}")
+
+    def _mark_ready(self, reason: str):
+        if self._ready.is_set():
+            return
+        self._ready.set()
+        logger.info(f"[warmup] 就绪（{reason}），用时 {time.monotonic() - self.started_at:.1f}s")
+
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            end = self.finished_at or time.monotonic()
+            return {
+                "rooms": len(self.rooms),
+                "warmed": self.warmed,
+                "failed": self.failed,
+                "ready": int(self._ready.is_set()),
+                "seconds": round(end - self.started_at, 1) if self.started_at else 0.0,
+            }
+
+    def ready_route(self) -> Tuple[int, str]:
+        """/ready：就绪返回 200，否则 503；正文为预热统计与当前仍新鲜的房间数。"""
+        body = dict(self.stats(), fresh=self.fresh_count())
+        return (200 if self.ready() else 503), json.dumps(body, ensure_ascii=False) + "\n"
+
+
+def make_warmup(load: Callable[[dict], float], cache: Optional[ResultCache] = None, path: str = WARMUP_FILE,
+                shard: Tuple[int, int] = (0, 1)) -> Optional[Warmup]:
+    """
+    WARMUP_ENABLED 时读取清单并返回 Warmup（由调用方在 gRPC 服务启动后 start()）；未开启时返回 None。
+    shard=(i, n)：多进程模式下第 i 个（共 n 个）工作进程只预热自己那一份，全局速率 WARMUP_RPS 也按 n 均分。
+    """
+    if not WARMUP_ENABLED:
+        return None
+    index, count = shard
+    count = max(count, 1)
+    return Warmup(load_rooms(path)[index % count::count], load, cache, rps=WARMUP_RPS / count)